@@ -0,0 +1,331 @@
+import asyncio
+import logging
+import os
+import time
+
+from backup_github import trace
+from backup_github.archive import create_writer
+from backup_github.github import GithubAPI, endpoint
+from backup_github.metrics import http_pages, http_retries, items_written
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+async def iterate(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def run_concurrent(func, items, limit):
+    # Tasks are created lazily so a streamed collection is never fully
+    # buffered; the first error is re-raised once running tasks finish
+    errors = []
+    pending = set()
+    async for item in iterate(items):
+        if len(pending) >= limit:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            errors += [task.exception() for task in done if task.exception()]
+            if errors:
+                break
+        pending.add(asyncio.ensure_future(func(item)))
+    if pending:
+        done, _ = await asyncio.wait(pending)
+        errors += [task.exception() for task in done if task.exception()]
+    if errors:
+        raise errors[0]
+
+
+class AsyncGithubAPI(GithubAPI):
+    def __init__(self, *args, concurrency=100, pool_size=4, transport=None, **kwargs):
+        if httpx is None:
+            raise ImportError(
+                "httpx is required for the async client, install backup-github-org[async]"
+            )
+        super().__init__(*args, concurrency=concurrency, pool_size=pool_size, **kwargs)
+        self.transport = transport
+        self.client = None
+        self.async_semaphore = None
+
+    async def __aenter__(self):
+        # A few HTTP/2 connections carry every in-flight request as
+        # multiplexed streams
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers=self.headers,
+            limits=httpx.Limits(max_connections=self.pool_size),
+            timeout=httpx.Timeout(60),
+            transport=self.transport,
+        )
+        self.async_semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.client.aclose()
+        self.client = None
+
+    async def get_page(self, url, params=None):
+        client_retried = False
+        for attempt in range(self.retry_count + 1):
+            try:
+                key, entry, headers = self.conditional(url, params)
+                with self.pool.use() as (token, limiter):
+                    await asyncio.sleep(limiter.delay())
+                    started = time.perf_counter()
+                    async with self.async_semaphore:
+                        resp = await self.client.get(
+                            url, params=params, headers={**headers, **self.auth(token)}
+                        )
+                self.observe(url, resp, started)
+                logging.debug(f"Make request to {url}")
+                return self.parse_page(resp, key, entry, token)
+            except self.RateLimitExceededException as e:
+                logging.warning("Rate limit exceeded")
+                http_retries.labels(self.organization, "rate_limit").inc()
+                self.pool.limiter(e.token, e.resource).exceeded(
+                    e.kind, attempt, self.backoff(attempt)
+                )
+                continue
+            except self.ClientError as e:
+                logging.warning(f"Client error: {e}")
+                if client_retried or attempt >= self.retry_count:
+                    raise
+                client_retried = True
+                http_retries.labels(self.organization, "client_error").inc()
+                await asyncio.sleep(self.retry_seconds)
+                continue
+            except self.ServerError as e:
+                logging.warning(f"Server error: {e}")
+                reason = "server_error"
+            except httpx.TransportError as e:
+                logging.warning(f"Transport error: {e}")
+                reason = "connection_error"
+            if attempt < self.retry_count:
+                http_retries.labels(self.organization, reason).inc()
+                seconds = self.backoff(attempt)
+                logging.warning(f"Try to retry in {seconds:.1f} seconds")
+                await asyncio.sleep(seconds)
+        raise Exception(f"Failed for {self.retry_count + 1} times")
+
+    async def iter_pages(self, url, params=None):
+        params = {**(params or {}), "page": 1, "per_page": 100}
+        template = endpoint(url, self.api_path)
+        pages = http_pages.labels(self.organization, template)
+        number = 0
+        while url:
+            number += 1
+            with trace.span(template, "page", page=number):
+                page, next_url = await self.get_page(url, params)
+            pages.inc()
+            url = next_url
+            params = None
+            yield page
+
+    async def paginate(self, url, params=None):
+        async for page in self.iter_pages(url, params):
+            for item in page:
+                yield item
+
+    async def make_request(self, url, params=None):
+        res = []
+        async for page in self.iter_pages(url, params):
+            if not isinstance(page, list):
+                return page
+            res += page
+        return res
+
+    def get_issues(self, repo_name, since=None):
+        params = {"state": "all"}
+        if since:
+            params.update({"since": since, "sort": "updated", "direction": "desc"})
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/issues", params
+        )
+
+    async def get_pulls(self, repo_name, since=None):
+        params = {"state": "all"}
+        if since:
+            params.update({"sort": "updated", "direction": "desc"})
+        async for pull in self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/pulls",
+            params,
+        ):
+            if since and pull["updated_at"] < since:
+                break
+            yield pull
+
+    async def get_rate_limit(self):
+        limit = await self.make_request(f"{self.api_url}/rate_limit")
+        return limit["resources"]["core"]
+
+
+class AsyncBackup:
+    token = str
+    output_dir = str
+    organization = str
+    concurrency = int
+
+    def __init__(
+        self,
+        token,
+        organization,
+        output_dir,
+        repositories,
+        pool_size=4,
+        concurrency=100,
+        transport=None,
+        output_format="tree",
+        dedup_users=False,
+        sizes=None,
+        api_url="https://api.github.com",
+        writer=None,
+        limiters=None,
+        cache=None,
+        catalog=None,
+    ):
+        self.token = token
+        self.organization = organization
+        self.output_dir = f"{output_dir}/{organization}"
+        self.concurrency = concurrency
+        self.api = AsyncGithubAPI(
+            self.token,
+            self.organization,
+            self.output_dir,
+            pool_size=pool_size,
+            concurrency=concurrency,
+            transport=transport,
+            api_url=api_url,
+            limiters=limiters,
+            cache=cache,
+        )
+        self.repositories = repositories
+        # Tells the repositories without issues, like the sync backup
+        self.catalog = catalog
+        os.makedirs(self.output_dir, exist_ok=True)
+        # The writer of the sync backup is reused, so there is one user
+        # table and one writer thread per organization
+        self.writer = writer or create_writer(
+            self.output_dir, output_format, dedup_users, sizes
+        )
+
+    async def run(self, members=False, issues=False, pulls=False):
+        async with self.api:
+            if members:
+                logging.info("Start async backup of members")
+                await self.backup_members()
+            if issues:
+                logging.info("Start async backup of issues")
+                await self.backup_issues()
+            if pulls:
+                logging.info("Start async backup of pulls")
+                await self.backup_pulls()
+        self.writer.flush()
+
+    async def backup_members(self):
+        members_dir = f"{self.output_dir}/members"
+        self.writer.write([(members_dir, None)])
+        await run_concurrent(
+            lambda member: self.__save_member(member, members_dir),
+            self.api.get_members(),
+            self.concurrency,
+        )
+
+    async def backup_issues(self):
+        repo_dir = f"{self.output_dir}/repos"
+        repos = [
+            repo
+            for repo in await self.__backed_up_repositories(repo_dir)
+            if self.catalog is None
+            or (self.catalog.peek(repo) or {}).get("has_issues", True)
+        ]
+        await run_concurrent(
+            lambda repo: self.__save_issues(repo, f"{repo_dir}/{repo}/issues"),
+            repos,
+            self.concurrency,
+        )
+
+    async def backup_pulls(self):
+        repo_dir = f"{self.output_dir}/repos"
+        await run_concurrent(
+            lambda repo: self.__save_pulls(repo, f"{repo_dir}/{repo}/pulls"),
+            await self.__backed_up_repositories(repo_dir),
+            self.concurrency,
+        )
+
+    async def __backed_up_repositories(self, repo_dir):
+        if self.repositories is None:
+            self.repositories = [
+                repo["name"] async for repo in self.api.get_repositories()
+            ]
+        return [
+            repo for repo in self.repositories if os.path.isdir(f"{repo_dir}/{repo}")
+        ]
+
+    async def __save_member(self, member, members_dir):
+        membership = await self.api.get_member_status(member["login"])
+        self.writer.save_member(member, membership, f'{members_dir}/{member["login"]}')
+        items_written.labels(self.organization, "members").inc()
+
+    async def __save_issues(self, repo, issues_dir):
+        self.writer.write([(issues_dir, None)])
+        await run_concurrent(
+            lambda issue: self.__save_issue(repo, issue, issues_dir),
+            self.api.get_issues(repo),
+            self.concurrency,
+        )
+
+    async def __save_issue(self, repo, issue, issues_dir):
+        if "pull" in issue["html_url"]:
+            return
+        issue_dir = f'{issues_dir}/{issue["number"]}'
+        self.writer.save_issue(issue, issue_dir)
+        items_written.labels(self.organization, "issues").inc()
+        await self.__save_comments(repo, issue, issue_dir)
+
+    async def __save_pulls(self, repo, pulls_dir):
+        self.writer.write([(pulls_dir, None)])
+        await run_concurrent(
+            lambda pull: self.__save_pull(repo, pull, pulls_dir),
+            self.api.get_pulls(repo),
+            self.concurrency,
+        )
+
+    async def __save_pull(self, repo, pull, pulls_dir):
+        if "pull" not in pull["html_url"]:
+            return
+        pull_dir = f'{pulls_dir}/{pull["number"]}'
+        self.writer.save_pull(pull, pull_dir)
+        items_written.labels(self.organization, "pulls").inc()
+        await self.__save_comments(repo, pull, pull_dir)
+        await run_concurrent(
+            lambda review: self.__save_review(repo, pull, review, pull_dir),
+            self.api.get_reviews(repo, pull["number"]),
+            self.concurrency,
+        )
+
+    async def __save_review(self, repo, pull, review, pull_dir):
+        review_dir = f'{pull_dir}/reviews/{review["id"]}'
+        self.writer.save_review(review, review_dir)
+        items_written.labels(self.organization, "reviews").inc()
+        comments = self.api.get_comments_for_review(repo, pull["number"], review["id"])
+        comments = [c async for c in comments]
+        self.writer.save_review_comments(comments, review_dir)
+        items_written.labels(self.organization, "review_comments").inc(len(comments))
+
+    async def __save_comments(self, repo, item, item_dir):
+        comments = []
+        if item.get("comments") != 0:
+            # The listing already tells when there is nothing to fetch
+            comments = [
+                c async for c in self.api.get_comments_for_issue(repo, item["number"])
+            ]
+        self.writer.save_comments(comments, item_dir)
+        items_written.labels(self.organization, "comments").inc(len(comments))
@@ -0,0 +1,354 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+
+from backup_github.writer import QueuedWriter, TreeWriter, UserStore
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+RESOURCES = ["issues", "pulls"]
+EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+# Uncompressed bytes of a frame, and of the records buffered for all streams
+FRAME_SIZE = 1 << 20
+BUFFER_SIZE = 8 << 20
+
+
+def encode(record):
+    # Both encoders give the same compact UTF-8 lines
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (
+        json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+    )
+
+
+def compress(data, compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def decompress(data, compression):
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def default_compression():
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def stream_file(base, compression=None):
+    # Keep appending to an existing stream in the format it was started with
+    for name, extension in EXTENSIONS.items():
+        if os.path.exists(f"{base}.jsonl.{extension}"):
+            return f"{base}.jsonl.{extension}", name
+    compression = compression or default_compression()
+    return f"{base}.jsonl.{EXTENSIONS[compression]}", compression
+
+
+def key(record):
+    return record["path"].split("/")[0]
+
+
+def frames(entries, frame_size=FRAME_SIZE):
+    group = []
+    size = 0
+    for entry in entries:
+        group.append(entry)
+        size += len(entry[1])
+        if size >= frame_size:
+            yield group
+            group = []
+            size = 0
+    if group:
+        yield group
+
+
+def write_frame(file, index, entries, compression):
+    # Each frame is an independent compressed block, the index maps the
+    # items it contains to its offset for random access
+    data = compress(b"".join(line for _, line in entries), compression)
+    offset = file.tell()
+    file.write(data)
+    keys = sorted({key for key, _ in entries})
+    index.write(
+        json.dumps({"offset": offset, "length": len(data), "keys": keys}) + "\n"
+    )
+
+
+def append(base, entries, compression=None, frame_size=FRAME_SIZE):
+    path, compression = stream_file(base, compression)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as file, open(f"{base}.idx", "a") as index:
+        for group in frames(entries, frame_size):
+            write_frame(file, index, group, compression)
+
+
+def load_index(base):
+    if not os.path.exists(f"{base}.idx"):
+        return []
+    with open(f"{base}.idx") as file:
+        return [json.loads(line) for line in file]
+
+
+def recover(base):
+    # A compaction is committed once its index is complete: an interrupted
+    # one is either finished or thrown away
+    path, _ = stream_file(base)
+    if os.path.exists(f"{base}.idx.compact"):
+        if os.path.exists(f"{path}.compact"):
+            os.replace(f"{path}.compact", path)
+        os.replace(f"{base}.idx.compact", f"{base}.idx")
+    for leftover in [f"{path}.compact", f"{base}.idx.compact.tmp"]:
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+
+def scan(base, key=None):
+    path, compression = stream_file(base)
+    listed = load_index(base)
+    if not listed:
+        return
+    with open(path, "rb") as file:
+        for frame in listed:
+            if key is not None and key not in frame["keys"]:
+                continue
+            file.seek(frame["offset"])
+            data = decompress(file.read(frame["length"]), compression)
+            for record in data.splitlines():
+                record = json.loads(record)
+                if key is None or record["path"].split("/")[0] == key:
+                    yield record
+
+
+def read(base, key=None):
+    recover(base)
+    yield from scan(base, key)
+
+
+def read_item(base, key):
+    return {record["path"]: record["content"] for record in read(base, key)}
+
+
+def superseded(base, start):
+    # Items written again since the stream had start bytes left older
+    # records behind
+    old = set()
+    new = set()
+    for frame in load_index(base):
+        (old if frame["offset"] < start else new).update(frame["keys"])
+    return bool(old & new)
+
+
+def compact(base, frame_size=FRAME_SIZE):
+    # Later records of a path replace earlier ones, so the stream is
+    # rewritten with the latest record of each path in full-size frames
+    recover(base)
+    path, compression = stream_file(base)
+    latest = {}
+    for number, record in enumerate(scan(base)):
+        latest[record["path"]] = number
+    records = (
+        record
+        for number, record in enumerate(scan(base))
+        if latest[record["path"]] == number
+    )
+    with open(f"{path}.compact", "wb") as file, open(
+        f"{base}.idx.compact.tmp", "w"
+    ) as index:
+        entries = ((key(record), encode(record)) for record in records)
+        for group in frames(entries, frame_size):
+            write_frame(file, index, group, compression)
+    os.replace(f"{base}.idx.compact.tmp", f"{base}.idx.compact")
+    recover(base)
+
+
+class ArchiveWriter(QueuedWriter):
+    root = str
+    compression = str
+    frame_size = int
+    buffer_size = int
+
+    def __init__(
+        self,
+        root,
+        compression=None,
+        frame_size=FRAME_SIZE,
+        buffer_size=BUFFER_SIZE,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.root = root
+        self.compression = compression or default_compression()
+        self.frame_size = frame_size
+        self.buffer_size = buffer_size
+        # Records are buffered per stream and written in frames of about
+        # frame_size, files wait for the records buffered before them
+        self.buffer_lock = threading.Lock()
+        self.buffers = {}
+        self.buffered = 0
+        self.pending = {}
+        # Size of each stream this run appends to before its first frame
+        self.starts = {}
+
+    def stream(self, path):
+        # The directory of a resource itself is implied by its stream
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        if len(parts) >= 3 and parts[0] == "repos" and parts[2] in RESOURCES:
+            return os.path.join(self.root, *parts[:3]), "/".join(parts[3:]) or None
+        if parts[0] == "members":
+            return os.path.join(self.root, "members"), "/".join(parts[1:]) or None
+        return None, None
+
+    def store(self, records, atomic=False):
+        self.store_batch([(records, atomic)])
+
+    def store_batch(self, batch):
+        with self.buffer_lock:
+            for records, atomic in batch:
+                for path, content in records:
+                    base, rest = (None, None) if atomic else self.stream(path)
+                    if base is None:
+                        self.pending[path] = (content, atomic)
+                    elif rest is not None:
+                        self.__buffer(base, {"path": rest, "content": content})
+            if self.buffered >= self.buffer_size:
+                self.__write()
+
+    def flush(self):
+        super().flush()
+        with self.buffer_lock:
+            self.__write()
+
+    def close(self):
+        super().close()
+        with self.buffer_lock:
+            self.__write()
+            for base, start in self.starts.items():
+                if superseded(base, start):
+                    logging.info(f"Compact {base}")
+                    compact(base, self.frame_size)
+            self.starts = {}
+
+    def __buffer(self, base, record):
+        if base not in self.starts:
+            recover(base)
+            path, _ = stream_file(base, self.compression)
+            self.starts[base] = os.path.getsize(path) if os.path.exists(path) else 0
+        entries, size = self.buffers.get(base, ([], 0))
+        line = encode(record)
+        entries.append((key(record), line))
+        self.buffers[base] = (entries, size + len(line))
+        self.buffered += len(line)
+        if self.sizes is not None:
+            self.sizes.touch(base)
+        if size + len(line) >= self.frame_size:
+            append(base, entries, self.compression, self.frame_size)
+            del self.buffers[base]
+            self.buffered -= size + len(line)
+
+    def __write(self):
+        # State files go last so they never get ahead of the records
+        for base, (entries, _) in self.buffers.items():
+            append(base, entries, self.compression, self.frame_size)
+        self.buffers = {}
+        self.buffered = 0
+        pending, self.pending = self.pending, {}
+        for path, (content, atomic) in pending.items():
+            super().store([(path, content)], atomic)
+
+
+def members(org_dir):
+    for path in sorted(glob.glob(f"{org_dir}/members/*/member.json")):
+        with open(path) as file:
+            yield json.load(file)
+    for record in read(f"{org_dir}/members"):
+        if record["path"].endswith("/member.json"):
+            yield record["content"]
+
+
+def create_writer(
+    org_dir, output_format="tree", dedup_users=False, sizes=None, users_path=None
+):
+    users = None
+    if dedup_users:
+        # Members of earlier backups give the table its ids up front
+        users = UserStore(users_path or f"{org_dir}/users.json")
+        users.seed(members(org_dir))
+        if users.path != f"{org_dir}/users.json":
+            # A shard starts from the table merged after the previous run
+            users.seed(UserStore(f"{org_dir}/users.json").users.values())
+    if output_format == "archive":
+        return ArchiveWriter(org_dir, users=users, sizes=sizes)
+    return QueuedWriter(users, sizes)
+
+
+def tree_bases(org_dir):
+    bases = [f"{org_dir}/members"]
+    for resource in RESOURCES:
+        bases += sorted(glob.glob(f"{org_dir}/repos/*/{resource}"))
+    return [base for base in bases if os.path.isdir(base)]
+
+
+def archive_bases(org_dir):
+    bases = [f"{org_dir}/members"]
+    for resource in RESOURCES:
+        bases += sorted(
+            index[: -len(".idx")]
+            for index in glob.glob(f"{org_dir}/repos/*/{resource}.idx")
+        )
+    return [base for base in bases if os.path.exists(f"{base}.idx")]
+
+
+def to_archive(org_dir, compression=None, batch_size=100):
+    # Streams already in the archive format keep only their latest records
+    for base in archive_bases(org_dir):
+        logging.info(f"Compact {base}")
+        compact(base)
+    writer = ArchiveWriter(org_dir, compression)
+    for base in tree_bases(org_dir):
+        logging.info(f"Convert {base} to archive")
+        batch = []
+        for key in sorted(os.listdir(base)):
+            records = []
+            for root, dirs, files in os.walk(f"{base}/{key}"):
+                if not dirs and not files:
+                    records.append((root, None))
+                for name in sorted(files):
+                    with open(f"{root}/{name}") as file:
+                        records.append((f"{root}/{name}", json.load(file)))
+            batch.append((records, False))
+            if len(batch) >= batch_size:
+                writer.store_batch(batch)
+                batch = []
+        if batch:
+            writer.store_batch(batch)
+        writer.flush()
+        shutil.rmtree(base)
+
+
+def to_tree(org_dir):
+    writer = TreeWriter()
+    for base in archive_bases(org_dir):
+        logging.info(f"Convert {base} to tree")
+        recover(base)
+        path, _ = stream_file(base)
+        writer.makedirs(base)
+        writer.store(
+            (f"{base}/{record['path']}", record["content"]) for record in read(base)
+        )
+        os.remove(path)
+        os.remove(f"{base}.idx")
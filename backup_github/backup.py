@@ -2,13 +2,109 @@ import logging
 import os
 import shutil
 import subprocess
+import threading
 import time
-from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 
+from backup_github import git, trace
+from backup_github.archive import create_writer
+from backup_github.cache import ValidatorCache
+from backup_github.catalog import RepositoryCatalog
+from backup_github.git import GitResult
 from backup_github.github import GithubAPI
-from backup_github.metrics import git_size
-from backup_github.utils import filter_save, subprocess_handle
+from backup_github.graphql import GithubGraphQLAPI
+from backup_github.metrics import (
+    git_fetch_bytes,
+    git_fetch_duration,
+    items_written,
+    phase_duration,
+)
+from backup_github.shard import Shard
+from backup_github.sizes import SizeLedger
+from backup_github.state import HighWaterMark, Journal, State, utc_now
+from backup_github.utils import run_parallel
+
+
+def timed(phase):
+    def decorator(func):
+        def ret(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with trace.span(phase, "phase", organization=self.organization):
+                    return func(self, *args, **kwargs)
+            finally:
+                phase_duration.labels(self.organization, phase).set(
+                    time.perf_counter() - started
+                )
+
+        return ret
+
+    return decorator
+
+
+def traced(phase):
+    def decorator(func):
+        def ret(self, repository, *args, **kwargs):
+            with trace.span(repository, "repository", phase=phase):
+                return func(self, repository, *args, **kwargs)
+
+        return ret
+
+    return decorator
+
+
+class PullListing:
+    key = str
+
+    def __init__(self, pulls, key, cursor):
+        # The pulls listing is sorted like the issues listing, so it is read
+        # only as far as the pull items taken need, and a pull is held only
+        # while its item may still come
+        self.pulls = iter(pulls)
+        self.key = key
+        self.cursor = cursor
+        self.lock = threading.Lock()
+        self.held = {}
+        self.expected = set()
+        self.frontier = ""
+
+    def track(self, items):
+        for item in items:
+            if "pull" in item["html_url"]:
+                with self.lock:
+                    self.expected.add(item["number"])
+                    self.frontier = item.get(self.key) or ""
+            yield item
+
+    def find(self, item):
+        number = item["number"]
+        position = item.get(self.key) or ""
+        with self.lock:
+            pull = self.held.pop(number, None)
+            if pull is None:
+                for listed in self.pulls:
+                    if listed["number"] == number:
+                        pull = listed
+                        break
+                    self.held[listed["number"]] = listed
+                    if (listed.get(self.key) or "") < position:
+                        break
+            self.expected.discard(number)
+            # Items listed after the frontier come later in both listings, a
+            # pull before it that no item waits for is not asked for anymore
+            for held in list(self.held.values()):
+                if (
+                    held["number"] not in self.expected
+                    and (held.get(self.key) or "") > self.frontier
+                ):
+                    del self.held[held["number"]]
+                    self.cursor.done(held)
+            return pull
+
+    def done(self, pull):
+        self.cursor.done(pull)
 
 
 class Backup:
@@ -16,215 +112,510 @@ class Backup:
     output_dir = str
     organization = str
     repositories = Optional[list]
+    git_workers = int
+    workers = int
+    bulk_comments = bool
+    incremental = bool
+    force_fetch = bool
+    git_url = str
+    shard = Optional[Shard]
 
-    def __init__(self, token, organization, output_dir, repositories):
+    def __init__(
+        self,
+        token,
+        organization,
+        output_dir,
+        repositories,
+        pool_size=10,
+        git_workers=4,
+        workers=4,
+        concurrency=8,
+        bulk_comments=False,
+        incremental=False,
+        http_cache_size=0,
+        force_fetch=False,
+        backend="rest",
+        resume=False,
+        output_format="tree",
+        dedup_users=False,
+        api_url="https://api.github.com",
+        git_url="https://{token}@github.com",
+        shared=None,
+        shard=None,
+    ):
         self.token = token
+        self.shard = shard
+        self.git_url = git_url.rstrip("/")
+        self.force_fetch = force_fetch
+        if bulk_comments and backend == "graphql":
+            # Comments come along with issues, pulls and reviews, the bulk
+            # endpoints would download them again and leave them stashed
+            logging.warning("Bulk comments are not used with the GraphQL backend")
+            bulk_comments = False
+        self.bulk_comments = bulk_comments
+        self.incremental = incremental
+        self.checkpoints = {}
+        self.checkpoints_lock = threading.Lock()
+        self.git_workers = git_workers
+        self.workers = workers
         self.organization = organization
         self.output_dir = f"{output_dir}/{organization}"
-        self.api = GithubAPI(self.token, self.organization, self.output_dir)
-        self.repositories = repositories
-        if self.repositories is None:
-            self.repositories = self.__get_repositories()
+        cache = None
+        if http_cache_size:
+            cache = ValidatorCache(
+                self.__state_path(f"{self.output_dir}/.cache/http"), http_cache_size
+            )
+        api = GithubGraphQLAPI if backend == "graphql" else GithubAPI
+        self.api = api(
+            self.token,
+            self.organization,
+            self.output_dir,
+            pool_size=pool_size,
+            concurrency=concurrency,
+            cache=cache,
+            api_url=api_url,
+            **(shared.options(token) if shared is not None else {}),
+        )
+        self.catalog = RepositoryCatalog(self.api, repositories)
+        listed = list(self.catalog)
+        if shard is not None:
+            self.catalog.shard(shard)
+            logging.info(
+                f"Shard {shard} backs up {len(self.catalog)} of {len(listed)} repositories, "
+                f"{self.catalog.size()} of {self.catalog.size(listed)} KB"
+            )
+        self.repositories = self.catalog.names
         if not os.path.isdir(output_dir):
             logging.warning("Output directory does not exist. It will be created")
-            os.mkdir(output_dir)
+            # Organizations of a batch and shards may create it concurrently
+            os.makedirs(output_dir, exist_ok=True)
         os.makedirs(self.output_dir, exist_ok=True)
+        if shard is not None:
+            # What this shard saw listed and took, so the merge can tell a
+            # repository that no shard backed up
+            coverage = State(self.__state_path(f"{self.output_dir}/repositories.json"))
+            coverage.data = {"listed": listed, "repositories": self.repositories}
+            coverage.save()
+        self.sizes = SizeLedger(
+            self.output_dir,
+            self.__state_path(f"{self.output_dir}/sizes.json"),
+            self.repositories if shard is not None else None,
+            shard is None or shard.primary,
+        )
+        self.users_path = self.__state_path(f"{self.output_dir}/users.json")
+        self.writer = create_writer(
+            self.output_dir, output_format, dedup_users, self.sizes, self.users_path
+        )
+        self.journal = Journal(
+            self.__state_path(f"{self.output_dir}/journal.json"), resume, self.writer
+        )
 
+    def __state_path(self, path):
+        # Shards sharing the output tree keep their own state files, which
+        # backup-github-merge combines afterwards
+        return path if self.shard is None else self.shard.path(path)
+
+    @timed("members")
     def backup_members(self):
+        if self.journal.done("members"):
+            logging.info("Members were backed up by the interrupted run")
+            return
         members_dir = f"{self.output_dir}/members"
-        os.makedirs(members_dir, exist_ok=True)
+        self.writer.write([(members_dir, None)])
         logging.debug(f"Member dir is {members_dir}")
         org_members = self.api.get_members()
-        logging.debug(f"Got members {org_members}")
         self.__save_members(org_members, members_dir)
+        self.journal.complete("members")
+        self.writer.flush()
 
+    @timed("pulls")
     def backup_pulls(self):
         repo_dir = f"{self.output_dir}/repos"
-        repos = list(os.walk(repo_dir))[0][1]
-        for repo in repos:
-            pull_dir = f"{repo_dir}/{repo}/pulls"
-            os.makedirs(pull_dir, exist_ok=True)
-            logging.debug(f"Pulls dir is {pull_dir}")
-            pulls = self.api.get_pulls(repo)
-            logging.debug(f"Pulls: {pulls}")
-            self.__save_pulls(pulls, pull_dir, repo)
+        repos = self.__backed_up_repositories(repo_dir, "pulls")
+        run_parallel(
+            lambda repo: self.__backup_repo_pulls(repo, repo_dir), repos, self.workers
+        )
+        self.journal.complete("pulls")
+        self.writer.flush()
 
+    @timed("issues")
     def backup_issues(self):
         repo_dir = f"{self.output_dir}/repos"
-        repos = list(os.walk(repo_dir))[0][1]
-        for repo in repos:
-            issues_dir = f"{repo_dir}/{repo}/issues"
-            os.makedirs(issues_dir, exist_ok=True)
-            logging.debug(f"Issues dir is {issues_dir}")
-            issues = self.api.get_issues(repo)
-            logging.debug(f"Issues: {issues}")
-            self.__save_issues(issues, issues_dir, repo)
+        repos = [
+            repo
+            for repo in self.__backed_up_repositories(repo_dir, "issues")
+            if (self.catalog.peek(repo) or {}).get("has_issues", True)
+        ]
+        run_parallel(
+            lambda repo: self.__backup_repo_issues(repo, repo_dir), repos, self.workers
+        )
+        self.journal.complete("issues")
+        self.writer.flush()
+
+    @timed("issues_pulls")
+    def backup_issues_and_pulls(self):
+        # The issues listing returns pulls as well, so one walk of it feeds
+        # both phases; GraphQL lists issues and pulls separately anyway
+        if isinstance(self.api, GithubGraphQLAPI):
+            self.backup_issues()
+            self.backup_pulls()
+            return
+        repo_dir = f"{self.output_dir}/repos"
+        repos = [
+            repo
+            for repo in self.catalog
+            if os.path.isdir(f"{repo_dir}/{repo}")
+            and not (
+                self.journal.done("issues", repo) and self.journal.done("pulls", repo)
+            )
+        ]
+        run_parallel(
+            lambda repo: self.__backup_repo_issues_and_pulls(repo, repo_dir),
+            repos,
+            self.workers,
+        )
+        self.journal.complete("issues")
+        self.journal.complete("pulls")
+        self.writer.flush()
+
+    def __backup_repo_issues_and_pulls(self, repo, repo_dir):
+        has_issues = (self.catalog.peek(repo) or {}).get("has_issues", True)
+        if not self.journal.done("issues", repo) and not has_issues:
+            self.journal.complete("issues", repo)
+        if self.journal.done("issues", repo):
+            self.__backup_repo_pulls(repo, repo_dir)
+        elif self.journal.done("pulls", repo):
+            self.__backup_repo_issues(repo, repo_dir)
+        else:
+            self.__backup_repo_items(repo, repo_dir)
+
+    @traced("issues_pulls")
+    def __backup_repo_items(self, repo, repo_dir):
+        issues_dir = f"{repo_dir}/{repo}/issues"
+        pull_dir = f"{repo_dir}/{repo}/pulls"
+        self.writer.write([(issues_dir, None), (pull_dir, None)])
+        checkpoint = self.__checkpoint(repo_dir, repo)
+        since = None
+        if self.incremental and checkpoint.get("issues") and checkpoint.get("pulls"):
+            since = min(checkpoint.get("issues"), checkpoint.get("pulls"))
+        started = utc_now()
+        mark = HighWaterMark(since)
+        cursor = self.journal.cursor("issues", repo)
+        items = self.api.get_issues(repo, since, cursor)
+        pulls_cursor = self.journal.cursor("pulls", repo)
+        pulls = PullListing(
+            pulls_cursor.track(self.api.get_pulls(repo, since, pulls_cursor)),
+            "updated_at" if since else "created_at",
+            pulls_cursor,
+        )
+        comments = review_comments = None
+        if self.bulk_comments:
+            comments = self.__get_issue_comments(repo, since)
+            review_comments = self.__get_review_comments(repo, since)
+        run_parallel(
+            cursor.wrap(
+                lambda item: self.__save_item(
+                    item,
+                    issues_dir,
+                    pull_dir,
+                    repo,
+                    pulls,
+                    comments,
+                    review_comments,
+                )
+            ),
+            mark.track(pulls.track(cursor.track(items))),
+            self.workers,
+        )
+        self.__save_checkpoint(checkpoint, "issues", mark, started)
+        self.__save_checkpoint(checkpoint, "pulls", mark, started)
+        self.journal.complete("issues", repo)
+        self.journal.complete("pulls", repo)
+
+    def __save_item(
+        self, item, issues_dir, pull_dir, repo, pulls, comments, review_comments
+    ):
+        if "pull" not in item["html_url"]:
+            self.__save_issue(item, issues_dir, repo, comments)
+            return
+        # Head, base and merge commit are only in the pulls listing, a pull
+        # it does not have where expected is fetched on its own
+        pull = pulls.find(item)
+        self.__save_pull(
+            pull or self.api.get_pull(repo, item["number"]),
+            pull_dir,
+            repo,
+            comments,
+            review_comments,
+            item,
+        )
+        if pull is not None:
+            pulls.done(pull)
+
+    @traced("pulls")
+    def __backup_repo_pulls(self, repo, repo_dir):
+        pull_dir = f"{repo_dir}/{repo}/pulls"
+        self.writer.write([(pull_dir, None)])
+        logging.debug(f"Pulls dir is {pull_dir}")
+        checkpoint = self.__checkpoint(repo_dir, repo)
+        since = checkpoint.get("pulls") if self.incremental else None
+        started = utc_now()
+        mark = HighWaterMark(since)
+        cursor = self.journal.cursor("pulls", repo)
+        pulls = self.api.get_pulls(repo, since, cursor)
+        comments = review_comments = None
+        if self.bulk_comments:
+            comments = self.__get_issue_comments(repo, since)
+            review_comments = self.__get_review_comments(repo, since)
+        self.__save_pulls(
+            mark.track(cursor.track(pulls)),
+            pull_dir,
+            repo,
+            cursor,
+            comments,
+            review_comments,
+        )
+        self.__save_checkpoint(checkpoint, "pulls", mark, started)
+        self.journal.complete("pulls", repo)
 
+    @traced("issues")
+    def __backup_repo_issues(self, repo, repo_dir):
+        issues_dir = f"{repo_dir}/{repo}/issues"
+        self.writer.write([(issues_dir, None)])
+        logging.debug(f"Issues dir is {issues_dir}")
+        checkpoint = self.__checkpoint(repo_dir, repo)
+        since = checkpoint.get("issues") if self.incremental else None
+        started = utc_now()
+        mark = HighWaterMark(since)
+        cursor = self.journal.cursor("issues", repo)
+        issues = self.api.get_issues(repo, since, cursor)
+        comments = None
+        if self.bulk_comments:
+            comments = self.__get_issue_comments(repo, since)
+        self.__save_issues(
+            mark.track(cursor.track(issues)), issues_dir, repo, cursor, comments
+        )
+        self.__save_checkpoint(checkpoint, "issues", mark, started)
+        self.journal.complete("issues", repo)
+
+    def __checkpoint(self, repo_dir, repo):
+        with self.checkpoints_lock:
+            if repo not in self.checkpoints:
+                self.checkpoints[repo] = State(
+                    f"{repo_dir}/{repo}/checkpoint.json", self.writer
+                )
+            return self.checkpoints[repo]
+
+    def __save_checkpoint(self, checkpoint, resource, mark, started):
+        # Items updated while the phase was running may have been missed, so
+        # the mark never moves past the phase start time
+        if mark.value is None:
+            return
+        checkpoint.set(resource, min(mark.value, started))
+        checkpoint.save()
+
+    def __get_issue_comments(self, repo, since=None):
+        comments = defaultdict(list)
+        for comment in self.api.get_repo_issue_comments(repo, since):
+            number = int(comment["issue_url"].rsplit("/", 1)[1])
+            comments[number].append(comment)
+        return comments
+
+    def __get_review_comments(self, repo, since=None):
+        comments = defaultdict(list)
+        for comment in self.api.get_repo_review_comments(repo, since):
+            comments[comment["pull_request_review_id"]].append(comment)
+        return comments
+
+    @timed("repositories")
     def backup_repositories(self):
         repo_dir = f"{self.output_dir}/repos"
         os.makedirs(repo_dir, exist_ok=True)
         logging.debug(f"Repositories dir is {repo_dir}")
         logging.debug(f"Repositories: {self.repositories}")
-        self.__save_repositories(self.repositories, repo_dir)
+        repositories = [
+            repo
+            for repo in self.repositories
+            if not self.journal.done("repositories", repo)
+        ]
+        results = self.__save_repositories(repositories, repo_dir)
+        self.journal.complete("repositories")
+        self.writer.flush()
+        return results
 
-    def __get_repositories(self):
-        return [repo["name"] for repo in self.api.get_repositories()]
+    def __backed_up_repositories(self, repo_dir, phase):
+        return [
+            repo
+            for repo in self.catalog
+            if os.path.isdir(f"{repo_dir}/{repo}")
+            and not self.journal.done(phase, repo)
+        ]
 
     def __save_repositories(self, repositories, dir):
-        for repository in repositories:
-            if self.api.get_repository(repository)["size"] == 0:
-                continue
-            if not self.__save_repo_content(repository, dir):
-                continue
-            repo = self.api.get_repository(repository)
-            filter_save(
-                repo,
-                ["id", "name", "private", "fork", "default_branch", "visibility"],
-                f"{dir}/{repository}/repo.json",
-            )
-            git_size.labels(self.organization).inc(
-                sum(
-                    p.stat().st_size
-                    for p in Path(f"{dir}/{repository}/content").rglob("*")
-                )
-            )
+        results = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.git_workers) as executor:
+            futures = {
+                executor.submit(self.__save_repository, repository, dir): repository
+                for repository in repositories
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logging.error(f"Repository {futures[future]} backup error: {e}")
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        return results
+
+    @traced("repositories")
+    def __save_repository(self, repository, dir):
+        repo = self.catalog.get(repository)
+        if repo["size"] == 0:
+            return GitResult(repository, True, "empty repository")
+        checkpoint = self.__checkpoint(dir, repository)
+        content = f"{dir}/{repository}/content/{repository}.git"
+        if (
+            not self.force_fetch
+            and os.path.isdir(content)
+            and repo.get("pushed_at")
+            and checkpoint.get("pushed_at") == repo["pushed_at"]
+        ):
+            logging.info(f"Repository {repository} was not pushed since last backup")
+            skipped = True
+        elif self.__save_repo_content(repository, dir):
+            skipped = False
+            checkpoint.set("pushed_at", repo.get("pushed_at"))
+            checkpoint.set("refs", git.refs(content))
+            checkpoint.save()
+            self.sizes.touch(content, "git")
+        else:
+            return GitResult(repository, False, "clone failed")
+        self.writer.save_repository(repo, f"{dir}/{repository}")
+        items_written.labels(self.organization, "repositories").inc()
+        self.journal.complete("repositories", repository)
+        return GitResult(repository, True, skipped=skipped)
 
     def __save_repo_content(self, repository, dir):
-        cur_dir = os.getcwd()
         repo_content_path = f"{dir}/{repository}/content"
+        started = time.perf_counter()
+        before = git.size(f"{repo_content_path}/{repository}.git")
         if os.path.isdir(repo_content_path):
             logging.info(
                 f"Repositories dir {dir}/{repository}/content exists. Will update repository"
             )
-            os.chdir(repo_content_path)
         else:
             logging.info(
                 f"Repositories dir {dir}/{repository}/content does not exist. Will clone repository"
             )
             os.makedirs(repo_content_path, exist_ok=True)
-            os.chdir(repo_content_path)
-            repo_url = (
-                f"https://{self.token}@github.com/{self.organization}/{repository}.git"
-            )
+            repo_url = self.git_url.format(token=self.api.token)
+            repo_url = f"{repo_url}/{self.organization}/{repository}.git"
             try:
-                subprocess_handle(subprocess.call, ["git", "clone", "--bare", repo_url])
-                if not os.path.exists(f"{repository}.git"):
-                    time.sleep(10)
-                    subprocess_handle(
-                        subprocess.call, ["git", "clone", "--bare", repo_url]
-                    )
-                    if not os.path.exists(f"{repository}.git"):
-                        raise subprocess.CalledProcessError(
-                            1, ["git", "clone", "--bare", repo_url]
-                        )
+                git.clone(repo_url, f"{repo_content_path}/{repository}.git")
             except subprocess.CalledProcessError:
                 shutil.rmtree(f"{dir}/{repository}")
                 logging.error(f"Repository {repository} backup error, will be skipped")
-                os.chdir(cur_dir)
                 return False
-        os.chdir(f"{repository}.git")
-        subprocess_handle(subprocess.check_output, ["git", "fetch", "-p"])
-        os.chdir(cur_dir)
+        git.fetch(f"{repo_content_path}/{repository}.git")
+        git_fetch_duration.labels(self.organization, repository).set(
+            time.perf_counter() - started
+        )
+        git_fetch_bytes.labels(self.organization, repository).set(
+            max(git.size(f"{repo_content_path}/{repository}.git") - before, 0)
+        )
         return True
 
     def __save_members(self, members, members_dir):
-        for member in members:
-            member_dir = f'{members_dir}/{member["login"]}'
-            os.makedirs(member_dir, exist_ok=True)
-            membership = self.api.get_member_status(member["login"])
-            filter_save(member, ["id", "login"], f"{member_dir}/member.json")
-            filter_save(membership, ["state", "role"], f"{member_dir}/membership.json")
-
-    def __save_comments(self, comments, outer_dir):
-        for comment in comments:
-            comment_dir = f'{outer_dir}/comments/{comment["id"]}'
-            os.makedirs(comment_dir, exist_ok=True)
-            filter_save(
-                comment, ["id", "body", "created_at"], f"{comment_dir}/comment.json"
-            )
-            filter_save(comment["user"], ["login"], f"{comment_dir}/user.json")
-
-    def __save_issues(self, issues, dir, repo):
-        for issue in issues:
-            if "pull" in issue["html_url"]:
-                logging.debug(f"Issue {issue['number']} is pull")
-                continue
-
-            issue_dir = f'{dir}/{issue["number"]}'
-            os.makedirs(issue_dir, exist_ok=True)
-            os.makedirs(f"{issue_dir}/comments", exist_ok=True)
-
-            filter_save(
-                issue,
-                ["title", "body", "created_at", "state"],
-                f"{issue_dir}/issue.json",
-            )
-            filter_save(issue["assignee"], ["login"], f"{issue_dir}/assignee.json")
-            filter_save(issue["user"], ["login"], f"{issue_dir}/user.json")
+        run_parallel(
+            lambda member: self.__save_member(member, members_dir),
+            members,
+            self.workers,
+        )
 
-            self.__save_comments(
-                self.api.get_comments_for_issue(repo, issue["number"]),
-                issue_dir,
-            )
+    def __save_member(self, member, members_dir):
+        membership = self.api.get_member_status(member["login"])
+        self.writer.save_member(member, membership, f'{members_dir}/{member["login"]}')
+        items_written.labels(self.organization, "members").inc()
 
-    def __save_pulls(self, pulls, dir, repo):
-        for pull in pulls:
-            if "pull" not in pull["html_url"]:
-                continue
+    def __save_issues(self, issues, dir, repo, cursor, comments=None):
+        run_parallel(
+            cursor.wrap(lambda issue: self.__save_issue(issue, dir, repo, comments)),
+            issues,
+            self.workers,
+        )
 
-            pull_dir = f'{dir}/{pull["number"]}'
-            os.makedirs(pull_dir, exist_ok=True)
-            os.makedirs(f"{pull_dir}/comments", exist_ok=True)
-            os.makedirs(f"{pull_dir}/reviews", exist_ok=True)
+    def __save_issue(self, issue, dir, repo, comments=None):
+        if "pull" in issue["html_url"]:
+            logging.debug(f"Issue {issue['number']} is pull")
+            return
 
-            filter_save(
-                pull,
-                ["title", "body", "created_at", "state", "merge_commit_sha"],
-                f"{pull_dir}/pull.json",
-            )
-            filter_save(pull["assignee"], ["login"], f"{pull_dir}/assignee.json")
-            filter_save(pull["user"], ["login"], f"{pull_dir}/user.json")
-            filter_save(pull["head"], ["ref", "sha"], f"{pull_dir}/head.json")
-            filter_save(pull["base"], ["ref", "sha"], f"{pull_dir}/base.json")
-
-            self.__save_comments(
-                self.api.get_comments_for_issue(repo, pull["number"]),
-                pull_dir,
-            )
-            self.__save_pull_reviews(repo, pull, dir)
+        issue_dir = f'{dir}/{issue["number"]}'
+        self.writer.save_issue(issue, issue_dir)
+        items_written.labels(self.organization, "issues").inc()
+
+        self.__save_comments(self.__item_comments(repo, issue, comments), issue_dir)
+
+    def __item_comments(self, repo, item, comments=None):
+        if comments is not None:
+            return comments.get(item["number"], [])
+        if item.get("comments") == 0:
+            # The listing already tells there is nothing to fetch
+            return []
+        return self.api.get_comments_for_issue(repo, item["number"])
+
+    def __save_pulls(
+        self, pulls, dir, repo, cursor, comments=None, review_comments=None
+    ):
+        run_parallel(
+            cursor.wrap(
+                lambda pull: self.__save_pull(
+                    pull, dir, repo, comments, review_comments
+                )
+            ),
+            pulls,
+            self.workers,
+        )
+
+    def __save_pull(
+        self, pull, dir, repo, comments=None, review_comments=None, item=None
+    ):
+        if "pull" not in pull["html_url"]:
+            return
 
-    def __save_pull_reviews(self, repo, pull, dir):
+        pull_dir = f'{dir}/{pull["number"]}'
+        self.writer.save_pull(pull, pull_dir)
+        items_written.labels(self.organization, "pulls").inc()
+
+        # The issues listing tells how many comments the pull has
+        self.__save_comments(
+            self.__item_comments(repo, item or pull, comments), pull_dir
+        )
+        self.__save_pull_reviews(repo, pull, dir, review_comments)
+
+    def __save_pull_reviews(self, repo, pull, dir, review_comments=None):
+        # Pulls are already saved in parallel, a pool per pull would multiply
+        # the threads by the number of workers again
         for review in self.api.get_reviews(repo, pull["number"]):
-            review_dir = f'{dir}/{pull["number"]}/reviews/{review["id"]}'
-            os.makedirs(review_dir, exist_ok=True)
-            os.makedirs(f"{review_dir}/comments", exist_ok=True)
-            filter_save(
-                review,
-                ["id", "body", "state", "submitted_at", "commit_id"],
-                f"{review_dir}/review.json",
-            )
-            filter_save(review["user"], ["login"], f"{review_dir}/user.json")
+            self.__save_pull_review(repo, pull, review, dir, review_comments)
+
+    def __save_pull_review(self, repo, pull, review, dir, review_comments=None):
+        review_dir = f'{dir}/{pull["number"]}/reviews/{review["id"]}'
+        self.writer.save_review(review, review_dir)
+        items_written.labels(self.organization, "reviews").inc()
 
+        if review_comments is None:
             comments = self.api.get_comments_for_review(
                 repo, pull["number"], review["id"]
             )
-            for comment in comments:
-                comments_dir = f'{review_dir}/comments/{comment["id"]}'
-                os.makedirs(comments_dir, exist_ok=True)
-                filter_save(
-                    comment,
-                    [
-                        "id",
-                        "body",
-                        "created_at",
-                        "diff_hunk",
-                        "path",
-                        "position",
-                        "original_position",
-                        "commit_id",
-                        "original_commit_id",
-                        "in_reply_to_id",
-                    ],
-                    f"{comments_dir}/comment.json",
-                )
-                filter_save(comment["user"], ["login"], f"{comments_dir}/user.json")
+        else:
+            comments = review_comments.get(review["id"], [])
+        comments = list(comments)
+        self.writer.save_review_comments(comments, review_dir)
+        items_written.labels(self.organization, "review_comments").inc(len(comments))
+
+    def __save_comments(self, comments, dir):
+        comments = list(comments)
+        self.writer.save_comments(comments, dir)
+        items_written.labels(self.organization, "comments").inc(len(comments))
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+
+class ValidatorCache:
+    path = str
+    max_bytes = int
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        os.makedirs(path, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(path):
+            for name in names:
+                stat = os.stat(f"{root}/{name}")
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name[: -len(".json")]] = size
+            self.size += size
+
+    @staticmethod
+    def key(url, params=None):
+        query = json.dumps(sorted((params or {}).items()))
+        return hashlib.sha256(f"{url} {query}".encode()).hexdigest()
+
+    def __file(self, key):
+        return f"{self.path}/{key[:2]}/{key}.json"
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self.__file(key)) as file:
+                entry = json.load(file)
+            os.utime(self.__file(key))
+            return entry
+        except (OSError, ValueError) as e:
+            logging.debug(f"Broken cache entry {key}: {e}")
+            self.__remove(key)
+            return None
+
+    def put(self, key, etag, last_modified, body, next_url, size):
+        content = json.dumps(
+            {
+                "etag": etag,
+                "last_modified": last_modified,
+                "next": next_url,
+                "size": size,
+                "body": body,
+            }
+        )
+        if len(content) > self.max_bytes:
+            return
+        file = self.__file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(content)
+        os.replace(tmp, file)
+        with self.lock:
+            self.size += len(content) - self.entries.pop(key, 0)
+            self.entries[key] = len(content)
+            evicted = []
+            while self.size > self.max_bytes and self.entries:
+                old, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(self.__file(old))
+            except FileNotFoundError:
+                pass
+
+    def __remove(self, key):
+        with self.lock:
+            self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.__file(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,44 @@
+import threading
+
+
+class RepositoryCatalog:
+    names = list
+
+    def __init__(self, api, names=None):
+        self.api = api
+        self.lock = threading.Lock()
+        self.repos = {}
+        if names is None:
+            # The org listing already carries the full repository objects
+            for repo in api.get_repositories():
+                self.repos[repo["name"]] = repo
+            names = list(self.repos)
+        self.names = names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def shard(self, shard):
+        self.names = shard.select(self.names)
+
+    def size(self, names=None):
+        # In kilobytes as listed by GitHub, explicitly named repositories
+        # are not fetched yet and count as empty
+        names = self.names if names is None else names
+        return sum((self.peek(name) or {}).get("size", 0) for name in names)
+
+    def peek(self, name):
+        with self.lock:
+            return self.repos.get(name)
+
+    def get(self, name):
+        repo = self.peek(name)
+        if repo is None:
+            # Only repositories named explicitly are fetched one by one
+            repo = self.api.get_repository(name)
+            with self.lock:
+                self.repos[name] = repo
+        return repo
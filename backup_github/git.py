@@ -0,0 +1,59 @@
+import logging
+import os
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from backup_github import trace
+from backup_github.utils import subprocess_handle
+
+
+@dataclass
+class GitResult:
+    repository: str
+    success: bool
+    error: Optional[str] = None
+    skipped: bool = False
+
+
+def clone(url, path, retry_seconds=10):
+    parent, name = os.path.split(path)
+    command = ["git", "clone", "--bare", url, name]
+    for attempt in range(2):
+        if attempt:
+            time.sleep(retry_seconds)
+        with trace.span("git clone", "git", path=path, attempt=attempt):
+            subprocess_handle(subprocess.call, command, cwd=parent)
+        if os.path.exists(path):
+            return
+    raise subprocess.CalledProcessError(1, ["git", "clone", "--bare", name])
+
+
+def fetch(path):
+    logging.debug(f"Fetch {path}")
+    with trace.span("git fetch", "git", path=path):
+        subprocess_handle(subprocess.check_output, ["git", "-C", path, "fetch", "-p"])
+
+
+def refs(path):
+    with trace.span("git for-each-ref", "git", path=path):
+        output = subprocess_handle(
+            subprocess.check_output,
+            ["git", "-C", path, "for-each-ref", "--format=%(objectname) %(refname)"],
+        )
+    return dict(
+        reversed(line.split(" ", 1)) for line in output.decode().splitlines() if line
+    )
+
+
+def size(path):
+    # Object store size as counted by git, without walking the directory
+    if not os.path.isdir(path):
+        return 0
+    with trace.span("git count-objects", "git", path=path):
+        output = subprocess_handle(
+            subprocess.check_output, ["git", "-C", path, "count-objects", "-v"]
+        )
+    counts = dict(line.split(": ", 1) for line in output.decode().splitlines())
+    return (int(counts["size"]) + int(counts["size-pack"])) * 1024
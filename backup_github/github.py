@@ -1,9 +1,82 @@
 import logging
+import random
+import threading
 import time
+from itertools import takewhile
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from backup_github.metrics import rate_limit_count
+from backup_github import trace
+from backup_github.metrics import (
+    http_cache_bytes_saved,
+    http_cache_hits,
+    http_cache_misses,
+    http_pages,
+    http_request_duration,
+    http_retries,
+    rate_limit_count,
+    rate_limit_remaining,
+    token_rate_limit_exceeded,
+    token_rate_limit_remaining,
+    token_requests,
+)
+from backup_github.ratelimit import CORE, RateLimiter, TokenPool, token_label
+
+
+def endpoint(url, prefix=""):
+    # Names and numbers are replaced so the label keeps a small set of values;
+    # the path of the API root, like /api/v3 of GitHub Enterprise, is left out
+    path = urlsplit(url).path
+    prefix = prefix.rstrip("/")
+    if prefix and (path == prefix or path.startswith(f"{prefix}/")):
+        path = path.replace(prefix, "", 1)
+    parts = path.strip("/").split("/")
+    if parts[0] == "repos" and len(parts) >= 3:
+        parts[1:3] = ["{owner}", "{repo}"]
+    elif parts[0] == "orgs" and len(parts) >= 2:
+        parts[1] = "{org}"
+    if "memberships" in parts[:-1]:
+        parts[parts.index("memberships") + 1] = "{login}"
+    return "/" + "/".join("{id}" if part.isdigit() else part for part in parts)
+
+
+class SharedClient:
+    pool_size = int
+    concurrency = int
+    parallel_organizations = int
+
+    def __init__(self, pool_size=10, concurrency=8, parallel_organizations=1):
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.parallel_organizations = parallel_organizations
+        # Organizations of a batch share the keep-alive connections and the
+        # rate limit budget of every token they use; those backed up with
+        # the same tokens share the cap on in-flight requests. The pool keeps
+        # a connection for every request the batch can have in flight, so
+        # none is opened only to be thrown away
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=max(pool_size, concurrency * parallel_organizations),
+        )
+        self.lock = threading.Lock()
+        self.limiters = {}
+        self.semaphores = {}
+
+    def options(self, token):
+        tokens = tuple(token) if isinstance(token, (list, tuple)) else (token,)
+        with self.lock:
+            for single in tokens:
+                if single not in self.limiters:
+                    self.limiters[single] = RateLimiter()
+            if tokens not in self.semaphores:
+                self.semaphores[tokens] = threading.BoundedSemaphore(self.concurrency)
+            return {
+                "adapter": self.adapter,
+                "limiters": {single: self.limiters[single] for single in tokens},
+                "semaphore": self.semaphores[tokens],
+            }
 
 
 class GithubAPI:
@@ -13,10 +86,18 @@ class GithubAPI:
     organization = str
     retry_count = int
     retry_seconds = int
+    retry_max_seconds = int
+    pool_size = int
+    concurrency = int
+    api_url = str
+    resource = CORE
 
     class RateLimitExceededException(Exception):
-        def __init__(self, message=None):
+        def __init__(self, message=None, kind=None, token=None, resource=CORE):
             self.message = message
+            self.kind = kind
+            self.token = token
+            self.resource = resource
             super().__init__(self.message)
 
     class ClientError(Exception):
@@ -29,11 +110,27 @@ class GithubAPI:
             self.message = message
             super().__init__(self.message)
 
-    def raise_by_status(self, response):
-        if response.status_code == 403:
-            logging.warning("Status is 403 - Rate limit exceeded exception")
+    def raise_by_status(self, response, token=None, resource=CORE):
+        kind = self.limiter.classify(response)
+        if kind:
+            logging.warning(
+                f"Status is {response.status_code} - {kind.capitalize()} rate limit exceeded exception"
+            )
             rate_limit_count.labels(self.organization).inc()
-            raise self.RateLimitExceededException(response.content)
+            token_rate_limit_exceeded.labels(
+                self.organization, token_label(token or self.token)
+            ).inc()
+            raise self.RateLimitExceededException(
+                response.content,
+                kind,
+                token,
+                response.headers.get("X-RateLimit-Resource", resource),
+            )
+        elif response.status_code == 403:
+            logging.warning(
+                f"Status is {response.status_code} - Client error: Forbidden"
+            )
+            raise self.ClientError(response.content)
         elif response.status_code == 404:
             logging.warning(
                 f"Status is {response.status_code} - Client error: Not found"
@@ -46,121 +143,318 @@ class GithubAPI:
             logging.warning(f"Status is {response.status_code} - Server error")
             raise self.ServerError(response.content)
 
+    def backoff(self, attempt):
+        delay = min(self.retry_max_seconds, self.retry_seconds * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
     def retry(func):
         def ret(self, *args, **kwargs):
-            for _ in range(self.retry_count + 1):
+            client_retried = False
+            for attempt in range(self.retry_count + 1):
                 try:
                     return func(self, *args, **kwargs)
-                except self.RateLimitExceededException:
+                except self.RateLimitExceededException as e:
                     logging.warning("Rate limit exceeded")
-                    limit = self.get_rate_limit()
-                    reset = limit["reset"]
-                    seconds = max(
-                        self.retry_seconds, reset - time.time() + self.retry_seconds
+                    http_retries.labels(self.organization, "rate_limit").inc()
+                    # The token is out of rotation until its limit resets, the
+                    # next attempt goes to another one or waits for it
+                    self.pool.limiter(e.token, e.resource).exceeded(
+                        e.kind, attempt, self.backoff(attempt)
                     )
-                    logging.info(f"Waiting for {seconds} seconds...")
-                    time.sleep(seconds)
-                    logging.info("Done waiting - resume!")
+                    continue
                 except self.ClientError as e:
-                    logging.warning(f"Client error: {e}. Try to retry in 5 seconds")
+                    logging.warning(f"Client error: {e}")
+                    # A 404 or a missing permission does not go away with
+                    # backoff, it is retried once after a short delay
+                    if client_retried or attempt >= self.retry_count:
+                        raise
+                    client_retried = True
+                    http_retries.labels(self.organization, "client_error").inc()
                     time.sleep(self.retry_seconds)
+                    continue
                 except self.ServerError as e:
-                    logging.warning(f"Server error: {e}. Try to retry in 5 seconds")
-                    time.sleep(self.retry_seconds)
+                    logging.warning(f"Server error: {e}")
+                    reason = "server_error"
                 except requests.exceptions.Timeout as e:
-                    logging.warning(f"Timeout error: {e}. Try to retry in 5 seconds")
-                    time.sleep(self.retry_seconds)
+                    logging.warning(f"Timeout error: {e}")
+                    reason = "timeout"
                 except requests.exceptions.ConnectionError as e:
-                    logging.warning(f"Connection error: {e}. Try to retry in 5 seconds")
-                    time.sleep(self.retry_seconds)
+                    logging.warning(f"Connection error: {e}")
+                    reason = "connection_error"
+                if attempt < self.retry_count:
+                    http_retries.labels(self.organization, reason).inc()
+                    seconds = self.backoff(attempt)
+                    logging.warning(f"Try to retry in {seconds:.1f} seconds")
+                    time.sleep(seconds)
             raise Exception(f"Failed for {self.retry_count + 1} times")
 
         return ret
 
     def __init__(
-        self, token, organization, output_dir, retry_count=10, retry_seconds=1
+        self,
+        token,
+        organization,
+        output_dir,
+        retry_count=10,
+        retry_seconds=1,
+        pool_size=10,
+        retry_max_seconds=60,
+        concurrency=8,
+        cache=None,
+        limiter=None,
+        limiters=None,
+        api_url="https://api.github.com",
+        adapter=None,
+        semaphore=None,
     ):
+        # A list of tokens is used as a pool, each request goes out with the
+        # one that has the most budget left
+        self.tokens = list(token) if isinstance(token, (list, tuple)) else [token]
+        self.token = self.tokens[0]
         self.headers = {
             "Accept": "application/vnd.github+json",
-            "Authorization": f"Bearer {token}",
+            "Authorization": f"Bearer {self.token}",
         }
-        self.token = token
         self.organization = organization
         self.output_dir = output_dir
         self.retry_count = retry_count
         self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.pool_size = pool_size
+        self.api_url = api_url.rstrip("/")
+        self.api_path = urlsplit(self.api_url).path
+        self.cache = cache
+        limiters = dict(limiters or {})
+        if limiter is not None:
+            limiters.setdefault(self.token, limiter)
+        self.pool = TokenPool(self.tokens, limiters)
+        self.limiter = self.pool.limiter()
+        # One adapter (and therefore one urllib3 connection pool) is shared by
+        # the per-thread sessions, so keep-alive connections are reused
+        # across all endpoint methods and worker threads.
+        self.adapter = adapter or HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=max(pool_size, concurrency)
+        )
+        self.local = threading.local()
+        # Global cap on in-flight requests across all worker threads; GitHub
+        # secondary rate limits punish bursts of concurrent requests
+        self.concurrency = concurrency
+        self.semaphore = semaphore or threading.BoundedSemaphore(concurrency)
+
+    @property
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self.local.session = session
+        return session
+
+    def connection_stats(self):
+        opened = 0
+        requests_made = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests_made += pool.num_requests
+        return {"opened": opened, "reused": max(requests_made - opened, 0)}
+
+    def observe(self, url, response, started, **args):
+        seconds = time.perf_counter() - started
+        template = endpoint(url, self.api_path)
+        http_request_duration.labels(
+            self.organization, template, str(response.status_code)
+        ).observe(seconds)
+        trace.complete(
+            template,
+            "http",
+            started,
+            seconds,
+            status=response.status_code,
+            bytes=len(response.content),
+            **args,
+        )
+
+    def conditional(self, url, params=None):
+        key = entry = None
+        headers = {}
+        if self.cache is not None:
+            key = self.cache.key(url, params)
+            entry = self.cache.get(key)
+            if entry and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            elif entry and entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return key, entry, headers
+
+    def auth(self, token):
+        return {"Authorization": f"Bearer {token}"}
+
+    def update_budget(self, resp, token=None, resource=CORE):
+        token = token or self.token
+        resource = resp.headers.get("X-RateLimit-Resource", resource)
+        limiter = self.pool.limiter(token, resource)
+        limiter.update(resp.headers)
+        label = token_label(token)
+        token_requests.labels(self.organization, label).inc()
+        # The gauges follow the budget the backend spends, so they do not
+        # jump between the REST and GraphQL ones
+        if resource == self.resource and limiter.remaining is not None:
+            token_rate_limit_remaining.labels(self.organization, label).set(
+                limiter.remaining
+            )
+            rate_limit_remaining.labels(self.organization).set(
+                self.pool.remaining(resource)
+            )
+
+    def parse_page(self, resp, key=None, entry=None, token=None):
+        self.update_budget(resp, token)
+        if resp.status_code == 304 and entry:
+            logging.debug("Not modified")
+            http_cache_hits.labels(self.organization).inc()
+            http_cache_bytes_saved.labels(self.organization).inc(entry["size"])
+            return entry["body"], entry["next"]
+        self.raise_by_status(resp, token)
+        logging.debug("OK")
+        body = resp.json()
+        next_url = resp.links.get("next", {}).get("url")
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if key and (etag or last_modified):
+            http_cache_misses.labels(self.organization).inc()
+            self.cache.put(key, etag, last_modified, body, next_url, len(resp.content))
+        return body, next_url
 
     @retry
-    def make_request(self, url, params={}):
+    def get_page(self, url, params=None):
+        key, entry, headers = self.conditional(url, params)
+        with self.pool.use() as (token, limiter):
+            limiter.wait()
+            started = time.perf_counter()
+            with self.semaphore:
+                resp = self.session.get(
+                    url, params=params, headers={**headers, **self.auth(token)}
+                )
+        self.observe(url, resp, started)
+        logging.debug(f"Make request to {url}")
+        return self.parse_page(resp, key, entry, token)
+
+    def iter_pages(self, url, params=None, cursor=None):
+        # Retries happen per page inside get_page, so a failure keeps the
+        # cursor and the pages that were already yielded
+        params = {**(params or {}), "page": 1, "per_page": 100}
+        template = endpoint(url, self.api_path)
+        pages = http_pages.labels(self.organization, template)
+        position = None
+        if cursor is not None and cursor.start:
+            url, params, position = cursor.start, None, cursor.start
+        number = 0
+        while url:
+            if cursor is not None:
+                cursor.page(position)
+            number += 1
+            with trace.span(template, "page", page=number):
+                page, next_url = self.get_page(url, params)
+            pages.inc()
+            # The next link already carries every query parameter
+            url = position = next_url
+            params = None
+            yield page
+
+    def paginate(self, url, params=None, cursor=None):
+        for page in self.iter_pages(url, params, cursor):
+            yield from page
+
+    def make_request(self, url, params=None):
         res = []
-        params["page"] = 1
-        params["per_page"] = 100
-        while True:
-            resp = requests.get(url, headers=self.headers, params=params)
-            logging.debug(f"Make request to {url}")
-            self.raise_by_status(resp)
-            logging.debug("OK")
-            if isinstance(resp.json(), list):
-                res += resp.json()
-            else:
-                return resp.json()
-            if len(resp.json()) == 0:
-                break
-            params["page"] = params["page"] + 1
+        for page in self.iter_pages(url, params):
+            if not isinstance(page, list):
+                return page
+            res += page
         return res
 
     def get_organization(self):
-        return self.make_request(f"https://api.github.com/orgs/{self.organization}")
+        return self.make_request(f"{self.api_url}/orgs/{self.organization}")
 
     def get_members(self):
-        return self.make_request(
-            f"https://api.github.com/orgs/{self.organization}/members"
-        )
+        return self.paginate(f"{self.api_url}/orgs/{self.organization}/members")
 
     def get_member_status(self, member_login):
         return self.make_request(
-            f"https://api.github.com/orgs/{self.organization}/memberships/{member_login}"
+            f"{self.api_url}/orgs/{self.organization}/memberships/{member_login}"
         )
 
     def get_repository(self, repo_name):
         return self.make_request(
-            f"https://api.github.com/repos/{self.organization}/{repo_name}"
+            f"{self.api_url}/repos/{self.organization}/{repo_name}"
         )
 
-    def get_issues(self, repo_name):
-        return self.make_request(
-            f"https://api.github.com/repos/{self.organization}/{repo_name}/issues",
-            {"state": "all"},
+    def get_issues(self, repo_name, since=None, cursor=None):
+        params = {"state": "all"}
+        if since:
+            # Sorted like the pulls listing with since, so the two can be
+            # walked side by side
+            params.update({"since": since, "sort": "updated", "direction": "desc"})
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/issues",
+            params,
+            cursor,
+        )
+
+    def get_pulls(self, repo_name, since=None, cursor=None):
+        params = {"state": "all"}
+        if since:
+            # The pulls endpoint has no since parameter: walk the most recently
+            # updated pulls first and stop at the first older one
+            params.update({"sort": "updated", "direction": "desc"})
+        pulls = self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/pulls",
+            params,
+            cursor,
         )
+        if since:
+            return takewhile(lambda pull: pull["updated_at"] >= since, pulls)
+        return pulls
 
-    def get_pulls(self, repo_name):
+    def get_pull(self, repo_name, pull_number):
         return self.make_request(
-            f"https://api.github.com/repos/{self.organization}/{repo_name}/pulls",
-            {"state": "all"},
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/pulls/{str(pull_number)}"
         )
 
     def get_comments_for_issue(self, repo_name, issue_number):
-        return self.make_request(
-            f"https://api.github.com/repos/{self.organization}/{repo_name}/issues/{str(issue_number)}/comments"
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/issues/{str(issue_number)}/comments"
         )
 
     def get_reviews(self, repo_name, pull_number):
-        return self.make_request(
-            f"https://api.github.com/repos/{self.organization}/{repo_name}/pulls/{str(pull_number)}/reviews"
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/pulls/{str(pull_number)}/reviews"
         )
 
     def get_comments_for_review(self, repo_name, pull_number, review_id):
-        return self.make_request(
-            f"https://api.github.com/repos/{self.organization}/{repo_name}/pulls/"
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/pulls/"
             f"{str(pull_number)}/reviews/{str(review_id)}/comments"
         )
 
-    def get_repositories(self):
-        return self.make_request(
-            f"https://api.github.com/orgs/{self.organization}/repos"
+    def get_repo_issue_comments(self, repo_name, since=None):
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/issues/comments",
+            {"since": since} if since else None,
+        )
+
+    def get_repo_review_comments(self, repo_name, since=None):
+        return self.paginate(
+            f"{self.api_url}/repos/{self.organization}/{repo_name}/pulls/comments",
+            {"since": since} if since else None,
         )
 
+    def get_repositories(self):
+        return self.paginate(f"{self.api_url}/orgs/{self.organization}/repos")
+
     def get_rate_limit(self):
-        return self.make_request("https://api.github.com/rate_limit")["resources"][
-            "core"
-        ]
+        return self.make_request(f"{self.api_url}/rate_limit")["resources"]["core"]
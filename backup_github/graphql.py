@@ -0,0 +1,315 @@
+import logging
+import threading
+import time
+
+from backup_github.github import GithubAPI
+from backup_github.ratelimit import GRAPHQL, PRIMARY
+
+PAGE_INFO = "pageInfo { hasNextPage endCursor }"
+
+AUTHOR = "author { __typename login }"
+
+COMMENT = f"id databaseId body createdAt {AUTHOR}"
+
+REVIEW_COMMENT = (
+    f"id databaseId body createdAt {AUTHOR} diffHunk path position "
+    "originalPosition commit { oid } originalCommit { oid } replyTo { databaseId }"
+)
+
+REVIEW = (
+    f"id databaseId body state submittedAt commit {{ oid }} {AUTHOR} "
+    f"comments(first: $nested) {{ {PAGE_INFO} nodes {{ {REVIEW_COMMENT} }} }}"
+)
+
+ISSUE = (
+    f"id number title body createdAt updatedAt state url {AUTHOR} "
+    "assignees(first: 1) { nodes { login } } "
+    f"comments(first: $nested) {{ {PAGE_INFO} nodes {{ {COMMENT} }} }}"
+)
+
+PULL = (
+    f"{ISSUE} mergeCommit {{ oid }} headRefName headRefOid baseRefName baseRefOid "
+    f"reviews(first: $nested) {{ {PAGE_INFO} nodes {{ {REVIEW} }} }}"
+)
+
+RATE_LIMIT = "rateLimit { cost remaining resetAt }"
+
+ISSUES_QUERY = f"""
+query Issues($owner: String!, $name: String!, $first: Int!, $nested: Int!, $after: String, $since: DateTime) {{
+  {RATE_LIMIT}
+  repository(owner: $owner, name: $name) {{
+    issues(first: $first, after: $after, filterBy: {{since: $since}}) {{
+      {PAGE_INFO} nodes {{ {ISSUE} }}
+    }}
+  }}
+}}
+"""
+
+PULLS_QUERY = f"""
+query PullRequests($owner: String!, $name: String!, $first: Int!, $nested: Int!, $after: String) {{
+  {RATE_LIMIT}
+  repository(owner: $owner, name: $name) {{
+    pullRequests(first: $first, after: $after, orderBy: {{field: UPDATED_AT, direction: DESC}}) {{
+      {PAGE_INFO} nodes {{ {PULL} }}
+    }}
+  }}
+}}
+"""
+
+NODE_QUERY = """
+query Node($id: ID!, $first: Int!, $after: String{nested}) {{
+  {rate_limit}
+  node(id: $id) {{
+    ... on {type} {{
+      {field}(first: $first, after: $after) {{ {page_info} nodes {{ {fragment} }} }}
+    }}
+  }}
+}}
+"""
+
+
+def user(author):
+    # Deleted accounts have no author in GraphQL and are the ghost user in REST
+    if not author:
+        return {"login": "ghost"}
+    # GraphQL names apps without the suffix REST gives their bot accounts
+    if author.get("__typename") == "Bot":
+        return {"login": f"{author['login']}[bot]"}
+    return {"login": author["login"]}
+
+
+def oid(commit):
+    return commit["oid"] if commit else None
+
+
+class GithubGraphQLAPI(GithubAPI):
+    graphql_url = str
+    sizes = dict
+    nested_size = int
+    target_cost = int
+    resource = GRAPHQL
+
+    def __init__(
+        self,
+        *args,
+        graphql_url=None,
+        batch_size=50,
+        nested_size=20,
+        target_cost=10,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.graphql_url = graphql_url or f"{self.api_url}/graphql"
+        self.nested_size = nested_size
+        self.target_cost = target_cost
+        self.sizes = {"Issues": batch_size, "PullRequests": batch_size}
+        # Nested connections fetched along with issues and pulls, waiting to
+        # be picked up by the per-item endpoint methods
+        self.stash = {}
+        self.stash_lock = threading.Lock()
+
+    @GithubAPI.retry
+    def query(self, query, operation, variables):
+        with self.pool.use(GRAPHQL) as (token, limiter):
+            limiter.wait()
+            started = time.perf_counter()
+            with self.semaphore:
+                resp = self.session.post(
+                    self.graphql_url,
+                    json={
+                        "query": query,
+                        "operationName": operation,
+                        "variables": variables,
+                    },
+                    headers=self.auth(token),
+                )
+        self.observe(self.graphql_url, resp, started, operation=operation)
+        logging.debug(f"Make {operation} query to {self.graphql_url}")
+        self.update_budget(resp, token, GRAPHQL)
+        if 500 <= resp.status_code < 600 and operation in self.sizes:
+            # Heavy queries time out on GitHub side: retry with a smaller page
+            self.sizes[operation] = max(1, self.sizes[operation] // 2)
+            variables["first"] = self.sizes[operation]
+        self.raise_by_status(resp, token, GRAPHQL)
+        body = resp.json()
+        errors = body.get("errors") or []
+        if any(error.get("type") == "RATE_LIMITED" for error in errors):
+            raise self.RateLimitExceededException(resp.content, PRIMARY, token, GRAPHQL)
+        if errors or body.get("data") is None:
+            raise self.ServerError(resp.content)
+        data = body["data"]
+        self.__adapt(operation, data.get("rateLimit"))
+        return data
+
+    def __adapt(self, operation, rate_limit):
+        # Keep the cost of one query near the target number of points
+        if operation not in self.sizes or not rate_limit or not rate_limit["cost"]:
+            return
+        size = int(self.sizes[operation] * self.target_cost / rate_limit["cost"])
+        self.sizes[operation] = max(1, min(100, size))
+
+    def __paginate(self, query, operation, variables, path, cursor=None):
+        after = cursor.start if cursor is not None else None
+        while True:
+            variables = {
+                **variables,
+                "first": self.sizes[operation],
+                "nested": self.nested_size,
+                "after": after,
+            }
+            if cursor is not None:
+                cursor.page(after)
+            connection = self.query(query, operation, variables)
+            for key in path:
+                connection = connection[key]
+            yield from connection["nodes"]
+            if not connection["pageInfo"]["hasNextPage"]:
+                break
+            after = connection["pageInfo"]["endCursor"]
+
+    def __nodes(self, owner, type, field, fragment):
+        connection = owner[field]
+        nodes = list(connection["nodes"])
+        if connection["pageInfo"]["hasNextPage"]:
+            nested = "$nested" in fragment
+            query = NODE_QUERY.format(
+                nested=", $nested: Int!" if nested else "",
+                rate_limit=RATE_LIMIT,
+                type=type,
+                field=field,
+                page_info=PAGE_INFO,
+                fragment=fragment,
+            )
+            variables = {"id": owner["id"]}
+            after = connection["pageInfo"]["endCursor"]
+            while after:
+                variables = {**variables, "first": 100, "after": after}
+                if nested:
+                    variables["nested"] = self.nested_size
+                page = self.query(query, "Node", variables)["node"][field]
+                nodes += page["nodes"]
+                after = (
+                    page["pageInfo"]["hasNextPage"] and page["pageInfo"]["endCursor"]
+                )
+        return nodes
+
+    def __put(self, key, value):
+        with self.stash_lock:
+            self.stash[key] = value
+
+    def __pop(self, key):
+        with self.stash_lock:
+            return self.stash.pop(key, None)
+
+    def __comments(self, repo_name, node, type):
+        self.__put(
+            ("comments", repo_name, node["number"]),
+            [
+                {
+                    "id": comment["databaseId"],
+                    "body": comment["body"],
+                    "created_at": comment["createdAt"],
+                    "user": user(comment["author"]),
+                }
+                for comment in self.__nodes(node, type, "comments", COMMENT)
+            ],
+        )
+
+    def __issue(self, node):
+        assignees = node["assignees"]["nodes"]
+        return {
+            "number": node["number"],
+            "title": node["title"],
+            "body": node["body"] or None,
+            "created_at": node["createdAt"],
+            "updated_at": node["updatedAt"],
+            "state": "open" if node["state"] == "OPEN" else "closed",
+            "html_url": node["url"],
+            "user": user(node["author"]),
+            "assignee": user(assignees[0]) if assignees else None,
+        }
+
+    def __review(self, repo_name, node):
+        self.__put(
+            ("review_comments", repo_name, node["databaseId"]),
+            [
+                {
+                    "id": comment["databaseId"],
+                    "body": comment["body"],
+                    "created_at": comment["createdAt"],
+                    "diff_hunk": comment["diffHunk"],
+                    "path": comment["path"],
+                    "position": comment["position"],
+                    "original_position": comment["originalPosition"],
+                    "commit_id": oid(comment["commit"]),
+                    "original_commit_id": oid(comment["originalCommit"]),
+                    "in_reply_to_id": (comment["replyTo"] or {}).get("databaseId"),
+                    "user": user(comment["author"]),
+                }
+                for comment in self.__nodes(
+                    node, "PullRequestReview", "comments", REVIEW_COMMENT
+                )
+            ],
+        )
+        return {
+            "id": node["databaseId"],
+            "body": node["body"],
+            "state": node["state"],
+            "submitted_at": node["submittedAt"],
+            "commit_id": oid(node["commit"]),
+            "user": user(node["author"]),
+        }
+
+    def get_issues(self, repo_name, since=None, cursor=None):
+        nodes = self.__paginate(
+            ISSUES_QUERY,
+            "Issues",
+            {"owner": self.organization, "name": repo_name, "since": since},
+            ["repository", "issues"],
+            cursor,
+        )
+        for node in nodes:
+            self.__comments(repo_name, node, "Issue")
+            yield self.__issue(node)
+
+    def get_pulls(self, repo_name, since=None, cursor=None):
+        nodes = self.__paginate(
+            PULLS_QUERY,
+            "PullRequests",
+            {"owner": self.organization, "name": repo_name},
+            ["repository", "pullRequests"],
+            cursor,
+        )
+        for node in nodes:
+            if since and node["updatedAt"] < since:
+                break
+            self.__comments(repo_name, node, "PullRequest")
+            reviews = [
+                self.__review(repo_name, review)
+                for review in self.__nodes(node, "PullRequest", "reviews", REVIEW)
+            ]
+            self.__put(("reviews", repo_name, node["number"]), reviews)
+            yield {
+                **self.__issue(node),
+                "merge_commit_sha": oid(node["mergeCommit"]),
+                "head": {"ref": node["headRefName"], "sha": node["headRefOid"]},
+                "base": {"ref": node["baseRefName"], "sha": node["baseRefOid"]},
+            }
+
+    def get_comments_for_issue(self, repo_name, issue_number):
+        comments = self.__pop(("comments", repo_name, issue_number))
+        if comments is None:
+            return super().get_comments_for_issue(repo_name, issue_number)
+        return comments
+
+    def get_reviews(self, repo_name, pull_number):
+        reviews = self.__pop(("reviews", repo_name, pull_number))
+        if reviews is None:
+            return super().get_reviews(repo_name, pull_number)
+        return reviews
+
+    def get_comments_for_review(self, repo_name, pull_number, review_id):
+        comments = self.__pop(("review_comments", repo_name, review_id))
+        if comments is None:
+            return super().get_comments_for_review(repo_name, pull_number, review_id)
+        return comments
@@ -1,62 +1,206 @@
+import asyncio
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 
 from prometheus_client import write_to_textfile
 
+from backup_github import archive, trace
+from backup_github.aio import AsyncBackup
 from backup_github.backup import Backup
+from backup_github.github import SharedClient
+from backup_github.merge import merge
 from backup_github.metrics import (
     backup_duration,
     backup_time,
     git_size,
+    http_connections_opened,
+    http_connections_reused,
     meta_size,
     registry,
+    shard_count,
     success,
 )
-from backup_github.parse_args import parse_args
-from backup_github.utils import count_sizes
+from backup_github.parse_args import (
+    parse_args,
+    parse_config,
+    parse_convert_args,
+    parse_merge_args,
+    parse_trace_args,
+)
 
 logging.basicConfig(level=logging.INFO)
 
 
-def main():
+def backup_organization(parsed_args, shared=None):
     start = time()
-    parsed_args = None
+    backup = None
+    organization = parsed_args.organization
+    token = parsed_args.tokens or parsed_args.token
     try:
-        parsed_args = parse_args(sys.argv[1:])
-
         backup = Backup(
-            parsed_args.token,
-            parsed_args.organization,
+            token,
+            organization,
             parsed_args.output_dir,
             parsed_args.repository,
+            parsed_args.pool_size,
+            parsed_args.git_workers,
+            parsed_args.workers,
+            parsed_args.concurrency,
+            parsed_args.bulk_comments,
+            parsed_args.incremental,
+            parsed_args.http_cache_size * 1024 * 1024,
+            parsed_args.force_fetch,
+            parsed_args.backend,
+            parsed_args.resume,
+            parsed_args.output_format,
+            parsed_args.dedup_users,
+            parsed_args.api_url,
+            parsed_args.git_url,
+            shared,
+            parsed_args.shard,
         )
-        logging.info("Start backup of repos content")
-        backup.backup_repositories()
-        logging.info("Finish backup of repos content")
-        if parsed_args.members or parsed_args.all:
-            logging.info("Start backup of members")
-            backup.backup_members()
-            logging.info("Finish backup of members")
-        if parsed_args.issues or parsed_args.all:
-            logging.info("Start backup of issues")
-            backup.backup_issues()
-            logging.info("Finish backup of issues")
-        if parsed_args.pulls or parsed_args.all:
-            logging.info("Start backup of pulls")
-            backup.backup_pulls()
-            logging.info("Finish backup of pulls")
-        success.labels(parsed_args.organization).set(1)
+        logging.info(f"Start backup of repos content of {organization}")
+        results = backup.backup_repositories()
+        failed = [result.repository for result in results if not result.success]
+        if failed:
+            logging.warning(f"Failed to backup repositories: {failed}")
+        logging.info(f"Finish backup of repos content of {organization}")
+        # Members belong to the whole organization, the first shard takes them
+        members = (parsed_args.members or parsed_args.all) and (
+            parsed_args.shard is None or parsed_args.shard.primary
+        )
+        if parsed_args.use_async:
+            logging.info("Start async backup of metadata")
+            asyncio.run(
+                AsyncBackup(
+                    token,
+                    organization,
+                    parsed_args.output_dir,
+                    backup.repositories,
+                    pool_size=parsed_args.pool_size,
+                    concurrency=parsed_args.concurrency,
+                    api_url=parsed_args.api_url,
+                    writer=backup.writer,
+                    # Async requests spend the same budget of the tokens as
+                    # the sync ones and the other organizations of a batch
+                    limiters=backup.api.pool.limiters,
+                    cache=backup.api.cache,
+                    catalog=backup.catalog,
+                ).run(
+                    members=members,
+                    issues=parsed_args.issues or parsed_args.all,
+                    pulls=parsed_args.pulls or parsed_args.all,
+                )
+            )
+            logging.info("Finish async backup of metadata")
+        else:
+            if members:
+                logging.info(f"Start backup of members of {organization}")
+                backup.backup_members()
+                logging.info(f"Finish backup of members of {organization}")
+            issues = parsed_args.issues or parsed_args.all
+            pulls = parsed_args.pulls or parsed_args.all
+            if issues and pulls:
+                logging.info(f"Start backup of issues and pulls of {organization}")
+                backup.backup_issues_and_pulls()
+                logging.info(f"Finish backup of issues and pulls of {organization}")
+            elif issues:
+                logging.info(f"Start backup of issues of {organization}")
+                backup.backup_issues()
+                logging.info(f"Finish backup of issues of {organization}")
+            elif pulls:
+                logging.info(f"Start backup of pulls of {organization}")
+                backup.backup_pulls()
+                logging.info(f"Finish backup of pulls of {organization}")
+        backup.journal.finish()
+        success.labels(organization).set(1)
     except Exception as e:
-        logging.error(e)
-        success.labels(parsed_args.organization).set(0)
+        logging.error(f"Backup of {organization} failed: {e}")
+        success.labels(organization).set(0)
+    finally:
+        if backup is not None:
+            try:
+                backup.writer.close()
+            except Exception as e:
+                logging.error(e)
+                success.labels(organization).set(0)
+        if backup is not None:
+            sizes = backup.sizes.totals()
+            git_size.labels(organization).set(sizes["git"])
+            meta_size.labels(organization).set(sizes["meta"])
+        backup_time.labels(organization).set(int(time()))
+        backup_duration.labels(organization).set(time() - start)
+        if parsed_args.shard is not None:
+            shard_count.labels(organization, str(parsed_args.shard)).set(
+                parsed_args.shard.count
+            )
+        # A shared pool counts the connections of the whole batch
+        if backup is not None and shared is None:
+            connections = backup.api.connection_stats()
+            http_connections_opened.labels(organization).set(connections["opened"])
+            http_connections_reused.labels(organization).set(connections["reused"])
+
+
+def backup_batch(settings, organizations):
+    shared = SharedClient(
+        settings.pool_size, settings.concurrency, settings.parallel_organizations
+    )
+
+    def run(parsed_args):
+        backup_organization(parsed_args, shared)
+        # Metrics of finished organizations are saved as the batch goes
+        write_to_textfile(f"{settings.metrics_path}", registry)
+
+    logging.info(f"Start backup of {len(organizations)} organizations")
+    with ThreadPoolExecutor(max_workers=settings.parallel_organizations) as executor:
+        list(executor.map(run, organizations))
+    logging.info(f"Finish backup of {len(organizations)} organizations")
+
+
+def main():
+    parsed_args = parse_args(sys.argv[1:])
+    organizations = None
+    if parsed_args.config:
+        parsed_args, organizations = parse_config(parsed_args.config, parsed_args)
+    if parsed_args.profile or parsed_args.trace_file:
+        trace.start(parsed_args.trace_file or "trace.json")
+    try:
+        if organizations is not None:
+            backup_batch(parsed_args, organizations)
+        else:
+            backup_organization(parsed_args)
     finally:
-        sizes = count_sizes(parsed_args.output_dir)
-        git_size.labels(parsed_args.organization).set(sizes["git"])
-        meta_size.labels(parsed_args.organization).set(sizes["meta"])
-        backup_time.labels(parsed_args.organization).set(int(time()))
-        backup_duration.labels(parsed_args.organization).set(time() - start)
         write_to_textfile(f"{parsed_args.metrics_path}", registry)
+        trace.stop()
+
+
+def convert():
+    parsed_args = parse_convert_args(sys.argv[1:])
+    if parsed_args.output_format == "archive":
+        archive.to_archive(parsed_args.directory, parsed_args.compression)
+    else:
+        archive.to_tree(parsed_args.directory)
+
+
+def merge_shards():
+    parsed_args = parse_merge_args(sys.argv[1:])
+    failed = merge(
+        parsed_args.organizations,
+        parsed_args.output_dir,
+        parsed_args.shards,
+        parsed_args.metrics,
+        parsed_args.metrics_path,
+    )
+    if failed:
+        logging.error(f"Sharded backup failed for {failed}")
+        sys.exit(1)
+
+
+def summarize_trace():
+    parsed_args = parse_trace_args(sys.argv[1:])
+    print(trace.summarize(trace.load(parsed_args.trace_file), parsed_args.top))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+
+from prometheus_client import CollectorRegistry, write_to_textfile
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+
+from backup_github.shard import shard_paths
+from backup_github.state import State
+from backup_github.writer import TreeWriter, UserStore
+
+# How a gauge reported by every shard combines into the one of the whole run,
+# other gauges and all counters and histograms are summed
+GAUGES = {
+    "github_backup_success": min,
+    "github_backup_last_timestamp_seconds": max,
+    "github_backup_duration_seconds": max,
+    "github_backup_phase_duration_seconds": max,
+    "github_backup_rate_limit_remaining": min,
+    "github_backup_token_rate_limit_remaining": min,
+}
+
+
+class MergedCollector:
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def combine(family, sample, values):
+    if sample.endswith("_created"):
+        return min(values)
+    if family.type == "gauge":
+        return GAUGES.get(family.name, sum)(values)
+    return sum(values)
+
+
+def merge_metrics(texts):
+    families = {}
+    values = {}
+    for text in texts:
+        for family in text_string_to_metric_families(text):
+            families.setdefault(
+                family.name,
+                Metric(family.name, family.documentation, family.type, family.unit),
+            )
+            samples = values.setdefault(family.name, {})
+            for sample in family.samples:
+                key = (sample.name, tuple(sorted(sample.labels.items())))
+                samples.setdefault(key, []).append(sample.value)
+    for name, family in families.items():
+        for (sample, labels), samples in values[name].items():
+            family.add_sample(sample, dict(labels), combine(family, sample, samples))
+    return families
+
+
+def reported_shards(families, organization):
+    family = families.get("github_backup_shard")
+    if family is None:
+        return set()
+    return {
+        sample.labels["shard"]
+        for sample in family.samples
+        if sample.labels["organization"] == organization
+    }
+
+
+def merge_state(org_dir, count):
+    problems = []
+    for index, path in shard_paths(f"{org_dir}/journal.json", count).items():
+        if os.path.exists(path):
+            problems.append(f"shard {index}/{count} did not finish")
+    listed = set()
+    covered = set()
+    for path in shard_paths(f"{org_dir}/repositories.json", count).values():
+        if os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            listed.update(data["listed"])
+            covered.update(data["repositories"])
+    # Nodes that listed the organization at different times may disagree on
+    # what it holds, a repository only one of them saw can fall between them
+    missed = sorted(listed - covered)
+    if missed:
+        problems.append(f"repositories backed up by no shard: {missed}")
+    ledger = State(f"{org_dir}/sizes.json")
+    complete = True
+    sizes = {}
+    for index, path in shard_paths(ledger.path, count).items():
+        if not os.path.exists(path):
+            problems.append(f"shard {index}/{count} did not run")
+            complete = False
+            continue
+        with open(path) as file:
+            data = json.load(file)
+        complete = complete and data.get("complete", False)
+        sizes.update(data.get("sizes", {}))
+    ledger.data = {"complete": complete, "sizes": sizes}
+    ledger.save()
+    users = UserStore(f"{org_dir}/users.json")
+    for path in shard_paths(users.path, count).values():
+        if os.path.exists(path):
+            with open(path) as file:
+                users.seed(json.load(file).values())
+    users.save(TreeWriter())
+    return problems
+
+
+def merge(organizations, output_dir, count, metrics_paths, metrics_path):
+    texts = []
+    for path in metrics_paths:
+        if os.path.exists(path):
+            with open(path) as file:
+                texts.append(file.read())
+        else:
+            logging.warning(f"Metrics file {path} does not exist")
+    families = merge_metrics(texts)
+    failed = []
+    for organization in organizations:
+        problems = merge_state(f"{output_dir}/{organization}", count)
+        shards = reported_shards(families, organization)
+        problems += [
+            f"shard {index}/{count} reported no metrics"
+            for index in range(1, count + 1)
+            if f"{index}/{count}" not in shards
+        ]
+        for problem in problems:
+            logging.error(f"Backup of {organization}: {problem}")
+        success = families.get("github_backup_success")
+        if success is None:
+            success = families["github_backup_success"] = Metric(
+                "github_backup_success", "1 if backup is okay", "gauge"
+            )
+        samples = [
+            sample
+            for sample in success.samples
+            if sample.labels["organization"] == organization
+        ]
+        if problems or not samples or samples[0].value != 1:
+            failed.append(organization)
+            success.samples = [
+                sample
+                for sample in success.samples
+                if sample.labels["organization"] != organization
+            ]
+            success.add_sample(
+                "github_backup_success", {"organization": organization}, 0
+            )
+    registry = CollectorRegistry()
+    registry.register(MergedCollector(list(families.values())))
+    write_to_textfile(metrics_path, registry)
+    return failed
@@ -1,4 +1,4 @@
-from prometheus_client import CollectorRegistry, Gauge
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
 
 registry = CollectorRegistry()
 success = Gauge(
@@ -37,3 +37,105 @@ rate_limit_count = Gauge(
     labelnames=["organization"],
     registry=registry,
 )
+http_connections_opened = Gauge(
+    "github_backup_http_connections_opened",
+    "count of new HTTP connections opened to GitHub API",
+    labelnames=["organization"],
+    registry=registry,
+)
+http_connections_reused = Gauge(
+    "github_backup_http_connections_reused",
+    "count of requests served over a reused keep-alive connection",
+    labelnames=["organization"],
+    registry=registry,
+)
+http_cache_hits = Counter(
+    "github_backup_http_cache_hits",
+    "count of requests answered with 304 Not Modified from the validator cache",
+    labelnames=["organization"],
+    registry=registry,
+)
+http_cache_misses = Counter(
+    "github_backup_http_cache_misses",
+    "count of cacheable requests that returned a full response",
+    labelnames=["organization"],
+    registry=registry,
+)
+http_cache_bytes_saved = Counter(
+    "github_backup_http_cache_bytes_saved",
+    "response bytes not downloaded thanks to the validator cache",
+    labelnames=["organization"],
+    registry=registry,
+)
+rate_limit_remaining = Gauge(
+    "github_backup_rate_limit_remaining",
+    "requests left in the current rate limit window",
+    labelnames=["organization"],
+    registry=registry,
+)
+http_request_duration = Histogram(
+    "github_backup_http_request_duration_seconds",
+    "duration of requests to GitHub API",
+    labelnames=["organization", "endpoint", "status"],
+    registry=registry,
+)
+http_retries = Counter(
+    "github_backup_http_retries",
+    "count of retried requests to GitHub API",
+    labelnames=["organization", "reason"],
+    registry=registry,
+)
+http_pages = Counter(
+    "github_backup_http_pages",
+    "count of pages fetched from GitHub API",
+    labelnames=["organization", "endpoint"],
+    registry=registry,
+)
+phase_duration = Gauge(
+    "github_backup_phase_duration_seconds",
+    "duration of the last run of a backup phase in seconds",
+    labelnames=["organization", "phase"],
+    registry=registry,
+)
+git_fetch_duration = Gauge(
+    "github_backup_git_fetch_duration_seconds",
+    "duration of the last clone or fetch of a repository in seconds",
+    labelnames=["organization", "repository"],
+    registry=registry,
+)
+git_fetch_bytes = Gauge(
+    "github_backup_git_fetch_bytes",
+    "growth of the object store of a repository in the last clone or fetch",
+    labelnames=["organization", "repository"],
+    registry=registry,
+)
+items_written = Counter(
+    "github_backup_items_written",
+    "count of backed up items by resource type",
+    labelnames=["organization", "resource"],
+    registry=registry,
+)
+token_requests = Counter(
+    "github_backup_token_requests",
+    "count of requests sent with a token of the pool, by token digest",
+    labelnames=["organization", "token"],
+    registry=registry,
+)
+token_rate_limit_remaining = Gauge(
+    "github_backup_token_rate_limit_remaining",
+    "requests left in the current rate limit window of a token, by token digest",
+    labelnames=["organization", "token"],
+    registry=registry,
+)
+token_rate_limit_exceeded = Counter(
+    "github_backup_token_rate_limit_exceeded",
+    "count of rate limit responses of a token, by token digest",
+    labelnames=["organization", "token"],
+    registry=registry,
+)
+shard_count = Gauge(
+    "github_backup_shard",
+    "number of shards the organization is split into, by shard of this node",
+    labelnames=["organization", "shard"],
+    registry=registry,
+)
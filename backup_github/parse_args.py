@@ -1,4 +1,7 @@
 import argparse
+import json
+
+from backup_github.shard import Shard
 
 
 class Parser(argparse.ArgumentParser):
@@ -15,11 +18,21 @@ def parse_args(args=None) -> argparse.Namespace:
         "organization",
         metavar="ORGANIZATION_NAME",
         type=str,
+        nargs="?",
+        default=None,
         help="github organization name",
     )
     parser.add_argument(
         "-t", "--token", type=str, default="", dest="token", help="personal token"
     )
+    parser.add_argument(
+        "--tokens",
+        type=str,
+        nargs="+",
+        default=None,
+        dest="tokens",
+        help="pool of tokens, each request is sent with the one that has the most rate limit budget left",
+    )
     parser.add_argument(
         "-o",
         "--output-directory",
@@ -69,5 +82,308 @@ def parse_args(args=None) -> argparse.Namespace:
         dest="metrics_path",
         help="path for .prom file with metrics",
     )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=10,
+        dest="pool_size",
+        help="maximum number of keep-alive connections to GitHub API",
+    )
+    parser.add_argument(
+        "--git-workers",
+        type=int,
+        default=4,
+        dest="git_workers",
+        help="number of repositories cloned or fetched in parallel",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        dest="workers",
+        help="number of repositories and items processed in parallel for metadata backup",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        dest="concurrency",
+        help="maximum number of concurrent requests to GitHub API",
+    )
+    parser.add_argument(
+        "--bulk-comments",
+        action="store_true",
+        dest="bulk_comments",
+        help="fetch comments with repository-wide endpoints instead of per issue and review",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="fetch only issues and pulls updated since the previous backup",
+    )
+    parser.add_argument(
+        "--http-cache-size",
+        type=int,
+        default=0,
+        dest="http_cache_size",
+        help="size in megabytes of the on-disk ETag cache for conditional requests, 0 to disable",
+    )
+    parser.add_argument(
+        "--force-fetch",
+        action="store_true",
+        dest="force_fetch",
+        help="fetch every repository even if it was not pushed since the previous backup",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["rest", "graphql"],
+        default="rest",
+        dest="backend",
+        help="GitHub API used to fetch issues, pulls, reviews and comments",
+    )
+    parser.add_argument(
+        "--async",
+        action="store_true",
+        dest="use_async",
+        help="fetch members, issues and pulls with the asyncio HTTP/2 client",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        help="continue an interrupted backup from its run journal",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["tree", "archive"],
+        default="tree",
+        dest="output_format",
+        help="write metadata as a directory tree or as compressed JSON-lines archives",
+    )
+    parser.add_argument(
+        "--dedup-users",
+        action="store_true",
+        dest="dedup_users",
+        help="keep users in one users.json table and reference them by login",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        dest="profile",
+        help="record a trace of phases, repositories, API calls and git commands",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        default=None,
+        dest="trace_file",
+        help="Chrome trace file written by --profile, trace.json by default",
+    )
+    parser.add_argument(
+        "--api-url",
+        type=str,
+        default="https://api.github.com",
+        dest="api_url",
+        help="base URL of GitHub API",
+    )
+    parser.add_argument(
+        "--git-url",
+        type=str,
+        default="https://{token}@github.com",
+        dest="git_url",
+        help="base URL repositories are cloned from, {token} is replaced with the token",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        dest="config",
+        help="JSON file with organizations to back up in one batch and their options",
+    )
+    parser.add_argument(
+        "--parallel-organizations",
+        type=int,
+        default=4,
+        dest="parallel_organizations",
+        help="number of organizations of a batch backed up at the same time",
+    )
+    parser.add_argument(
+        "--shard",
+        type=Shard.parse,
+        default=None,
+        dest="shard",
+        help="back up only shard INDEX/COUNT of the repositories, split by name hash",
+    )
+    parsed = parser.parse_args(args)
+    if parsed.organization is None and parsed.config is None:
+        parser.error("the following arguments are required: ORGANIZATION_NAME")
+    unsupported = async_unsupported(parsed)
+    if unsupported:
+        parser.error(f"--async does not support {', '.join(unsupported)}")
+    return parsed
+
+
+def async_unsupported(parsed):
+    # The asyncio client has no checkpoints, journal or other backends, so
+    # these would give a different backup than without --async
+    if not parsed.use_async:
+        return []
+    return [
+        option
+        for option, value in [
+            ("--incremental", parsed.incremental),
+            ("--bulk-comments", parsed.bulk_comments),
+            ("--backend graphql", parsed.backend == "graphql"),
+            ("--resume", parsed.resume),
+        ]
+        if value
+    ]
+
+
+def override(parsed, options, path):
+    parsed = argparse.Namespace(**vars(parsed))
+    for key, value in options.items():
+        name = key.replace("-", "_")
+        if name == "config" or not hasattr(parsed, name):
+            raise ValueError(f"Unknown option {key} in {path}")
+        if name == "shard" and value is not None:
+            value = Shard.parse(value)
+        setattr(parsed, name, value)
+    return parsed
+
+
+# Options of the whole process, an organization of a batch cannot set them
+BATCH_OPTIONS = [
+    "pool_size",
+    "concurrency",
+    "parallel_organizations",
+    "metrics_path",
+    "profile",
+    "trace_file",
+]
+
+
+def parse_config(path, defaults):
+    # Top-level options apply to the batch and every organization, an entry
+    # overrides them; keys are the option names with underscores
+    with open(path) as file:
+        config = json.load(file)
+    common = {key: value for key, value in config.items() if key != "organizations"}
+    settings = override(defaults, common, path)
+    organizations = []
+    for entry in config.get("organizations", []):
+        if isinstance(entry, str):
+            entry = {"organization": entry}
+        for key in entry:
+            if key.replace("-", "_") in BATCH_OPTIONS:
+                raise ValueError(
+                    f"Option {key} in {path} applies to the whole batch, "
+                    f"it cannot be set for organization {entry.get('organization')}"
+                )
+        parsed = override(settings, entry, path)
+        if not parsed.organization:
+            raise ValueError(f"Organization without a name in {path}")
+        unsupported = async_unsupported(parsed)
+        if unsupported:
+            raise ValueError(
+                f"Organization {parsed.organization} in {path}: "
+                f"--async does not support {', '.join(unsupported)}"
+            )
+        organizations.append(parsed)
+    return settings, organizations
+
+
+def parse_convert_args(args=None) -> argparse.Namespace:
+    parser = Parser(
+        prog="backup-github-convert",
+        description="Convert a backup between the tree and archive formats",
+    )
+    parser.add_argument(
+        "directory",
+        metavar="ORGANIZATION_DIRECTORY",
+        type=str,
+        help="backup directory of an organization",
+    )
+    parser.add_argument(
+        "--to",
+        choices=["tree", "archive"],
+        required=True,
+        dest="output_format",
+        help="format to convert to",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["zstd", "gzip"],
+        default=None,
+        dest="compression",
+        help="compression of new archives, zstd when zstandard is installed",
+    )
+    parsed = parser.parse_args(args)
+    return parsed
+
+
+def parse_merge_args(args=None) -> argparse.Namespace:
+    parser = Parser(
+        prog="backup-github-merge",
+        description="Merge state and metrics of the shards of a backup",
+    )
+    parser.add_argument(
+        "organizations",
+        metavar="ORGANIZATION_NAME",
+        type=str,
+        nargs="+",
+        help="github organization name",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        required=True,
+        dest="shards",
+        help="number of shards the backup was split into",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-directory",
+        type=str,
+        default=".",
+        dest="output_dir",
+        help="directory for backup shared by the shards",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        default=[],
+        dest="metrics",
+        help=".prom files written by the shards",
+    )
+    parser.add_argument(
+        "--metrics_path",
+        default="/var/lib/node_exporter",
+        dest="metrics_path",
+        help="path for .prom file with merged metrics",
+    )
+    parsed = parser.parse_args(args)
+    return parsed
+
+
+def parse_trace_args(args=None) -> argparse.Namespace:
+    parser = Parser(
+        prog="backup-github-trace",
+        description="Summarize a trace file written with --profile",
+    )
+    parser.add_argument(
+        "trace_file",
+        metavar="TRACE_FILE",
+        type=str,
+        help="Chrome trace file",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        dest="top",
+        help="number of slowest spans to list",
+    )
     parsed = parser.parse_args(args)
     return parsed
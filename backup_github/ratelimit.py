@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+PRIMARY = "primary"
+SECONDARY = "secondary"
+DEFAULT_LIMIT = 5000
+CORE = "core"
+GRAPHQL = "graphql"
+
+
+def token_label(token):
+    # Tokens never reach the metrics, only a short digest that tells them apart
+    return hashlib.sha256(token.encode()).hexdigest()[:12]
+
+
+class RateLimiter:
+    reserve = int
+    pace_below = float
+    secondary_seconds = int
+
+    resource = str
+
+    def __init__(
+        self, reserve=50, pace_below=0.25, secondary_seconds=60, resource=CORE
+    ):
+        self.reserve = reserve
+        self.pace_below = pace_below
+        self.secondary_seconds = secondary_seconds
+        self.resource = resource
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0
+        self.next_slot = 0
+        # Budgets of the other resources of the same token, shared by all of
+        # its limiters
+        self.resources = {resource: self}
+        self.resources_lock = threading.Lock()
+
+    def budget(self, resource):
+        # GitHub counts REST and GraphQL requests of a token separately
+        with self.resources_lock:
+            limiter = self.resources.get(resource)
+            if limiter is None:
+                limiter = RateLimiter(
+                    self.reserve, self.pace_below, self.secondary_seconds, resource
+                )
+                limiter.resources = self.resources
+                limiter.resources_lock = self.resources_lock
+                self.resources[resource] = limiter
+            return limiter
+
+    def update(self, headers):
+        resource = headers.get("X-RateLimit-Resource")
+        if resource is not None and resource != self.resource:
+            self.budget(resource).update(headers)
+            return
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        limit = headers.get("X-RateLimit-Limit")
+        retry_after = headers.get("Retry-After")
+        with self.lock:
+            if remaining is not None and reset is not None:
+                self.remaining = int(remaining)
+                self.reset = int(reset)
+            if limit is not None:
+                self.limit = int(limit)
+            if retry_after is not None:
+                self.blocked_until = max(
+                    self.blocked_until, time.time() + int(retry_after)
+                )
+
+    def classify(self, response):
+        # Tell primary and secondary rate limits apart from permission errors
+        if response.status_code not in (403, 429):
+            return None
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            return PRIMARY
+        if "Retry-After" in response.headers:
+            return SECONDARY
+        if response.status_code == 429 or b"secondary rate limit" in response.content:
+            return SECONDARY
+        return None
+
+    def exceeded(self, kind, attempt=0, backoff=0):
+        with self.lock:
+            if kind == PRIMARY:
+                # A reset already in the past (clock skew, a stale header)
+                # still keeps the token out for the backoff of the attempt
+                until = time.time() + backoff
+                if self.reset is not None:
+                    until = max(until, self.reset + 1)
+                self.blocked_until = max(self.blocked_until, until)
+            elif kind == SECONDARY and self.blocked_until <= time.time():
+                seconds = min(self.secondary_seconds * 2**attempt, 3600)
+                self.blocked_until = time.time() + seconds
+
+    def delay(self):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.blocked_until)
+            if (
+                self.remaining is not None
+                and self.reset is not None
+                and self.limit
+                and self.reset > slot
+                and self.remaining < self.limit * self.pace_below
+            ):
+                # Spread the rest of the budget evenly over the reset window
+                budget = max(self.remaining - self.reserve, 1)
+                if self.remaining <= self.reserve:
+                    slot = max(slot, self.reset + 1)
+                else:
+                    slot = max(slot, self.next_slot)
+                    self.next_slot = slot + (self.reset - slot) / budget
+            return slot - now
+
+    def wait(self):
+        seconds = self.delay()
+        if seconds > 0:
+            if seconds > 1:
+                logging.info(f"Rate limit budget is low, waiting {seconds:.1f} seconds")
+            time.sleep(seconds)
+
+    def available_at(self):
+        # Time the budget allows requests again, pacing aside
+        with self.lock:
+            at = self.blocked_until
+            if (
+                self.remaining is not None
+                and self.reset is not None
+                and self.remaining <= self.reserve
+                and self.reset > time.time()
+            ):
+                at = max(at, self.reset + 1)
+            return at
+
+    def headroom(self, reserved=0):
+        # Share of the budget left, a token not used yet counts as unused
+        with self.lock:
+            limit = self.limit or DEFAULT_LIMIT
+            remaining = limit if self.remaining is None else self.remaining
+            return (remaining - reserved) / limit
+
+
+class TokenPool:
+    tokens = list
+
+    def __init__(self, tokens, limiters=None):
+        self.tokens = list(tokens)
+        limiters = limiters or {}
+        self.limiters = {
+            token: limiters.get(token) or RateLimiter() for token in self.tokens
+        }
+        self.inflight = {token: 0 for token in self.tokens}
+        self.lock = threading.Lock()
+
+    def limiter(self, token=None, resource=CORE):
+        limiter = self.limiters.get(token) or self.limiters[self.tokens[0]]
+        return limiter.budget(resource)
+
+    def pick(self, resource=CORE):
+        # The token with the most budget left among those not exhausted, or
+        # the one that is available first when they all are; requests in
+        # flight count against the budget so parallel workers spread out
+        now = time.time()
+        scores = {}
+        for token in self.tokens:
+            limiter = self.limiters[token].budget(resource)
+            available_at = limiter.available_at()
+            scores[token] = (
+                available_at <= now,
+                -max(available_at, now),
+                limiter.headroom(self.inflight[token]),
+            )
+        return max(self.tokens, key=lambda token: scores[token])
+
+    @contextmanager
+    def use(self, resource=CORE):
+        with self.lock:
+            token = self.pick(resource)
+            self.inflight[token] += 1
+        try:
+            yield token, self.limiters[token].budget(resource)
+        finally:
+            with self.lock:
+                self.inflight[token] -= 1
+
+    def remaining(self, resource=CORE):
+        budgets = [limiter.budget(resource) for limiter in self.limiters.values()]
+        known = [budget.remaining for budget in budgets if budget.remaining is not None]
+        return sum(known) if known else None
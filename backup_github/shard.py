@@ -0,0 +1,59 @@
+import argparse
+import hashlib
+import os
+
+
+def stable_hash(name):
+    # Unlike hash(), the same on every host and every run
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big")
+
+
+def assign(name, count):
+    # Rendezvous hashing: a repository goes to the shard that scores it
+    # highest, so its shard depends on its name and the number of shards
+    # only, and repositories added, removed or resized never move the others
+    return max(range(1, count + 1), key=lambda index: stable_hash(f"{index}/{name}"))
+
+
+class Shard:
+    index = int
+    count = int
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value):
+        try:
+            index, count = (int(part) for part in value.split("/"))
+            return cls(index, count)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f"invalid shard {value!r}, expected INDEX/COUNT like 1/4"
+            )
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    @property
+    def primary(self):
+        # Organization-wide data such as members is backed up by one shard
+        return self.index == 1
+
+    @property
+    def suffix(self):
+        return f"shard-{self.index}-of-{self.count}"
+
+    def path(self, path):
+        root, extension = os.path.splitext(path)
+        return f"{root}.{self.suffix}{extension}"
+
+    def select(self, names):
+        return [name for name in names if assign(name, self.count) == self.index]
+
+
+def shard_paths(path, count):
+    return {index: Shard(index, count).path(path) for index in range(1, count + 1)}
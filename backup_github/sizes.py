@@ -0,0 +1,95 @@
+import os
+
+from backup_github.state import State
+
+
+def du(path, skip=None):
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            size += entry.stat(follow_symlinks=False).st_size
+            if entry.is_dir(follow_symlinks=False) and entry.name != skip:
+                size += du(entry.path)
+    return size
+
+
+class SizeLedger(State):
+    root = str
+    dirty = set
+
+    def __init__(self, root, path=None, repositories=None, primary=True):
+        super().__init__(path or f"{root}/sizes.json")
+        self.root = root
+        # A shard measures its own repositories, members and the rest of the
+        # organization directory are counted by the primary one
+        self.repositories = repositories
+        self.primary = primary
+        # A run that did not finish may have written without updating the
+        # ledger, so its sizes are not trusted
+        self.stale = not self.data.get("complete", False)
+        self.data = {"complete": False, "sizes": self.data.get("sizes", {})}
+        self.dirty = set()
+        self.save()
+
+    def touch(self, path, kind="meta"):
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        if parts[0] == "repos" and len(parts) > 1:
+            key = f"repos/{parts[1]}"
+            if len(parts) > 2 and parts[2] == "content":
+                kind = "git"
+        elif parts[0] == "members":
+            key = "members"
+        else:
+            return
+        with self.lock:
+            self.dirty.add((key, kind))
+
+    def totals(self):
+        # Only entries written during this run are measured again, the rest
+        # comes from the ledger of previous runs
+        sizes = {}
+        keys = []
+        if os.path.isdir(f"{self.root}/repos"):
+            keys = [
+                f"repos/{repo}"
+                for repo in sorted(os.listdir(f"{self.root}/repos"))
+                if self.repositories is None or repo in self.repositories
+            ]
+        if self.primary and os.path.isdir(f"{self.root}/members"):
+            keys.append("members")
+        for key in keys:
+            known = self.data["sizes"].get(key, {})
+            sizes[key] = {
+                kind: (
+                    self.__measure(key, kind)
+                    if self.stale or (key, kind) in self.dirty or kind not in known
+                    else known[kind]
+                )
+                for kind in ["git", "meta"]
+            }
+        other = self.__other() if self.primary else 0
+        with self.lock:
+            self.data = {"complete": True, "sizes": sizes}
+            self.dirty = set()
+        self.stale = False
+        self.save()
+        git = sum(size["git"] for size in sizes.values())
+        meta = sum(size["meta"] for size in sizes.values()) + other
+        return {"git": git, "meta": meta}
+
+    def __other(self):
+        other = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name in ["members", os.path.basename(self.path)]:
+                    continue
+                other += entry.stat(follow_symlinks=False).st_size
+                if entry.is_dir(follow_symlinks=False) and entry.name != "repos":
+                    other += du(entry.path)
+        return other
+
+    def __measure(self, key, kind):
+        path = f"{self.root}/{key}"
+        if kind == "git":
+            return du(f"{path}/content") if os.path.isdir(f"{path}/content") else 0
+        return os.stat(path).st_size + du(path, skip="content")
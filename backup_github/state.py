@@ -0,0 +1,160 @@
+import copy
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class State:
+    path = str
+    data = dict
+
+    def __init__(self, path, writer=None):
+        self.path = path
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.data = json.load(file)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+
+    def save(self):
+        with self.lock:
+            if self.writer is not None:
+                # Queued behind the records it describes
+                self.writer.write([(self.path, copy.deepcopy(self.data))], atomic=True)
+                return
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as file:
+                json.dump(self.data, file, indent=4)
+            os.replace(tmp, self.path)
+
+
+class HighWaterMark:
+    value = str
+
+    def __init__(self, since=None):
+        self.value = since
+        self.lock = threading.Lock()
+
+    def update(self, updated_at):
+        if updated_at is None:
+            return
+        with self.lock:
+            if self.value is None or updated_at > self.value:
+                self.value = updated_at
+
+    def track(self, items):
+        for item in items:
+            self.update(item.get("updated_at"))
+            yield item
+
+
+class Journal(State):
+    previous = dict
+
+    def __init__(self, path, resume=False, writer=None):
+        super().__init__(path, writer)
+        # Progress of the interrupted run decides what to skip, while this
+        # run records its own progress on top of it
+        self.previous = self.data if resume else {}
+        self.data = copy.deepcopy(self.previous)
+
+    def done(self, phase, repo=None):
+        if repo is None:
+            return phase in self.previous.get("phases", [])
+        return repo in self.previous.get("repositories", {}).get(phase, [])
+
+    def complete(self, phase, repo=None):
+        with self.lock:
+            if repo is None:
+                completed = self.data.setdefault("phases", [])
+                item = phase
+            else:
+                repositories = self.data.setdefault("repositories", {})
+                completed = repositories.setdefault(phase, [])
+                item = repo
+                self.data.get("cursors", {}).pop(f"{phase}/{repo}", None)
+            if item not in completed:
+                completed.append(item)
+        self.save()
+
+    def cursor(self, phase, repo):
+        key = f"{phase}/{repo}"
+        return Cursor(self, key, self.previous.get("cursors", {}).get(key))
+
+    def set_cursor(self, key, position):
+        with self.lock:
+            self.data.setdefault("cursors", {})[key] = position
+        self.save()
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.flush()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Cursor:
+    key = str
+    start = Optional[str]
+
+    def __init__(self, journal, key, start=None):
+        self.journal = journal
+        self.key = key
+        self.start = start
+        self.pages = deque()
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def page(self, position):
+        with self.lock:
+            self.pages.append([position, 0])
+            position = self.__advance()
+        if position is not None:
+            self.journal.set_cursor(self.key, position)
+
+    def track(self, items):
+        for item in items:
+            with self.lock:
+                page = self.pages[-1]
+                page[1] += 1
+                self.items[id(item)] = page
+            yield item
+
+    def done(self, item):
+        with self.lock:
+            self.items.pop(id(item))[1] -= 1
+            position = self.__advance()
+        if position is not None:
+            self.journal.set_cursor(self.key, position)
+
+    def wrap(self, func):
+        def tracked(item):
+            func(item)
+            self.done(item)
+
+        return tracked
+
+    def __advance(self):
+        # A resumed run restarts at the first page that still has unsaved
+        # items, so pages are dropped only once every item on them is saved
+        advanced = False
+        while len(self.pages) > 1 and self.pages[0][1] == 0:
+            self.pages.popleft()
+            advanced = True
+        return self.pages[0][0] if advanced and self.pages[0][0] else None
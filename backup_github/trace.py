@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class NullTracer:
+    def span(self, name, category, **args):
+        return NULL_SPAN
+
+    def complete(self, name, category, started, seconds, **args):
+        pass
+
+    def close(self):
+        pass
+
+
+class Span:
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.complete(
+            self.name,
+            self.category,
+            self.started,
+            time.perf_counter() - self.started,
+            **self.args,
+        )
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer:
+    path = str
+    flush_size = int
+
+    def __init__(self, path, flush_size=1000):
+        self.path = path
+        self.flush_size = flush_size
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.first = True
+        # Chrome trace JSON array format: events are streamed to the file so
+        # long runs do not keep them in memory, and the array is closed last
+        self.file = open(path, "w")
+        self.file.write("[\n")
+
+    def span(self, name, category, **args):
+        return Span(self, name, category, args)
+
+    def complete(self, name, category, started, seconds, **args):
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((started - self.origin) * 1e6, 1),
+            "dur": round(seconds * 1e6, 1),
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+            if len(self.events) >= self.flush_size:
+                self.__flush()
+
+    def close(self):
+        with self.lock:
+            self.__flush()
+            self.file.write("\n]\n")
+            self.file.close()
+
+    def __flush(self):
+        for event in self.events:
+            self.file.write(("" if self.first else ",\n") + json.dumps(event))
+            self.first = False
+        self.events = []
+        self.file.flush()
+
+
+tracer = NullTracer()
+
+
+def span(name, category, **args):
+    return tracer.span(name, category, **args)
+
+
+def complete(name, category, started, seconds, **args):
+    tracer.complete(name, category, started, seconds, **args)
+
+
+def start(path):
+    global tracer
+    tracer = Tracer(path)
+
+
+def stop():
+    global tracer
+    tracer.close()
+    tracer = NullTracer()
+
+
+def load(path):
+    with open(path) as file:
+        content = file.read().rstrip()
+    # A run that was killed leaves the array open
+    if not content.endswith("]"):
+        content = content.rstrip(",") + "]"
+    return json.loads(content)
+
+
+def summarize(events, top=10):
+    durations = defaultdict(list)
+    for event in events:
+        if event.get("ph") == "X":
+            durations[(event["cat"], event["name"])].append(event["dur"] / 1e6)
+    lines = [
+        f"{'category':<12} {'name':<60} {'count':>8} {'total s':>10} {'mean s':>8} {'p95 s':>8} {'max s':>8}"
+    ]
+    for (category, name), values in sorted(
+        durations.items(), key=lambda item: sum(item[1]), reverse=True
+    ):
+        values = sorted(values)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        lines.append(
+            f"{category:<12} {name[:60]:<60} {len(values):>8} {sum(values):>10.2f} "
+            f"{sum(values) / len(values):>8.3f} {p95:>8.3f} {values[-1]:>8.3f}"
+        )
+    lines.append("")
+    lines.append("Slowest spans:")
+    slowest = sorted(
+        (event for event in events if event.get("ph") == "X"),
+        key=lambda event: event["dur"],
+        reverse=True,
+    )[:top]
+    for event in slowest:
+        lines.append(
+            f"{event['dur'] / 1e6:>10.3f} s  {event['cat']:<12} {event['name']}  {event.get('args', {})}"
+        )
+    return "\n".join(lines)
@@ -1,25 +1,16 @@
-import json
 import logging
-import os
 import subprocess
 import sys
-from pathlib import Path
-
-
-def save_json(path, content):
-    mode = "w" if os.path.exists(path) else "w+"
-    with open(path, mode) as file:
-        logging.debug(f"Save to {file.name}: {content}")
-        json.dump(content, file, indent=4)
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 
 def filter_fields(fields, src):
     return {field: src[field] if src and field in src else None for field in fields}
 
 
-def subprocess_handle(func, args):
+def subprocess_handle(func, args, **kwargs):
     try:
-        func(args)
+        return func(args, **kwargs)
     except subprocess.CalledProcessError as e:
         logging.error("Subprocess call error")
         logging.error("exit code: {}".format(e.returncode))
@@ -33,19 +24,20 @@ def subprocess_handle(func, args):
         raise e
 
 
-def filter_save(struct, fields, path):
-    backup = filter_fields(fields, struct)
-    save_json(path, backup)
-
-
-def count_sizes(output_dir):
-    git = 0
-    repo_dir = f"{output_dir}/repos"
-    repos = list(os.walk(repo_dir))[0][1]
-    for repository in repos:
-        git += sum(
-            p.stat().st_size
-            for p in Path(f"{repo_dir}/{repository}/content").rglob("*")
-        )
-    meta = sum(p.stat().st_size for p in Path(output_dir).rglob("*")) - git
-    return {"git": git, "meta": meta}
+def run_parallel(func, items, workers):
+    # Items are submitted lazily so a streamed collection is never fully
+    # buffered; the first error is re-raised once running tasks finish
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for item in items:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                errors += [f.exception() for f in done if f.exception()]
+                if errors:
+                    break
+            pending.add(executor.submit(func, item))
+        done, _ = wait(pending)
+        errors += [f.exception() for f in done if f.exception()]
+    if errors:
+        raise errors[0]
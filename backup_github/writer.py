@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import queue
+import threading
+
+from backup_github.utils import filter_fields
+
+REPOSITORY_FIELDS = ["id", "name", "private", "fork", "default_branch", "visibility"]
+MEMBER_FIELDS = ["id", "login"]
+MEMBERSHIP_FIELDS = ["state", "role"]
+ISSUE_FIELDS = ["title", "body", "created_at", "state"]
+PULL_FIELDS = ["title", "body", "created_at", "state", "merge_commit_sha"]
+REF_FIELDS = ["ref", "sha"]
+USER_FIELDS = ["login"]
+USER_TABLE_FIELDS = ["id", "login"]
+COMMENT_FIELDS = ["id", "body", "created_at"]
+REVIEW_FIELDS = ["id", "body", "state", "submitted_at", "commit_id"]
+REVIEW_COMMENT_FIELDS = [
+    "id",
+    "body",
+    "created_at",
+    "diff_hunk",
+    "path",
+    "position",
+    "original_position",
+    "commit_id",
+    "original_commit_id",
+    "in_reply_to_id",
+]
+
+
+def dumps(content):
+    # The tree is meant to be the same whatever is installed, so it is not
+    # written with orjson, which indents and escapes differently
+    return json.dumps(content, indent=4).encode()
+
+
+class UserStore:
+    path = str
+    users = dict
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.users = {}
+        self.dirty = False
+        if os.path.exists(path):
+            with open(path) as file:
+                self.users = json.load(file)
+
+    def seed(self, members):
+        for member in members:
+            self.ref(member)
+
+    def ref(self, user):
+        # Users are interned by login, so a known user costs a dict lookup
+        # and the records only carry the login
+        if not user:
+            return None
+        login = user["login"]
+        known = self.users.get(login)
+        if known is not None and (known["id"] is not None or not user.get("id")):
+            return login
+        with self.lock:
+            self.users[login] = filter_fields(USER_TABLE_FIELDS, user)
+            self.dirty = True
+        return login
+
+    def save(self, writer):
+        with self.lock:
+            if not self.dirty:
+                return
+            users = dict(sorted(self.users.items()))
+            self.dirty = False
+        writer.write([(self.path, users)], atomic=True)
+
+
+class TreeWriter:
+    def __init__(self, users=None, sizes=None):
+        self.users = users
+        self.sizes = sizes
+        self.dirs = set()
+        self.dirs_lock = threading.Lock()
+
+    def save_repository(self, repo, repo_dir):
+        self.write([(f"{repo_dir}/repo.json", filter_fields(REPOSITORY_FIELDS, repo))])
+
+    def save_member(self, member, membership, member_dir):
+        if self.users is not None:
+            self.users.ref(member)
+        self.write(
+            [
+                (f"{member_dir}/member.json", filter_fields(MEMBER_FIELDS, member)),
+                (
+                    f"{member_dir}/membership.json",
+                    filter_fields(MEMBERSHIP_FIELDS, membership),
+                ),
+            ]
+        )
+
+    def save_issue(self, issue, issue_dir):
+        self.write(
+            [(f"{issue_dir}/comments", None)]
+            + self.__with_users(
+                f"{issue_dir}/issue.json",
+                filter_fields(ISSUE_FIELDS, issue),
+                assignee=issue["assignee"],
+                user=issue["user"],
+            )
+        )
+
+    def save_pull(self, pull, pull_dir):
+        self.write(
+            [
+                (f"{pull_dir}/comments", None),
+                (f"{pull_dir}/reviews", None),
+                (f"{pull_dir}/head.json", filter_fields(REF_FIELDS, pull["head"])),
+                (f"{pull_dir}/base.json", filter_fields(REF_FIELDS, pull["base"])),
+            ]
+            + self.__with_users(
+                f"{pull_dir}/pull.json",
+                filter_fields(PULL_FIELDS, pull),
+                assignee=pull["assignee"],
+                user=pull["user"],
+            )
+        )
+
+    def save_comments(self, comments, outer_dir):
+        self.write(self.__comments(comments, outer_dir, COMMENT_FIELDS))
+
+    def save_review(self, review, review_dir):
+        self.write(
+            [(f"{review_dir}/comments", None)]
+            + self.__with_users(
+                f"{review_dir}/review.json",
+                filter_fields(REVIEW_FIELDS, review),
+                user=review["user"],
+            )
+        )
+
+    def save_review_comments(self, comments, review_dir):
+        self.write(self.__comments(comments, review_dir, REVIEW_COMMENT_FIELDS))
+
+    def __comments(self, comments, outer_dir, fields):
+        records = []
+        for comment in comments:
+            records += self.__with_users(
+                f'{outer_dir}/comments/{comment["id"]}/comment.json',
+                filter_fields(fields, comment),
+                user=comment["user"],
+            )
+        return records
+
+    def __with_users(self, path, content, **users):
+        # With a user store the record references users by login, otherwise
+        # each user is written next to it
+        if self.users is not None:
+            refs = {name: self.users.ref(user) for name, user in users.items()}
+            return [(path, {**content, **refs})]
+        directory = os.path.dirname(path)
+        return [(path, content)] + [
+            (f"{directory}/{name}.json", filter_fields(USER_FIELDS, user))
+            for name, user in users.items()
+        ]
+
+    def write(self, records, atomic=False):
+        self.store(records, atomic)
+
+    def store(self, records, atomic=False):
+        # A record without content only creates its directory
+        for path, content in records:
+            if self.sizes is not None:
+                self.sizes.touch(path)
+            if content is None:
+                self.makedirs(path)
+                continue
+            self.makedirs(os.path.dirname(path))
+            logging.debug(f"Save to {path}: {content}")
+            target = f"{path}.tmp" if atomic else path
+            with open(target, "wb") as file:
+                file.write(dumps(content))
+            if atomic:
+                os.replace(target, path)
+
+    def makedirs(self, path):
+        with self.dirs_lock:
+            if path in self.dirs:
+                return
+        os.makedirs(path, exist_ok=True)
+        with self.dirs_lock:
+            self.dirs.add(path)
+
+    def store_batch(self, batch):
+        for records, atomic in batch:
+            self.store(records, atomic)
+
+    def flush(self):
+        if self.users is not None:
+            self.users.save(self)
+
+    def close(self):
+        self.flush()
+
+
+class QueuedWriter(TreeWriter):
+    queue_size = int
+    batch_size = int
+
+    def __init__(self, users=None, sizes=None, queue_size=10000, batch_size=100):
+        super().__init__(users, sizes)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        # Fetchers only enqueue records, a single thread writes them in
+        # order, so a state file queued after some records is never on disk
+        # before them
+        self.queue = queue.Queue(queue_size)
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.error = None
+
+    def write(self, records, atomic=False):
+        self.__raise()
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, daemon=True)
+                self.thread.start()
+        self.queue.put((records, atomic))
+
+    def flush(self):
+        if self.users is not None:
+            self.users.save(self)
+        self.queue.join()
+        self.__raise()
+
+    def close(self):
+        if self.users is not None:
+            self.users.save(self)
+        with self.thread_lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+        self.__raise()
+
+    def __raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def __run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                # After a failure the remaining records are dropped and the
+                # error is raised to the next caller
+                if self.error is None:
+                    self.store_batch([item for item in batch if item is not None])
+            except Exception as e:
+                logging.error(f"Write error: {e}")
+                self.error = e
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is None:
+                return
@@ -0,0 +1,448 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from backup_github.github import endpoint
+
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+def timestamp(minutes):
+    return (EPOCH + timedelta(minutes=minutes)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def draw(rng, mean):
+    # Most items get a few children and some get many, like real projects
+    if mean <= 0:
+        return 0
+    return int(rng.expovariate(1 / mean))
+
+
+class Organization:
+    name = str
+
+    def __init__(
+        self,
+        name="benchmark",
+        repos=5,
+        members=20,
+        issues=50,
+        pull_ratio=0.5,
+        comments=3.0,
+        reviews=1.0,
+        review_comments=2.0,
+        commits=20,
+        file_size=4096,
+        seed=0,
+    ):
+        self.name = name
+        self.commits = commits
+        self.file_size = file_size
+        rng = random.Random(seed)
+        self.ids = iter(range(1, 10**9))
+        self.members = [
+            {"login": f"user{i}", "id": next(self.ids), "type": "User"}
+            for i in range(members)
+        ]
+        self.roles = {
+            member["login"]: "admin" if i == 0 else "member"
+            for i, member in enumerate(self.members)
+        }
+        self.repos = {}
+        self.items = {}
+        self.comments = {}
+        self.reviews = {}
+        self.review_comments = {}
+        for i in range(repos):
+            repo = f"repo{i}"
+            self.repos[repo] = {
+                "id": next(self.ids),
+                "name": repo,
+                "full_name": f"{name}/{repo}",
+                "private": False,
+                "fork": False,
+                "default_branch": "main",
+                "visibility": "public",
+                "has_issues": True,
+                "size": (commits * file_size + 1023) // 1024,
+                "pushed_at": timestamp(i),
+                "updated_at": timestamp(i),
+            }
+            self.__generate(
+                rng, repo, issues, pull_ratio, comments, reviews, review_comments
+            )
+
+    def user(self, rng):
+        if not self.members:
+            return {"login": "ghost", "id": 10001, "type": "User"}
+        return rng.choice(self.members)
+
+    def __generate(
+        self, rng, repo, issues, pull_ratio, comments, reviews, review_comments
+    ):
+        url = f"https://github.com/{self.name}/{repo}"
+        items = []
+        for number in range(1, issues + 1):
+            pull = rng.random() < pull_ratio
+            created = number * 10
+            item = {
+                "id": next(self.ids),
+                "number": number,
+                "title": f"Item {number}",
+                "body": "x" * rng.randint(0, 2000),
+                "state": rng.choice(["open", "closed"]),
+                "created_at": timestamp(created),
+                "updated_at": timestamp(created + rng.randint(0, 10**5)),
+                "html_url": f"{url}/{'pull' if pull else 'issues'}/{number}",
+                "user": self.user(rng),
+                "assignee": self.user(rng) if rng.random() < 0.5 else None,
+            }
+            if pull:
+                item["pull_request"] = {"html_url": item["html_url"]}
+                item["head"] = {"ref": f"branch{number}", "sha": f"{number:040x}"}
+                item["base"] = {"ref": "main", "sha": f"{0:040x}"}
+                item["merge_commit_sha"] = None
+            items.append(item)
+            self.comments[(repo, number)] = [
+                self.__comment(rng, repo, number, created + j)
+                for j in range(draw(rng, comments))
+            ]
+            item["comments"] = len(self.comments[(repo, number)])
+            if pull:
+                self.reviews[(repo, number)] = []
+                for j in range(draw(rng, reviews)):
+                    review = {
+                        "id": next(self.ids),
+                        "body": "x" * rng.randint(0, 500),
+                        "state": rng.choice(
+                            ["APPROVED", "COMMENTED", "CHANGES_REQUESTED"]
+                        ),
+                        "submitted_at": timestamp(created + j),
+                        "commit_id": item["head"]["sha"],
+                        "user": self.user(rng),
+                    }
+                    self.reviews[(repo, number)].append(review)
+                    self.review_comments[(repo, review["id"])] = [
+                        self.__review_comment(rng, repo, number, review, created + k)
+                        for k in range(draw(rng, review_comments))
+                    ]
+        self.items[repo] = items
+
+    def __comment(self, rng, repo, number, minutes):
+        return {
+            "id": next(self.ids),
+            "body": "x" * rng.randint(0, 1000),
+            "created_at": timestamp(minutes),
+            "updated_at": timestamp(minutes),
+            "user": self.user(rng),
+            "issue_url": f"https://api.github.com/repos/{self.name}/{repo}/issues/{number}",
+        }
+
+    def __review_comment(self, rng, repo, number, review, minutes):
+        return {
+            "id": next(self.ids),
+            "body": "x" * rng.randint(0, 1000),
+            "created_at": timestamp(minutes),
+            "updated_at": timestamp(minutes),
+            "diff_hunk": "@@ -1 +1 @@",
+            "path": "file.txt",
+            "position": 1,
+            "original_position": 1,
+            "commit_id": review["commit_id"],
+            "original_commit_id": review["commit_id"],
+            "in_reply_to_id": None,
+            "pull_request_review_id": review["id"],
+            "user": review["user"],
+            "pull_request_url": f"https://api.github.com/repos/{self.name}/{repo}/pulls/{number}",
+        }
+
+
+PULL_ONLY = ["head", "base", "merge_commit_sha"]
+ISSUE_ONLY = ["comments"]
+
+
+def without(items, fields):
+    # Issue and pull listings carry different fields of the same item
+    return [
+        {name: value for name, value in item.items() if name not in fields}
+        for item in items
+    ]
+
+
+def ordered(items, query):
+    # Like GitHub, listings are sorted by creation, newest first
+    field = "updated_at" if query.get("sort") == "updated" else "created_at"
+    return sorted(
+        items,
+        key=lambda item: (item[field], item["number"]),
+        reverse=query.get("direction", "desc") == "desc",
+    )
+
+
+def since(items, query):
+    if "since" not in query:
+        return items
+    return [item for item in items if item["updated_at"] >= query["since"]]
+
+
+class FakeGithub:
+    latency = float
+    jitter = float
+    error_rate = float
+    secondary_rate = float
+    rate_limit = int
+
+    def __init__(
+        self,
+        organization,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        secondary_rate=0.0,
+        rate_limit=10**6,
+        seed=0,
+    ):
+        self.organization = organization
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.secondary_rate = secondary_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset = int(time.time()) + 3600
+        self.used = 0
+        self.endpoints = Counter()
+        self.statuses = Counter()
+        self.bytes = 0
+        self.server = None
+        self.thread = None
+        org = re.escape(organization.name)
+        repo = r"(?P<repo>[^/]+)"
+        self.routes = [
+            (rf"/orgs/{org}", self.__organization),
+            (rf"/orgs/{org}/members", self.__members),
+            (rf"/orgs/{org}/memberships/(?P<login>[^/]+)", self.__membership),
+            (rf"/orgs/{org}/repos", self.__repos),
+            (rf"/repos/{org}/{repo}", self.__repo),
+            (rf"/repos/{org}/{repo}/issues", self.__issues),
+            (rf"/repos/{org}/{repo}/pulls", self.__pulls),
+            (rf"/repos/{org}/{repo}/issues/comments", self.__repo_comments),
+            (rf"/repos/{org}/{repo}/pulls/comments", self.__repo_review_comments),
+            (rf"/repos/{org}/{repo}/issues/(?P<number>\d+)/comments", self.__comments),
+            (rf"/repos/{org}/{repo}/pulls/(?P<number>\d+)/reviews", self.__reviews),
+            (
+                rf"/repos/{org}/{repo}/pulls/(?P<number>\d+)/reviews/(?P<review>\d+)/comments",
+                self.__review_comments,
+            ),
+            (r"/rate_limit", self.__rate_limit),
+        ]
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.server.github = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self, reset=False):
+        with self.lock:
+            stats = {
+                "total": sum(self.endpoints.values()),
+                "bytes": self.bytes,
+                "endpoints": dict(self.endpoints.most_common()),
+                "statuses": {
+                    str(status): count
+                    for status, count in sorted(self.statuses.items())
+                },
+            }
+            if reset:
+                self.endpoints = Counter()
+                self.statuses = Counter()
+                self.bytes = 0
+        return stats
+
+    def handle(self, request):
+        url = urlsplit(request.path)
+        query = dict(parse_qsl(url.query))
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            self.used += 1
+            remaining = max(self.rate_limit - self.used, 0)
+            fault = self.rng.random()
+        headers = {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(self.reset),
+        }
+        if remaining == 0:
+            status, body = 403, {"message": "API rate limit exceeded"}
+        elif fault < self.error_rate:
+            status, body = 502, {"message": "Server Error"}
+        elif fault < self.error_rate + self.secondary_rate:
+            headers["Retry-After"] = "1"
+            status, body = 403, {"message": "You have exceeded a secondary rate limit"}
+        else:
+            status, body = self.__route(url.path, query, request, headers)
+        content = b"" if body is None else json.dumps(body).encode()
+        if status == 200:
+            headers["ETag"] = f'"{hashlib.md5(content).hexdigest()}"'
+            if request.headers.get("If-None-Match") == headers["ETag"]:
+                status, content = 304, b""
+        with self.lock:
+            self.endpoints[endpoint(url.path)] += 1
+            self.statuses[status] += 1
+            self.bytes += len(content)
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(content)))
+        request.end_headers()
+        request.wfile.write(content)
+
+    def __route(self, path, query, request, headers):
+        for pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path.rstrip("/"))
+            if match is None:
+                continue
+            body = handler(query, **match.groupdict())
+            if body is None:
+                break
+            if not isinstance(body, list):
+                return 200, body
+            return 200, self.__paginate(body, path, query, request, headers)
+        return 404, {"message": "Not Found"}
+
+    def __paginate(self, items, path, query, request, headers):
+        page = int(query.get("page", 1))
+        per_page = min(int(query.get("per_page", 30)), 100)
+        last = max((len(items) + per_page - 1) // per_page, 1)
+        base = f"http://{request.headers['Host']}{path}"
+        links = []
+        if page < last:
+            links.append(
+                f'<{base}?{urlencode({**query, "page": page + 1})}>; rel="next"'
+            )
+            links.append(f'<{base}?{urlencode({**query, "page": last})}>; rel="last"')
+        if links:
+            headers["Link"] = ", ".join(links)
+        start = (page - 1) * per_page
+        return items[start:][:per_page]
+
+    def __organization(self, query):
+        return {
+            "login": self.organization.name,
+            "id": 1,
+            "public_repos": len(self.organization.repos),
+        }
+
+    def __members(self, query):
+        return self.organization.members
+
+    def __membership(self, query, login):
+        if login not in self.organization.roles:
+            return None
+        return {"state": "active", "role": self.organization.roles[login]}
+
+    def __repos(self, query):
+        return list(self.organization.repos.values())
+
+    def __repo(self, query, repo):
+        return self.organization.repos.get(repo)
+
+    def __issues(self, query, repo):
+        if repo not in self.organization.items:
+            return None
+        return without(
+            ordered(since(self.organization.items[repo], query), query), PULL_ONLY
+        )
+
+    def __pulls(self, query, repo):
+        if repo not in self.organization.items:
+            return None
+        pulls = [
+            item for item in self.organization.items[repo] if "pull_request" in item
+        ]
+        return without(ordered(pulls, query), ISSUE_ONLY)
+
+    def __repo_comments(self, query, repo):
+        if repo not in self.organization.items:
+            return None
+        return since(
+            [
+                comment
+                for item in self.organization.items[repo]
+                for comment in self.organization.comments[(repo, item["number"])]
+            ],
+            query,
+        )
+
+    def __repo_review_comments(self, query, repo):
+        if repo not in self.organization.items:
+            return None
+        return since(
+            [
+                comment
+                for item in self.organization.items[repo]
+                for review in self.organization.reviews.get((repo, item["number"]), [])
+                for comment in self.organization.review_comments[(repo, review["id"])]
+            ],
+            query,
+        )
+
+    def __comments(self, query, repo, number):
+        return self.organization.comments.get((repo, int(number)))
+
+    def __reviews(self, query, repo, number):
+        return self.organization.reviews.get((repo, int(number)))
+
+    def __review_comments(self, query, repo, number, review):
+        return self.organization.review_comments.get((repo, int(review)))
+
+    def __rate_limit(self, query):
+        with self.lock:
+            core = {
+                "limit": self.rate_limit,
+                "remaining": max(self.rate_limit - self.used, 0),
+                "reset": self.reset,
+                "used": self.used,
+            }
+        return {"resources": {"core": core}, "rate": core}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so connection reuse of the client is measured as well
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.github.handle(self)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,56 @@
+import os
+import random
+import subprocess
+
+
+def fast_import_stream(commits, file_size, seed):
+    # Every commit rewrites one of a few files with incompressible content,
+    # so the object store grows by about file_size per commit
+    rng = random.Random(seed)
+    chunks = []
+    for number in range(commits):
+        content = (
+            rng.getrandbits(8 * file_size).to_bytes(file_size, "little")
+            if file_size
+            else b""
+        )
+        message = f"Commit {number}\n".encode()
+        chunks += [
+            b"blob\n",
+            f"mark :{2 * number + 1}\n".encode(),
+            f"data {len(content)}\n".encode(),
+            content,
+            b"\n",
+            b"commit refs/heads/main\n",
+            f"mark :{2 * number + 2}\n".encode(),
+            f"committer Benchmark <benchmark@example.com> {1672531200 + number} +0000\n".encode(),
+            f"data {len(message)}\n".encode(),
+            message,
+        ]
+        if number:
+            chunks.append(f"from :{2 * number}\n".encode())
+        chunks.append(f"M 100644 :{2 * number + 1} file{number % 10}.bin\n\n".encode())
+    return b"".join(chunks)
+
+
+def create_remotes(root, organization, seed=0):
+    # Bare repositories laid out as {root}/{org}/{repo}.git, so the backup
+    # clones them from file://{root}
+    for index, repo in enumerate(organization.repos):
+        path = os.path.join(root, organization.name, f"{repo}.git")
+        if os.path.isdir(path):
+            continue
+        os.makedirs(path)
+        subprocess.check_call(["git", "init", "--quiet", "--bare", path])
+        subprocess.check_call(
+            ["git", "-C", path, "symbolic-ref", "HEAD", "refs/heads/main"]
+        )
+        if organization.commits:
+            subprocess.run(
+                ["git", "-C", path, "fast-import", "--quiet"],
+                input=fast_import_stream(
+                    organization.commits, organization.file_size, seed + index
+                ),
+                check=True,
+            )
+    return f"file://{os.path.abspath(root)}"
@@ -0,0 +1,312 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.fake_github import FakeGithub, Organization
+from benchmarks.remote import create_remotes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Items each phase is measured by
+PHASES = {
+    "repositories": ["repositories"],
+    "members": ["members"],
+    "issues": ["issues"],
+    "pulls": ["pulls"],
+    "issues_pulls": ["issues", "pulls"],
+}
+COMPARED = [
+    "wall_seconds",
+    "cpu_seconds",
+    "peak_rss_bytes",
+    "requests",
+    "files_written",
+    "bytes_written",
+]
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Benchmark a backup against a local fake GitHub organization",
+    )
+    parser.add_argument("--repos", type=int, default=5, help="number of repositories")
+    parser.add_argument("--members", type=int, default=20, help="number of members")
+    parser.add_argument(
+        "--issues", type=int, default=50, help="issues and pulls per repository"
+    )
+    parser.add_argument(
+        "--pull-ratio", type=float, default=0.5, help="share of pulls among issues"
+    )
+    parser.add_argument(
+        "--comments", type=float, default=3.0, help="mean comments per issue or pull"
+    )
+    parser.add_argument(
+        "--reviews", type=float, default=1.0, help="mean reviews per pull"
+    )
+    parser.add_argument(
+        "--review-comments", type=float, default=2.0, help="mean comments per review"
+    )
+    parser.add_argument(
+        "--commits", type=int, default=20, help="commits per repository"
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=4096, help="bytes added by every commit"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every response"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="random extra latency up to seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of 502 responses"
+    )
+    parser.add_argument(
+        "--secondary-rate",
+        type=float,
+        default=0.0,
+        help="share of 403 secondary rate limit responses",
+    )
+    parser.add_argument(
+        "--rate-limit", type=int, default=10**6, help="primary rate limit of the hour"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of generated data and faults"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=1,
+        help="backups run one after another into the same directory, later runs measure updates",
+    )
+    parser.add_argument(
+        "--output", default="benchmark.json", help="JSON file with the results"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="results of an earlier benchmark to compare with",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="directory for remotes and backups, kept after the run",
+    )
+    parser.add_argument(
+        "backup_args",
+        nargs=argparse.REMAINDER,
+        help="arguments passed to backup-github after --, --all by default",
+    )
+    parsed = parser.parse_args(args)
+    if parsed.backup_args[:1] == ["--"]:
+        parsed.backup_args = parsed.backup_args[1:]
+    return parsed
+
+
+def read_metrics(path):
+    metrics = {}
+    if not os.path.exists(path):
+        return metrics
+    with open(path) as file:
+        for family in text_string_to_metric_families(file.read()):
+            for sample in family.samples:
+                metrics.setdefault(sample.name, []).append(
+                    (sample.labels, sample.value)
+                )
+    return metrics
+
+
+def labelled(metrics, name, label):
+    return {labels[label]: value for labels, value in metrics.get(name, [])}
+
+
+def written(directory, since):
+    files = size = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            if stat.st_mtime >= since:
+                files += 1
+                size += stat.st_size
+    return files, size
+
+
+def run_backup(organization, server, git_url, work_dir, backup_args, number):
+    output_dir = os.path.join(work_dir, "backup")
+    metrics_path = os.path.join(work_dir, f"metrics-{number}.prom")
+    log_path = os.path.join(work_dir, f"backup-{number}.log")
+    command = [
+        sys.executable,
+        "-m",
+        "backup_github.main",
+        organization.name,
+        "--token",
+        "benchmark",
+        "--output-directory",
+        output_dir,
+        "--metrics_path",
+        metrics_path,
+        "--api-url",
+        server.url,
+        "--git-url",
+        git_url,
+        *(backup_args or ["--all"]),
+    ]
+    server.stats(reset=True)
+    started = time.time()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT
+        )
+        # wait4 reports the peak RSS of the backup and of the git commands it ran
+        _, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - started
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    if process.returncode != 0 or not os.path.exists(metrics_path):
+        with open(log_path) as log:
+            logging.warning("Backup failed:\n" + "".join(log.readlines()[-20:]))
+    metrics = read_metrics(metrics_path)
+    requests = server.stats()
+    files, size = written(os.path.join(output_dir, organization.name), started)
+    durations = labelled(metrics, "github_backup_phase_duration_seconds", "phase")
+    items = labelled(metrics, "github_backup_items_written_total", "resource")
+    phases = {}
+    for phase, resources in PHASES.items():
+        if phase not in durations:
+            continue
+        seconds = durations[phase]
+        count = sum(items.get(resource, 0) for resource in resources)
+        phases[phase] = {
+            "seconds": seconds,
+            "items": int(count),
+            "items_per_second": count / seconds if seconds else None,
+        }
+    return {
+        "exit_code": process.returncode,
+        "success": labelled(metrics, "github_backup_success", "organization").get(
+            organization.name
+        )
+        == 1,
+        "wall_seconds": wall,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        # Kilobytes on Linux, bytes on macOS
+        "peak_rss_bytes": usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        "requests": requests["total"],
+        "response_bytes": requests["bytes"],
+        "endpoints": requests["endpoints"],
+        "statuses": requests["statuses"],
+        "retries": {
+            reason: int(value)
+            for reason, value in labelled(
+                metrics, "github_backup_http_retries_total", "reason"
+            ).items()
+        },
+        "files_written": files,
+        "bytes_written": size,
+        "phases": phases,
+        "items": {resource: int(value) for resource, value in items.items()},
+    }
+
+
+def compare(results, baseline):
+    lines = [
+        f"{'run':<4} {'metric':<28} {'baseline':>14} {'current':>14} {'change':>8}"
+    ]
+    for number, (current, before) in enumerate(
+        zip(results["runs"], baseline["runs"]), 1
+    ):
+        values = [
+            (metric, before.get(metric), current.get(metric)) for metric in COMPARED
+        ]
+        for phase in sorted(set(current["phases"]) | set(before["phases"])):
+            values.append(
+                (
+                    f"{phase} seconds",
+                    before["phases"].get(phase, {}).get("seconds"),
+                    current["phases"].get(phase, {}).get("seconds"),
+                )
+            )
+        for metric, old, new in values:
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else ""
+            lines.append(
+                f"{number:<4} {metric:<28} {old:>14.2f} {new:>14.2f} {change:>8}"
+            )
+    return "\n".join(lines)
+
+
+def run(args):
+    organization = Organization(
+        repos=args.repos,
+        members=args.members,
+        issues=args.issues,
+        pull_ratio=args.pull_ratio,
+        comments=args.comments,
+        reviews=args.reviews,
+        review_comments=args.review_comments,
+        commits=args.commits,
+        file_size=args.file_size,
+        seed=args.seed,
+    )
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="backup-github-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    scenario = {
+        name: value
+        for name, value in vars(args).items()
+        if name not in ["output", "baseline", "work_dir"]
+    }
+    results = {"scenario": scenario, "runs": []}
+    try:
+        git_url = create_remotes(
+            os.path.join(work_dir, "remotes"), organization, args.seed
+        )
+        with FakeGithub(
+            organization,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            secondary_rate=args.secondary_rate,
+            rate_limit=args.rate_limit,
+            seed=args.seed,
+        ) as server:
+            for number in range(1, args.runs + 1):
+                logging.info(f"Start benchmark run {number} against {server.url}")
+                result = run_backup(
+                    organization, server, git_url, work_dir, args.backup_args, number
+                )
+                logging.info(
+                    f"Run {number}: {result['wall_seconds']:.2f} s, {result['requests']} requests, "
+                    f"{result['files_written']} files, exit code {result['exit_code']}"
+                )
+                results["runs"].append(result)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main(args=None):
+    parsed_args = parse_args(args)
+    results = run(parsed_args)
+    with open(parsed_args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    logging.info(f"Results saved to {parsed_args.output}")
+    if parsed_args.baseline:
+        with open(parsed_args.baseline) as file:
+            print(compare(results, json.load(file)))
+    return 0 if all(result["exit_code"] == 0 for result in results["runs"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+from backup_github.aio import AsyncBackup, AsyncGithubAPI, run_concurrent
+from backup_github.archive import create_writer
+from backup_github.catalog import RepositoryCatalog
+from backup_github.metrics import registry
+from backup_github.ratelimit import RateLimiter
+from tests import backup_test
+
+httpx = pytest.importorskip("httpx")
+
+fixtures = backup_test.TestBackup
+ROUTES = {
+    "/orgs/org/members": fixtures.users,
+    "/orgs/org/memberships/user1": fixtures.membership[0],
+    "/orgs/org/memberships/user2": fixtures.membership[1],
+    "/repos/org/test/issues": fixtures.issues + fixtures.pulls,
+    "/repos/org/test/pulls": fixtures.pulls,
+    "/repos/org/test/issues/1/comments": fixtures.issues_comments,
+    "/repos/org/test/issues/3/comments": fixtures.pulls_comments,
+    "/repos/org/test/pulls/3/reviews": fixtures.reviews,
+    "/repos/org/test/pulls/3/reviews/1/comments": fixtures.reviews_comments,
+}
+
+
+def handler(request):
+    assert request.headers["Authorization"] == "Bearer token"
+    return httpx.Response(200, json=ROUTES.get(request.url.path, []))
+
+
+def files(path):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), path)
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class TestAsyncBackup:
+    def test_same_tree_as_expected(self):
+        expected = "tests/resources/backup"
+        with tempfile.TemporaryDirectory() as tmp:
+            backup = AsyncBackup(
+                "token", "org", tmp, ["test"], transport=httpx.MockTransport(handler)
+            )
+            os.makedirs(f"{backup.output_dir}/repos/test")
+            asyncio.run(backup.run(members=True, issues=True, pulls=True))
+            assert files(backup.output_dir) == files(expected)
+            for path in files(expected):
+                with open(f"{expected}/{path}") as expected_file:
+                    with open(f"{backup.output_dir}/{path}") as actual_file:
+                        assert json.load(expected_file) == json.load(actual_file), path
+
+    def test_shared_user_table(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for member in fixtures.users:
+                os.makedirs(f"{tmp}/org/members/{member['login']}")
+                with open(
+                    f"{tmp}/org/members/{member['login']}/member.json", "w"
+                ) as file:
+                    json.dump({"id": member["id"], "login": member["login"]}, file)
+            writer = create_writer(f"{tmp}/org", dedup_users=True)
+            backup = AsyncBackup(
+                "token",
+                "org",
+                tmp,
+                ["test"],
+                transport=httpx.MockTransport(handler),
+                writer=writer,
+            )
+            os.makedirs(f"{backup.output_dir}/repos/test")
+            asyncio.run(backup.run(issues=True, pulls=True))
+            writer.close()
+            with open(f"{tmp}/org/users.json") as file:
+                users = json.load(file)
+        assert {"user1", "user2", "login1", "login2"} <= set(users)
+
+    def test_pagination(self):
+        def paged(request):
+            if request.url.params.get("page") == "2":
+                return httpx.Response(200, json=[{"id": 2}])
+            return httpx.Response(
+                200,
+                json=[{"id": 1}],
+                headers={
+                    "Link": f'<{request.url.copy_set_param("page", "2")}>; rel="next"'
+                },
+            )
+
+        async def collect():
+            backup = AsyncBackup(
+                "token", "org", tmp, ["test"], transport=httpx.MockTransport(paged)
+            )
+            async with backup.api:
+                return [m async for m in backup.api.get_members()]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            assert asyncio.run(collect()) == [{"id": 1}, {"id": 2}]
+
+    def test_skip_items_without_comments(self):
+        paths = []
+
+        def recorded(request):
+            paths.append(request.url.path)
+            if request.url.path == "/repos/org/test/issues":
+                return httpx.Response(
+                    200, json=[{**issue, "comments": 0} for issue in fixtures.issues]
+                )
+            return handler(request)
+
+        catalog = RepositoryCatalog(None, ["test", "other"])
+        catalog.repos = {"other": {"name": "other", "has_issues": False}}
+        with tempfile.TemporaryDirectory() as tmp:
+            backup = AsyncBackup(
+                "token",
+                "org",
+                tmp,
+                ["test", "other"],
+                transport=httpx.MockTransport(recorded),
+                catalog=catalog,
+            )
+            for repo in ["test", "other"]:
+                os.makedirs(f"{backup.output_dir}/repos/{repo}")
+            asyncio.run(backup.run(issues=True))
+            assert os.path.isdir(f"{backup.output_dir}/repos/test/issues/1/comments")
+        assert "/repos/org/test/issues/1/comments" not in paths
+        assert "/repos/org/other/issues" not in paths
+        assert (
+            registry.get_sample_value(
+                "github_backup_items_written_total",
+                {"organization": "org", "resource": "issues"},
+            )
+            >= 2
+        )
+
+    def test_shared_limiters(self):
+        limiter = RateLimiter()
+        with tempfile.TemporaryDirectory() as tmp:
+            backup = AsyncBackup("token", "org", tmp, [], limiters={"token": limiter})
+        assert backup.api.limiter is limiter
+
+    def test_primary_rate_limit_waits(self):
+        responses = [
+            httpx.Response(
+                403,
+                headers={
+                    "X-RateLimit-Limit": "5000",
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": str(int(time.time()) - 60),
+                },
+            ),
+            httpx.Response(200, json=[]),
+        ]
+
+        async def collect():
+            api = AsyncGithubAPI(
+                "token",
+                "org",
+                tmp,
+                10,
+                0.4,
+                transport=httpx.MockTransport(lambda request: responses.pop(0)),
+            )
+            async with api:
+                return await api.make_request(f"{api.api_url}/orgs/org/members")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            started = time.perf_counter()
+            assert asyncio.run(collect()) == []
+            assert time.perf_counter() - started >= 0.2
+        assert responses == []
+
+
+class TestRunConcurrent:
+    def test_limit(self):
+        running = []
+        peak = []
+
+        async def func(item):
+            running.append(item)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(item)
+
+        asyncio.run(run_concurrent(func, range(20), 3))
+        assert max(peak) == 3
+
+    def test_error(self):
+        async def func(item):
+            if item == 5:
+                raise ValueError(item)
+
+        with pytest.raises(ValueError):
+            asyncio.run(run_concurrent(func, range(10), 2))
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+
+import pytest
+import requests_mock
+
+from backup_github import archive
+from backup_github.backup import Backup
+from tests import backup_test
+
+
+def tree(path):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), path)
+        for root, dirs, files in os.walk(path)
+        for name in dirs + files
+        if name not in ["checkpoint.json", "journal.json"]
+    )
+
+
+def assert_same_tree(expected, actual):
+    files = tree(expected)
+    assert tree(actual) == files
+    for path in files:
+        if os.path.isfile(f"{expected}/{path}"):
+            with open(f"{expected}/{path}") as expected_file:
+                with open(f"{actual}/{path}") as actual_file:
+                    assert json.load(expected_file) == json.load(actual_file), path
+
+
+class TestArchive:
+    def backup(self, output_dir, output_format):
+        backup = Backup(
+            "token", "org", output_dir, ["test"], output_format=output_format
+        )
+        os.makedirs(f"{backup.output_dir}/repos/test", exist_ok=True)
+        with requests_mock.Mocker() as m:
+            backup_test.TestBackup.mock_github(backup_test.TestBackup(), m)
+            backup.backup_members()
+            backup.backup_issues()
+            backup.backup_pulls()
+        backup.writer.close()
+        return backup.output_dir
+
+    def test_encoders_agree(self, monkeypatch):
+        record = {"path": "1/issue.json", "content": {"title": "Grüße", "n": [1, None]}}
+        encoded = archive.encode(record)
+        monkeypatch.setattr(archive, "orjson", None)
+        assert archive.encode(record) == encoded
+
+    def test_archive_layout(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            org_dir = self.backup(temp_dir, "archive")
+            assert sorted(os.listdir(f"{org_dir}/repos/test")) == [
+                "issues.idx",
+                f"issues.jsonl.{archive.EXTENSIONS[archive.default_compression()]}",
+                "pulls.idx",
+                f"pulls.jsonl.{archive.EXTENSIONS[archive.default_compression()]}",
+            ]
+            pull = archive.read_item(f"{org_dir}/repos/test/pulls", "3")
+            assert "3/reviews/1/comments/1/comment.json" in pull
+            assert all(path.startswith("3/") for path in pull)
+
+    def test_runs_do_not_grow_the_archive(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            base = f"{temp_dir}/org/repos/test/pulls"
+            self.backup(temp_dir, "archive")
+            records = list(archive.read(base))
+            self.backup(temp_dir, "archive")
+            # The records of a run are buffered into one frame per stream
+            assert len(archive.load_index(base)) == 1
+            assert sorted(
+                list(archive.read(base)), key=lambda record: record["path"]
+            ) == sorted(records, key=lambda record: record["path"])
+
+    def test_interrupted_compaction(self, monkeypatch):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            base = f"{temp_dir}/org/repos/test/issues"
+            self.backup(temp_dir, "archive")
+            records = list(archive.read(base))
+            archive.append(base, [("1", archive.encode(records[0]))], "gzip")
+            with monkeypatch.context() as patch:
+                patch.setattr(archive, "recover", lambda base: None)
+                archive.compact(base, frame_size=1)
+            assert os.path.exists(f"{base}.idx.compact")
+            assert archive.read_item(base, "1") == {
+                record["path"]: record["content"]
+                for record in records
+                if record["path"].startswith("1/")
+            }
+            assert len(archive.load_index(base)) == len(records)
+            assert not os.path.exists(f"{base}.idx.compact")
+
+    def test_archive_converts_to_tree(self):
+        with tempfile.TemporaryDirectory() as tree_dir:
+            with tempfile.TemporaryDirectory() as archive_dir:
+                expected = self.backup(tree_dir, "tree")
+                actual = self.backup(archive_dir, "archive")
+                archive.to_tree(actual)
+                assert_same_tree(expected, actual)
+
+    @pytest.mark.parametrize("compression", ["gzip", "zstd"])
+    def test_round_trip(self, compression):
+        if compression == "zstd" and archive.zstandard is None:
+            pytest.skip("zstandard is not installed")
+        with tempfile.TemporaryDirectory() as tree_dir:
+            with tempfile.TemporaryDirectory() as converted_dir:
+                expected = self.backup(tree_dir, "tree")
+                actual = self.backup(converted_dir, "tree")
+                archive.to_archive(actual, compression)
+                assert not os.path.exists(f"{actual}/repos/test/issues")
+                assert os.path.exists(
+                    f"{actual}/repos/test/issues.jsonl.{archive.EXTENSIONS[compression]}"
+                )
+                archive.to_tree(actual)
+                assert_same_tree(expected, actual)
+
+    def test_dedup_users_seeded_from_members(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            org_dir = self.backup(temp_dir, "archive")
+            backup = Backup(
+                "token",
+                "org",
+                temp_dir,
+                ["test"],
+                output_format="archive",
+                dedup_users=True,
+            )
+            with requests_mock.Mocker() as m:
+                backup_test.TestBackup.mock_github(backup_test.TestBackup(), m)
+                backup.backup_pulls()
+            backup.writer.close()
+            pull = archive.read_item(f"{org_dir}/repos/test/pulls", "3")
+            assert pull["3/pull.json"]["user"] == "user1"
+            with open(f"{org_dir}/users.json") as file:
+                users = json.load(file)
+            assert users["user1"]["id"] is not None
@@ -1,12 +1,14 @@
 import argparse
 import json
 import os
+import re
+import subprocess
 import tempfile
 
 import pytest
 import requests_mock
 
-from backup_github.backup import Backup
+from backup_github.backup import Backup, PullListing
 from backup_github.parse_args import parse_args
 
 os.path.join(os.path.dirname(__file__), "..", "tests/resources")
@@ -34,6 +36,20 @@ class TestArgs:
         args_parsed = parse_args(["-t", "token", "test_organization"])
         assert args_parsed.output_dir == "."
 
+    def test_pool_size(self):
+        args_parsed = parse_args(["--pool-size", "32", "test_organization"])
+        assert args_parsed.pool_size == 32
+
+    def test_default_pool_size(self):
+        args_parsed = parse_args(["test_organization"])
+        assert args_parsed.pool_size == 10
+
+    def test_async_unsupported(self):
+        assert parse_args(["--async", "--pool-size", "2", "org"]).use_async
+        for option in [["--incremental"], ["--backend", "graphql"], ["--resume"]]:
+            with pytest.raises(argparse.ArgumentError):
+                parse_args(["--async", *option, "org"])
+
 
 class TestBackup:
     temp_dir = tempfile.TemporaryDirectory()
@@ -385,3 +401,331 @@ class TestBackup:
             "tests/resources/backup/repos/test/pulls/3/reviews/1/comments/1/user.json",
             f"{self.backup.output_dir}/repos/test/pulls/3/reviews/1/comments/1/user.json",
         )
+
+    def test_backup_issues_and_pulls(self):
+        os.makedirs(f"{self.backup.output_dir}/repos/test", exist_ok=True)
+        with requests_mock.Mocker() as m:
+            self.mock_github(m)
+            self.backup.backup_issues_and_pulls()
+        paths = [request.path for request in m.request_history]
+        assert paths.count("/repos/org/test/issues") == 1
+        assert paths.count("/repos/org/test/pulls") == 1
+        for path in [
+            "issues/1/issue.json",
+            "issues/1/comments/1/comment.json",
+            "pulls/3/pull.json",
+            "pulls/3/head.json",
+            "pulls/3/base.json",
+            "pulls/3/comments/3/comment.json",
+            "pulls/3/reviews/1/review.json",
+            "pulls/3/reviews/1/comments/1/comment.json",
+            "pulls/4/pull.json",
+        ]:
+            self.compare_json(
+                f"tests/resources/backup/repos/test/{path}",
+                f"{self.backup.output_dir}/repos/test/{path}",
+            )
+        assert not os.path.exists(f"{self.backup.output_dir}/repos/test/issues/3")
+        assert not os.path.exists(f"{self.backup.output_dir}/repos/test/pulls/1")
+
+    def test_skip_items_without_comments(self):
+        os.makedirs(f"{self.backup.output_dir}/repos/test", exist_ok=True)
+        with requests_mock.Mocker() as m:
+            self.mock_github(m)
+            m.get(
+                url="https://api.github.com/repos/org/test/issues?page=1",
+                request_headers=self.headers,
+                json=[self.issues[0], {**self.issues[1], "comments": 0}]
+                + [{**pull, "comments": 0} for pull in self.pulls],
+            )
+            self.backup.backup_issues_and_pulls()
+        paths = {request.path for request in m.request_history}
+        assert "/repos/org/test/issues/2/comments" not in paths
+        assert "/repos/org/test/issues/3/comments" not in paths
+        assert os.path.isdir(f"{self.backup.output_dir}/repos/test/issues/2/comments")
+        assert os.path.isdir(f"{self.backup.output_dir}/repos/test/pulls/3/comments")
+
+
+class TestBackupBulkComments(TestBackup):
+    temp_dir = tempfile.TemporaryDirectory()
+    backup = Backup("token", "org", temp_dir.name, ["test"], bulk_comments=True)
+
+    def mock_github(self, m):
+        issue_url = "https://api.github.com/repos/org/test/issues"
+        m.get(
+            url="https://api.github.com/repos/org/test/issues/comments",
+            request_headers=self.headers,
+            json=[
+                {**comment, "issue_url": f"{issue_url}/1"}
+                for comment in self.issues_comments
+            ]
+            + [
+                {**comment, "issue_url": f"{issue_url}/3"}
+                for comment in self.pulls_comments
+            ],
+        )
+        m.get(
+            url="https://api.github.com/repos/org/test/pulls/comments",
+            request_headers=self.headers,
+            json=[
+                {**comment, "pull_request_review_id": 1}
+                for comment in self.reviews_comments
+            ],
+        )
+        super().mock_github(m)
+
+    def test_no_per_item_comment_requests(self):
+        os.makedirs(f"{self.backup.output_dir}/repos/test", exist_ok=True)
+        with requests_mock.Mocker() as m:
+            self.mock_github(m)
+            self.backup.backup_issues()
+            self.backup.backup_pulls()
+        paths = {request.path for request in m.request_history}
+        assert {path for path in paths if path.endswith("/comments")} == {
+            "/repos/org/test/issues/comments",
+            "/repos/org/test/pulls/comments",
+        }
+
+
+class TestBackupIncremental:
+    temp_dir = tempfile.TemporaryDirectory()
+    backup = Backup("token", "org", temp_dir.name, ["test"], incremental=True)
+    headers = TestBackup.headers
+    issues = [
+        {**issue, "updated_at": f"2023-01-0{issue['number']}T00:00:00Z"}
+        for issue in TestBackup.issues
+    ]
+    pulls = [
+        {**pull, "updated_at": f"2023-01-0{pull['number']}T00:00:00Z"}
+        for pull in TestBackup.pulls
+    ]
+
+    def mock_github(self, m):
+        m.get(
+            url="https://api.github.com/repos/org/test/issues",
+            request_headers=self.headers,
+            json=self.issues,
+        )
+        m.get(
+            url="https://api.github.com/repos/org/test/pulls",
+            request_headers=self.headers,
+            json=sorted(self.pulls, key=lambda pull: pull["updated_at"], reverse=True),
+        )
+        m.get(
+            url=re.compile(
+                "https://api.github.com/repos/org/test/.*/(comments|reviews)"
+            ),
+            request_headers=self.headers,
+            json=[],
+        )
+
+    def checkpoint(self):
+        with open(f"{self.backup.output_dir}/repos/test/checkpoint.json") as file:
+            return json.load(file)
+
+    def test_issues_since(self):
+        os.makedirs(f"{self.backup.output_dir}/repos/test", exist_ok=True)
+        with requests_mock.Mocker() as m:
+            self.mock_github(m)
+            self.backup.backup_issues()
+            assert "since" not in m.request_history[0].qs
+            assert self.checkpoint()["issues"] == "2023-01-02T00:00:00Z"
+            issue_requests = len(m.request_history)
+            self.backup.backup_issues()
+            assert m.request_history[issue_requests].qs["since"] == [
+                "2023-01-02t00:00:00z"
+            ]
+
+    def test_pulls_since(self):
+        os.makedirs(f"{self.backup.output_dir}/repos/test", exist_ok=True)
+        with requests_mock.Mocker() as m:
+            self.mock_github(m)
+            self.backup.backup_pulls()
+            assert self.checkpoint()["pulls"] == "2023-01-04T00:00:00Z"
+            self.pulls[1]["updated_at"] = "2023-01-05T00:00:00Z"
+            pull_requests = len(m.request_history)
+            self.backup.backup_pulls()
+            paths = [request.path for request in m.request_history[pull_requests:]]
+            assert "/repos/org/test/pulls/4/reviews" in paths
+            assert "/repos/org/test/pulls/3/reviews" not in paths
+            assert self.checkpoint()["pulls"] == "2023-01-05T00:00:00Z"
+
+
+class TestBackupRepositories:
+    temp_dir = tempfile.TemporaryDirectory()
+    headers = TestBackup.headers
+    repo = {
+        "id": 1,
+        "name": "test",
+        "private": True,
+        "fork": False,
+        "default_branch": "main",
+        "visibility": "private",
+        "size": 10,
+        "pushed_at": "2023-01-01T00:00:00Z",
+    }
+
+    def prepare(self, backup):
+        repo_dir = f"{backup.output_dir}/repos/test"
+        os.makedirs(f"{repo_dir}/content/test.git", exist_ok=True)
+        with open(f"{repo_dir}/checkpoint.json", "w") as file:
+            json.dump({"pushed_at": "2023-01-01T00:00:00Z"}, file)
+
+    def test_skip_not_pushed(self):
+        backup = Backup("token", "org", self.temp_dir.name, ["test"])
+        self.prepare(backup)
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/repos/org/test",
+                request_headers=self.headers,
+                json=self.repo,
+            )
+            results = backup.backup_repositories()
+            assert m.call_count == 1
+        assert [(r.repository, r.success, r.skipped) for r in results] == [
+            ("test", True, True)
+        ]
+        with open(f"{backup.output_dir}/repos/test/repo.json") as file:
+            assert json.load(file)["default_branch"] == "main"
+
+    def test_force_fetch(self):
+        backup = Backup("token", "org", self.temp_dir.name, ["test"], force_fetch=True)
+        self.prepare(backup)
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/repos/org/test",
+                request_headers=self.headers,
+                json=self.repo,
+            )
+            with pytest.raises(subprocess.CalledProcessError):
+                backup.backup_repositories()
+
+
+class TestBackupResume:
+    headers = TestBackup.headers
+    page2 = "https://api.github.com/repos/org/test/issues?state=all&page=2"
+
+    def mock_github(self, m, page2):
+        m.get(
+            url="https://api.github.com/repos/org/test/issues?page=1",
+            request_headers=self.headers,
+            json=TestBackup.issues,
+            headers={"Link": f'<{self.page2}>; rel="next"'},
+        )
+        m.get(url=self.page2, request_headers=self.headers, **page2)
+        m.get(
+            url=re.compile("https://api.github.com/repos/org/test/issues/.*/comments"),
+            request_headers=self.headers,
+            json=[],
+        )
+
+    def test_resume_from_cursor(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            backup = Backup("token", "org", temp_dir, ["test"])
+            backup.api.retry_count = 0
+            os.makedirs(f"{backup.output_dir}/repos/test")
+            with requests_mock.Mocker() as m:
+                self.mock_github(m, {"status_code": 500})
+                with pytest.raises(Exception):
+                    backup.backup_issues()
+            backup.writer.close()
+            resumed = Backup("token", "org", temp_dir, ["test"], resume=True)
+            with requests_mock.Mocker() as m:
+                self.mock_github(m, {"json": []})
+                resumed.backup_issues()
+                assert m.request_history[0].url == self.page2
+            with requests_mock.Mocker() as m:
+                Backup("token", "org", temp_dir, ["test"], resume=True).backup_issues()
+                assert m.call_count == 0
+
+    def mock_items(self, m, page2):
+        m.get(
+            url="https://api.github.com/repos/org/test/issues?page=1",
+            request_headers=self.headers,
+            json=TestBackup.pulls,
+            headers={"Link": f'<{self.page2}>; rel="next"'},
+        )
+        m.get(url=self.page2, request_headers=self.headers, **page2)
+        m.get(
+            url="https://api.github.com/repos/org/test/pulls?page=1",
+            request_headers=self.headers,
+            json=TestBackup.pulls,
+        )
+        m.get(
+            url=re.compile("https://api.github.com/repos/org/test/(issues|pulls)/.+"),
+            request_headers=self.headers,
+            json=[],
+        )
+
+    def test_resume_shared_pass(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            backup = Backup("token", "org", temp_dir, ["test"])
+            backup.api.retry_count = 0
+            os.makedirs(f"{backup.output_dir}/repos/test")
+            with requests_mock.Mocker() as m:
+                self.mock_items(m, {"status_code": 500})
+                with pytest.raises(Exception):
+                    backup.backup_issues_and_pulls()
+            backup.writer.close()
+            resumed = Backup("token", "org", temp_dir, ["test"], resume=True)
+            with requests_mock.Mocker() as m:
+                self.mock_items(m, {"json": []})
+                resumed.backup_issues_and_pulls()
+                # The page of pulls was done before the failure
+                assert m.request_history[0].url == self.page2
+            resumed.writer.close()
+            for number in [3, 4]:
+                for name in ["pull.json", "head.json", "base.json"]:
+                    assert os.path.isfile(
+                        f"{backup.output_dir}/repos/test/pulls/{number}/{name}"
+                    )
+
+
+class Done:
+    def __init__(self):
+        self.items = []
+
+    def done(self, item):
+        self.items.append(item["number"])
+
+
+class TestPullListing:
+    def item(self, number, pull=True):
+        return {
+            "number": number,
+            "html_url": f"https://github.com/org/test/{'pull' if pull else 'issues'}/{number}",
+            "created_at": f"2023-01-01T00:{number:02d}:00Z",
+        }
+
+    def test_reads_only_as_far_as_needed(self):
+        read = []
+
+        def pulls():
+            for number in range(50, 0, -1):
+                if number % 3:
+                    read.append(number)
+                    yield self.item(number)
+
+        cursor = Done()
+        listing = PullListing(pulls(), "created_at", cursor)
+        items = [self.item(n, bool(n % 3)) for n in range(50, 0, -1)]
+        for item in listing.track(items):
+            if "pull" in item["html_url"]:
+                assert listing.find(item)["number"] == item["number"]
+                assert read[-1] == item["number"]
+                assert not listing.held
+
+    def test_missing_pull(self):
+        cursor = Done()
+        listing = PullListing(
+            iter([self.item(9), self.item(7), self.item(3), self.item(1)]),
+            "created_at",
+            cursor,
+        )
+        items = listing.track([self.item(8), self.item(3)])
+        # Pull 9 was listed before any item that needs it and is let go
+        assert listing.find(next(items)) is None
+        assert list(listing.held) == [7]
+        assert listing.find(next(items))["number"] == 3
+        assert cursor.items == [9, 7]
+        assert not listing.held
@@ -0,0 +1,70 @@
+import tempfile
+
+import requests
+
+from benchmarks import run
+from benchmarks.fake_github import FakeGithub, Organization
+
+
+class TestFakeGithub:
+    organization = Organization(repos=1, members=3, issues=5, pull_ratio=1.0)
+
+    def test_pages_and_links(self):
+        with FakeGithub(self.organization) as server:
+            url = f"{server.url}/repos/benchmark/repo0/pulls"
+            resp = requests.get(url, params={"per_page": 2})
+            assert [pull["number"] for pull in resp.json()] == [5, 4]
+            assert "page=2" in resp.links["next"]["url"]
+            assert "page=3" in resp.links["last"]["url"]
+            resp = requests.get(resp.links["last"]["url"])
+            assert [pull["number"] for pull in resp.json()] == [1]
+            assert "next" not in resp.links
+            assert server.stats()["endpoints"] == {"/repos/{owner}/{repo}/pulls": 2}
+
+    def test_conditional_request(self):
+        with FakeGithub(self.organization) as server:
+            url = f"{server.url}/orgs/benchmark/members"
+            etag = requests.get(url).headers["ETag"]
+            resp = requests.get(url, headers={"If-None-Match": etag})
+            assert resp.status_code == 304
+            assert server.stats()["statuses"] == {"200": 1, "304": 1}
+
+    def test_faults(self):
+        with FakeGithub(self.organization, error_rate=1.0) as server:
+            assert requests.get(f"{server.url}/rate_limit").status_code == 502
+        with FakeGithub(self.organization, secondary_rate=1.0) as server:
+            resp = requests.get(f"{server.url}/rate_limit")
+            assert resp.status_code == 403
+            assert resp.headers["Retry-After"] == "1"
+
+    def test_not_found(self):
+        with FakeGithub(self.organization) as server:
+            assert requests.get(f"{server.url}/repos/other/repo0").status_code == 404
+
+
+class TestBenchmark:
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            args = run.parse_args(
+                [
+                    "--repos=1",
+                    "--members=2",
+                    "--issues=4",
+                    "--commits=2",
+                    f"--work-dir={temp_dir}",
+                    "--",
+                    "--all",
+                ]
+            )
+            results = run.run(args)
+        result = results["runs"][0]
+        assert result["exit_code"] == 0
+        assert result["success"]
+        assert result["requests"] == sum(result["endpoints"].values())
+        assert result["endpoints"]["/orgs/{org}/members"] == 1
+        assert set(result["phases"]) == {"repositories", "members", "issues_pulls"}
+        assert result["items"]["repositories"] == 1
+        assert result["items"]["members"] == 2
+        assert result["files_written"] > 0
+        assert result["peak_rss_bytes"] > 0
+        assert "wall_seconds" in run.compare(results, results)
@@ -0,0 +1,36 @@
+import tempfile
+
+from backup_github.cache import ValidatorCache
+
+
+class TestValidatorCache:
+    def test_key(self):
+        assert ValidatorCache.key("url", {"a": 1, "b": 2}) == ValidatorCache.key(
+            "url", {"b": 2, "a": 1}
+        )
+        assert ValidatorCache.key("url") != ValidatorCache.key("url", {"a": 1})
+
+    def test_put_get(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ValidatorCache(tmp, 1024)
+            cache.put("abc", '"etag"', None, [{"id": 1}], "next", 10)
+            assert cache.get("abc") == {
+                "etag": '"etag"',
+                "last_modified": None,
+                "next": "next",
+                "size": 10,
+                "body": [{"id": 1}],
+            }
+            assert ValidatorCache(tmp, 1024).get("abc")["body"] == [{"id": 1}]
+            assert cache.get("missing") is None
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ValidatorCache(tmp, 300)
+            for key in ["aa", "bb", "cc"]:
+                cache.put(key, '"etag"', None, ["x" * 50], None, 50)
+                cache.get("aa")
+            assert cache.get("aa") is not None
+            assert cache.get("bb") is None
+            assert cache.get("cc") is not None
+            assert cache.size <= 300
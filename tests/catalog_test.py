@@ -0,0 +1,27 @@
+import requests_mock
+
+from backup_github.catalog import RepositoryCatalog
+from backup_github.github import GithubAPI
+
+
+class TestRepositoryCatalog:
+    gh = GithubAPI("test_token", "test", ".", 1, 1)
+    repos = [{"name": "one", "size": 1}, {"name": "two", "size": 0}]
+
+    def test_listing(self):
+        with requests_mock.Mocker() as m:
+            m.get(url="https://api.github.com/orgs/test/repos", json=self.repos)
+            catalog = RepositoryCatalog(self.gh)
+            assert list(catalog) == ["one", "two"]
+            assert catalog.get("two") == {"name": "two", "size": 0}
+            assert m.call_count == 1
+
+    def test_named_repositories(self):
+        with requests_mock.Mocker() as m:
+            m.get(url="https://api.github.com/repos/test/one", json=self.repos[0])
+            catalog = RepositoryCatalog(self.gh, ["one"])
+            assert m.call_count == 0
+            assert catalog.peek("one") is None
+            assert catalog.get("one") == self.repos[0]
+            assert catalog.get("one") == self.repos[0]
+            assert m.call_count == 1
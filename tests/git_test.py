@@ -0,0 +1,57 @@
+import os
+import subprocess
+import tempfile
+
+import pytest
+
+from backup_github import git
+
+
+class TestGit:
+    def make_origin(self, path):
+        subprocess.check_output(["git", "init", "-q", "-b", "main", path])
+        subprocess.check_output(
+            [
+                "git",
+                "-C",
+                path,
+                "-c",
+                "user.name=test",
+                "-c",
+                "user.email=test@example.com",
+                "commit",
+                "-q",
+                "--allow-empty",
+                "-m",
+                "init",
+            ]
+        )
+
+    def test_clone_and_fetch(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            self.make_origin(f"{tmp}/origin")
+            os.makedirs(f"{tmp}/content")
+            git.clone(f"file://{tmp}/origin", f"{tmp}/content/origin.git")
+            assert os.path.isfile(f"{tmp}/content/origin.git/HEAD")
+            git.fetch(f"{tmp}/content/origin.git")
+        assert os.getcwd() == cwd
+
+    def test_clone_fail(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with pytest.raises(subprocess.CalledProcessError):
+                git.clone(f"file://{tmp}/missing", f"{tmp}/content.git", 0)
+            assert not os.path.exists(f"{tmp}/content.git")
+
+    def test_refs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.make_origin(f"{tmp}/origin")
+            refs = git.refs(f"{tmp}/origin")
+            assert list(refs) == ["refs/heads/main"]
+            assert len(list(refs.values())[0]) == 40
+
+    def test_size(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            assert git.size(f"{tmp}/missing.git") == 0
+            self.make_origin(f"{tmp}/origin")
+            assert git.size(f"{tmp}/origin") > 0
@@ -1,10 +1,16 @@
+import tempfile
+import threading
 import time
 
 import pytest
 import requests
 import requests_mock
 
-from backup_github.github import GithubAPI
+from backup_github.cache import ValidatorCache
+from backup_github.github import GithubAPI, endpoint
+from backup_github.metrics import registry
+from backup_github.ratelimit import token_label
+from benchmarks.fake_github import FakeGithub, Organization
 
 
 class TestGithubApi:
@@ -80,6 +86,20 @@ class TestGithubApi:
                 self.gh.make_request("https://api.github.com/orgs/test/members") == []
             )
 
+    def test_client_error_is_retried_once(self):
+        gh = GithubAPI("test_token", "test", ".", 10, 0, retry_max_seconds=60)
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members",
+                request_headers=self.headers,
+                response_list=[self.message_fail] * 3 + [self.empty_ok],
+            )
+            started = time.perf_counter()
+            with pytest.raises(GithubAPI.ClientError):
+                gh.make_request("https://api.github.com/orgs/test/members")
+            assert m.call_count == 2
+            assert time.perf_counter() - started < 1
+
     def test_make_request_rate_limit_exceeded_ok(self):
         with requests_mock.Mocker() as m:
             m.get(
@@ -136,3 +156,290 @@ class TestGithubApi:
             )
             with pytest.raises(Exception):
                 self.gh.make_request("https://api.github.com/orgs/test/members")
+
+    def test_session_is_reused(self):
+        assert self.gh.session is self.gh.session
+        assert self.gh.session.get_adapter("https://api.github.com") is self.gh.adapter
+
+    def test_session_per_thread(self):
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(self.gh.session))
+        thread.start()
+        thread.join()
+        assert sessions[0] is not self.gh.session
+        assert sessions[0].get_adapter("https://api.github.com") is self.gh.adapter
+
+    def test_connection_stats(self):
+        assert self.gh.connection_stats() == {"opened": 0, "reused": 0}
+
+    def test_connections_are_reused(self):
+        with FakeGithub(Organization(members=3)) as server:
+            gh = GithubAPI("test_token", "benchmark", ".", 1, 0, api_url=server.url)
+            workers = [
+                threading.Thread(
+                    target=lambda: [list(gh.get_members()) for _ in range(5)]
+                )
+                for _ in range(3)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            stats = gh.connection_stats()
+            requests_made = server.stats()["total"]
+        assert requests_made == 15
+        assert stats["opened"] < requests_made
+        assert stats["reused"] > 0
+        assert stats["opened"] + stats["reused"] == requests_made
+
+    def test_make_request_follows_link_header(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members?page=1",
+                request_headers=self.headers,
+                json=[self.user],
+                headers={
+                    "Link": '<https://api.github.com/orgs/test/members?per_page=100&page=2>; rel="next"'
+                },
+            )
+            m.get(
+                url="https://api.github.com/orgs/test/members?page=2",
+                request_headers=self.headers,
+                json=[self.user],
+            )
+            assert self.gh.make_request("https://api.github.com/orgs/test/members") == [
+                self.user,
+                self.user,
+            ]
+            assert m.call_count == 2
+            assert m.request_history[1].qs == {"per_page": ["100"], "page": ["2"]}
+
+    def test_paginate_is_lazy(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members?page=1",
+                request_headers=self.headers,
+                json=[self.user],
+                headers={
+                    "Link": '<https://api.github.com/orgs/test/members?per_page=100&page=2>; rel="next"'
+                },
+            )
+            items = self.gh.paginate("https://api.github.com/orgs/test/members")
+            assert m.call_count == 0
+            assert next(items) == self.user
+            assert m.call_count == 1
+
+    def test_make_request_object(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test",
+                request_headers=self.headers,
+                json={"login": "test"},
+            )
+            assert self.gh.make_request("https://api.github.com/orgs/test") == {
+                "login": "test"
+            }
+            assert m.call_count == 1
+
+    def test_paginate_retries_only_failed_page(self):
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members?page=1",
+                request_headers=self.headers,
+                json=[self.user],
+                headers={
+                    "Link": '<https://api.github.com/orgs/test/members?per_page=100&page=2>; rel="next"'
+                },
+            )
+            m.get(
+                url="https://api.github.com/orgs/test/members?page=2",
+                request_headers=self.headers,
+                response_list=[
+                    {"status_code": 502, "content": b"Bad Gateway"},
+                    {"json": [self.user], "status_code": 200},
+                ],
+            )
+            assert list(
+                self.gh.paginate("https://api.github.com/orgs/test/members")
+            ) == [self.user, self.user]
+            assert [r.qs["page"] for r in m.request_history] == [["1"], ["2"], ["2"]]
+
+    def test_params_are_not_shared(self):
+        params = {"state": "all"}
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members",
+                request_headers=self.headers,
+                json=[],
+            )
+            self.gh.make_request("https://api.github.com/orgs/test/members", params)
+        assert params == {"state": "all"}
+
+    def test_backoff(self):
+        gh = GithubAPI("test_token", "test", ".", 5, 2, retry_max_seconds=10)
+        for attempt, cap in [(0, 2), (1, 4), (2, 8), (3, 10), (10, 10)]:
+            delay = gh.backoff(attempt)
+            assert cap / 2 <= delay <= cap
+
+    def test_make_request_not_modified(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            gh = GithubAPI(
+                "test_token", "test", ".", 1, 1, cache=ValidatorCache(tmp, 1024)
+            )
+            with requests_mock.Mocker() as m:
+                m.get(
+                    url="https://api.github.com/orgs/test/members",
+                    request_headers=self.headers,
+                    response_list=[
+                        {"json": [self.user], "headers": {"ETag": '"v1"'}},
+                        {"status_code": 304},
+                    ],
+                )
+                url = "https://api.github.com/orgs/test/members"
+                assert gh.make_request(url) == [self.user]
+                assert "If-None-Match" not in m.request_history[0].headers
+                assert gh.make_request(url) == [self.user]
+                assert m.request_history[1].headers["If-None-Match"] == '"v1"'
+
+    def test_make_request_primary_rate_limit(self):
+        gh = GithubAPI("test_token", "test", ".", 10, 0.4)
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members",
+                request_headers=self.headers,
+                response_list=[
+                    {
+                        "status_code": 403,
+                        "headers": {
+                            "X-RateLimit-Limit": "5000",
+                            "X-RateLimit-Remaining": "0",
+                            # A reset in the past, as with clock skew
+                            "X-RateLimit-Reset": str(int(time.time()) - 60),
+                        },
+                    },
+                    self.empty_ok,
+                ],
+            )
+            started = time.perf_counter()
+            assert gh.make_request("https://api.github.com/orgs/test/members") == []
+            assert time.perf_counter() - started >= 0.2
+            assert m.call_count == 2
+            assert not any(r.path == "/rate_limit" for r in m.request_history)
+
+    def test_make_request_forbidden_is_not_rate_limit(self):
+        gh = GithubAPI("test_token", "test", ".", 0, 1)
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/test/members",
+                request_headers=self.headers,
+                status_code=403,
+                headers={"X-RateLimit-Remaining": "4000"},
+                content=b'{"message": "Resource not accessible by integration"}',
+            )
+            with pytest.raises(Exception):
+                gh.make_request("https://api.github.com/orgs/test/members")
+            assert gh.limiter.delay() == 0
+
+    def test_endpoint(self):
+        for url, template in [
+            (
+                "https://api.github.com/repos/org/repo/issues/12/comments?page=2",
+                "/repos/{owner}/{repo}/issues/{id}/comments",
+            ),
+            (
+                "https://api.github.com/orgs/org/memberships/octocat",
+                "/orgs/{org}/memberships/{login}",
+            ),
+            ("https://api.github.com/rate_limit", "/rate_limit"),
+        ]:
+            assert endpoint(url) == template
+
+    def test_endpoint_of_enterprise_server(self):
+        gh = GithubAPI(
+            "test_token", "ghe", ".", 1, 0, api_url="https://ghe.example.com/api/v3/"
+        )
+        url = "https://ghe.example.com/api/v3/repos/acme/widget/issues/12/comments"
+        with requests_mock.Mocker() as m:
+            m.get(url=url, request_headers=self.headers, json=[])
+            gh.make_request(url)
+        labels = {
+            "organization": "ghe",
+            "endpoint": "/repos/{owner}/{repo}/issues/{id}/comments",
+        }
+        assert registry.get_sample_value("github_backup_http_pages_total", labels) == 1
+        assert endpoint("https://ghe.example.com/api/v3", "/api/v3") == "/"
+
+    def test_request_metrics(self):
+        gh = GithubAPI("test_token", "metrics", ".", 1, 0)
+        labels = {"organization": "metrics", "endpoint": "/orgs/{org}/members"}
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/metrics/members",
+                request_headers=self.headers,
+                response_list=[{"status_code": 500}, self.empty_ok],
+            )
+            gh.make_request("https://api.github.com/orgs/metrics/members")
+        assert registry.get_sample_value("github_backup_http_pages_total", labels) == 1
+        assert (
+            registry.get_sample_value(
+                "github_backup_http_request_duration_seconds_count",
+                {**labels, "status": "500"},
+            )
+            == 1
+        )
+        assert (
+            registry.get_sample_value(
+                "github_backup_http_retries_total",
+                {"organization": "metrics", "reason": "server_error"},
+            )
+            == 1
+        )
+
+    def test_token_pool(self):
+        gh = GithubAPI(["first", "second"], "pool", ".", 1, 0)
+        with requests_mock.Mocker() as m:
+            m.get(
+                url="https://api.github.com/orgs/pool/members",
+                request_headers={"Authorization": "Bearer first"},
+                headers={
+                    "X-RateLimit-Limit": "5000",
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": str(int(time.time()) + 3600),
+                },
+                status_code=403,
+            )
+            m.get(
+                url="https://api.github.com/orgs/pool/members",
+                request_headers={"Authorization": "Bearer second"},
+                headers={
+                    "X-RateLimit-Limit": "5000",
+                    "X-RateLimit-Remaining": "4000",
+                    "X-RateLimit-Reset": str(int(time.time()) + 3600),
+                },
+                json=[],
+            )
+            for _ in range(3):
+                assert gh.make_request("https://api.github.com/orgs/pool/members") == []
+        tokens = [r.headers["Authorization"] for r in m.request_history]
+        # The exhausted token is used once and then left out until its reset
+        assert tokens == ["Bearer first"] + ["Bearer second"] * 3
+        assert (
+            registry.get_sample_value(
+                "github_backup_token_rate_limit_remaining",
+                {"organization": "pool", "token": token_label("second")},
+            )
+            == 4000
+        )
+        assert (
+            registry.get_sample_value(
+                "github_backup_token_rate_limit_exceeded_total",
+                {"organization": "pool", "token": token_label("first")},
+            )
+            == 1
+        )
+        assert (
+            registry.get_sample_value(
+                "github_backup_rate_limit_remaining", {"organization": "pool"}
+            )
+            == 4000
+        )
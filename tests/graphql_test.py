@@ -0,0 +1,242 @@
+import filecmp
+import json
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests_mock
+
+from backup_github.backup import Backup
+from tests import backup_test
+
+REVIEW_COMMENTS = {"R1": backup_test.TestBackup.reviews_comments}
+REVIEWS = {"P3": backup_test.TestBackup.reviews}
+COMMENTS = {
+    "I1": backup_test.TestBackup.issues_comments,
+    "P3": backup_test.TestBackup.pulls_comments,
+}
+
+
+def connection(items, first, after=None):
+    start = int(after or 0)
+    end = start + first
+    return {
+        "pageInfo": {"hasNextPage": end < len(items), "endCursor": str(end)},
+        "nodes": items[start:end],
+    }
+
+
+def author(user):
+    # GraphQL names bots after their app, REST adds the [bot] suffix
+    if user.get("type") == "Bot":
+        return {"__typename": "Bot", "login": user["login"][: -len("[bot]")]}
+    return {"__typename": "User", **user}
+
+
+def comment_node(comment):
+    return {
+        "id": f"C{comment['id']}",
+        "databaseId": comment["id"],
+        "body": comment["body"],
+        "createdAt": comment["created_at"],
+        "author": author(comment["user"]),
+    }
+
+
+def review_comment_node(comment):
+    return {
+        **comment_node(comment),
+        "diffHunk": comment["diff_hunk"],
+        "path": comment["path"],
+        "position": comment["position"],
+        "originalPosition": comment["original_position"],
+        "commit": {"oid": comment["commit_id"]},
+        "originalCommit": {"oid": comment["original_commit_id"]},
+        "replyTo": {"databaseId": comment["in_reply_to_id"]},
+    }
+
+
+def review_node(review, nested):
+    node_id = f"R{review['id']}"
+    return {
+        "id": node_id,
+        "databaseId": review["id"],
+        "body": review["body"],
+        "state": review["state"],
+        "submittedAt": review["submitted_at"],
+        "commit": {"oid": review["commit_id"]},
+        "author": author(review["user"]),
+        "comments": connection(
+            [review_comment_node(c) for c in REVIEW_COMMENTS.get(node_id, [])], nested
+        ),
+    }
+
+
+def issue_node(issue, nested, prefix="I"):
+    node_id = f"{prefix}{issue['number']}"
+    return {
+        "id": node_id,
+        "number": issue["number"],
+        "title": issue["title"],
+        "body": issue["body"],
+        "createdAt": issue["created_at"],
+        "updatedAt": issue["created_at"],
+        "state": issue["state"].upper(),
+        "url": issue["html_url"],
+        "author": author(issue["user"]),
+        "assignees": {"nodes": [issue["assignee"]]},
+        "comments": connection(
+            [comment_node(c) for c in COMMENTS.get(node_id, [])], nested
+        ),
+    }
+
+
+def pull_node(pull, nested):
+    node_id = f"P{pull['number']}"
+    return {
+        **issue_node(pull, nested, "P"),
+        "mergeCommit": {"oid": pull["merge_commit_sha"]},
+        "headRefName": pull["head"]["ref"],
+        "headRefOid": pull["head"]["sha"],
+        "baseRefName": pull["base"]["ref"],
+        "baseRefOid": pull["base"]["sha"],
+        "reviews": connection(
+            [review_node(r, nested) for r in REVIEWS.get(node_id, [])], nested
+        ),
+    }
+
+
+def children(node_id, field, nested):
+    if field == "reviews":
+        return [review_node(r, nested) for r in REVIEWS.get(node_id, [])]
+    if node_id.startswith("R"):
+        return [review_comment_node(c) for c in REVIEW_COMMENTS.get(node_id, [])]
+    return [comment_node(c) for c in COMMENTS.get(node_id, [])]
+
+
+class GraphQLHandler(BaseHTTPRequestHandler):
+    queries = []
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.queries.append(request)
+        variables = request["variables"]
+        first = variables["first"]
+        nested = variables.get("nested", 100)
+        after = variables.get("after")
+        if request["operationName"] == "Issues":
+            nodes = [issue_node(i, nested) for i in backup_test.TestBackup.issues]
+            data = {"repository": {"issues": connection(nodes, first, after)}}
+        elif request["operationName"] == "PullRequests":
+            nodes = [pull_node(p, nested) for p in backup_test.TestBackup.pulls]
+            data = {"repository": {"pullRequests": connection(nodes, first, after)}}
+        else:
+            field = re.search(r"\.\.\. on \w+ \{\s*(\w+)\(", request["query"]).group(1)
+            items = children(variables["id"], field, nested)
+            data = {"node": {field: connection(items, first, after)}}
+        data["rateLimit"] = {"cost": first * 10, "remaining": 4000, "resetAt": None}
+        body = json.dumps({"data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def graphql_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GraphQLHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/graphql"
+    server.shutdown()
+
+
+def tree(path):
+    return sorted(
+        os.path.relpath(os.path.join(root, name), path)
+        for root, dirs, files in os.walk(path)
+        for name in dirs + files
+        if name != "checkpoint.json"
+    )
+
+
+class TestGraphQLBackend:
+    def backup_rest(self, output_dir):
+        backup = Backup("token", "org", output_dir, ["test"])
+        os.makedirs(f"{backup.output_dir}/repos/test")
+        with requests_mock.Mocker() as m:
+            backup_test.TestBackup.mock_github(backup_test.TestBackup(), m)
+            backup.backup_issues()
+            backup.backup_pulls()
+        return f"{backup.output_dir}/repos/test"
+
+    def backup_graphql(self, output_dir, graphql_url, bulk_comments=False):
+        backup = Backup(
+            "token",
+            "org",
+            output_dir,
+            ["test"],
+            backend="graphql",
+            bulk_comments=bulk_comments,
+        )
+        backup.api.graphql_url = graphql_url
+        backup.api.sizes = {"Issues": 1, "PullRequests": 1}
+        backup.api.nested_size = 1
+        os.makedirs(f"{backup.output_dir}/repos/test")
+        backup.backup_issues()
+        backup.backup_pulls()
+        return backup, f"{backup.output_dir}/repos/test"
+
+    def test_same_tree_as_rest(self, graphql_url):
+        with tempfile.TemporaryDirectory() as rest_dir:
+            with tempfile.TemporaryDirectory() as graphql_dir:
+                expected = self.backup_rest(rest_dir)
+                _, actual = self.backup_graphql(graphql_dir, graphql_url)
+                files = tree(expected)
+                assert "pulls/3/reviews/1/comments/1/comment.json" in files
+                assert tree(actual) == files
+                for path in files:
+                    if os.path.isfile(f"{expected}/{path}"):
+                        assert filecmp.cmp(
+                            f"{expected}/{path}", f"{actual}/{path}", shallow=False
+                        ), path
+
+    def test_bulk_comments_off(self, graphql_url):
+        with tempfile.TemporaryDirectory() as graphql_dir:
+            backup, actual = self.backup_graphql(graphql_dir, graphql_url, True)
+            assert not backup.bulk_comments
+            assert backup.api.stash == {}
+            assert os.path.isfile(f"{actual}/issues/1/comments/1/comment.json")
+
+    def test_bot_author(self, graphql_url, monkeypatch):
+        bot = {
+            "id": 9,
+            "body": "Bump a dependency",
+            "created_at": "2022-10-24T10:05:33Z",
+            "user": {"login": "dependabot[bot]", "type": "Bot"},
+        }
+        monkeypatch.setitem(COMMENTS, "I1", COMMENTS["I1"] + [bot])
+        with tempfile.TemporaryDirectory() as graphql_dir:
+            _, actual = self.backup_graphql(graphql_dir, graphql_url)
+            with open(f"{actual}/issues/1/comments/9/user.json") as file:
+                assert json.load(file) == {"login": "dependabot[bot]"}
+
+    def test_batch_size_follows_cost(self, graphql_url):
+        with tempfile.TemporaryDirectory() as graphql_dir:
+            backup, _ = self.backup_graphql(graphql_dir, graphql_url)
+            backup.api.sizes = {"Issues": 50, "PullRequests": 50}
+            list(backup.api.get_issues("test"))
+            assert backup.api.sizes["Issues"] == 1
+            GraphQLHandler.queries.clear()
+            list(backup.api.get_issues("test"))
+            issues = [
+                q for q in GraphQLHandler.queries if q["operationName"] == "Issues"
+            ]
+            assert [q["variables"]["first"] for q in issues] == [1, 1]
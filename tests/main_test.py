@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from backup_github import main
+from backup_github.backup import Backup
+from backup_github.github import SharedClient
+from backup_github.parse_args import parse_args, parse_config
+from benchmarks.fake_github import FakeGithub, Organization
+from benchmarks.remote import create_remotes
+
+
+class TestConfig:
+    def write(self, temp_dir, config):
+        with open(f"{temp_dir}/config.json", "w") as file:
+            json.dump(config, file)
+        return f"{temp_dir}/config.json"
+
+    def test_organization_or_config_required(self):
+        with pytest.raises(Exception):
+            parse_args([])
+        assert parse_args(["--config", "config.json"]).organization is None
+
+    def test_options(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write(
+                temp_dir,
+                {
+                    "token": "common",
+                    "metrics_path": "batch.prom",
+                    "all": True,
+                    "organizations": [
+                        "org1",
+                        {"organization": "org2", "token": "other", "workers": 2},
+                    ],
+                },
+            )
+            settings, organizations = parse_config(
+                path, parse_args(["--config", path, "--workers", "8"])
+            )
+        assert settings.metrics_path == "batch.prom"
+        assert [org.organization for org in organizations] == ["org1", "org2"]
+        assert [org.token for org in organizations] == ["common", "other"]
+        assert [org.workers for org in organizations] == [8, 2]
+        assert all(org.all for org in organizations)
+
+    def test_unknown_option(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write(
+                temp_dir, {"organizations": [{"organization": "a", "b": 1}]}
+            )
+            with pytest.raises(ValueError):
+                parse_config(path, parse_args(["--config", path]))
+
+    def test_batch_option_per_organization(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self.write(
+                temp_dir,
+                {"organizations": [{"organization": "a", "concurrency": 2}]},
+            )
+            with pytest.raises(ValueError):
+                parse_config(path, parse_args(["--config", path]))
+
+
+class TestSharedClient:
+    def test_shared_per_token(self):
+        shared = SharedClient(pool_size=4, concurrency=2)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first = Backup("token", "org1", temp_dir, [], shared=shared)
+            second = Backup("token", "org2", temp_dir, [], shared=shared)
+            other = Backup("other", "org3", temp_dir, [], shared=shared)
+        assert first.api.adapter is second.api.adapter is other.api.adapter
+        assert first.api.limiter is second.api.limiter
+        assert first.api.semaphore is second.api.semaphore
+        assert first.api.limiter is not other.api.limiter
+        assert first.api.semaphore is not other.api.semaphore
+
+    def test_pool_fits_requests_in_flight(self):
+        shared = SharedClient(pool_size=10, concurrency=8, parallel_organizations=4)
+        assert shared.adapter.poolmanager.connection_pool_kw["maxsize"] == 32
+
+
+class TestBatch:
+    def test_batch(self, monkeypatch):
+        first = Organization(name="org1", repos=1, members=2, issues=3, commits=1)
+        second = Organization(name="org2", repos=2, members=1, issues=2, commits=1)
+        with tempfile.TemporaryDirectory() as temp_dir, FakeGithub(
+            first
+        ) as first_server, FakeGithub(second) as second_server:
+            git_url = create_remotes(f"{temp_dir}/remotes", first)
+            create_remotes(f"{temp_dir}/remotes", second)
+            config = {
+                "output_dir": f"{temp_dir}/backup",
+                "metrics_path": f"{temp_dir}/metrics.prom",
+                "git_url": git_url,
+                "all": True,
+                "organizations": [
+                    {"organization": "org1", "api_url": first_server.url},
+                    {"organization": "org2", "api_url": second_server.url},
+                ],
+            }
+            with open(f"{temp_dir}/config.json", "w") as file:
+                json.dump(config, file)
+            monkeypatch.setattr(
+                "sys.argv", ["backup-github", "--config", f"{temp_dir}/config.json"]
+            )
+            main.main()
+            with open(f"{temp_dir}/metrics.prom") as file:
+                metrics = list(text_string_to_metric_families(file.read()))
+            assert sorted(os.listdir(f"{temp_dir}/backup/org2/repos")) == [
+                "repo0",
+                "repo1",
+            ]
+            assert sorted(os.listdir(f"{temp_dir}/backup/org1/members")) == [
+                "user0",
+                "user1",
+            ]
+        succeeded = {
+            sample.labels["organization"]: sample.value
+            for family in metrics
+            if family.name == "github_backup_success"
+            for sample in family.samples
+        }
+        assert succeeded == {"org1": 1, "org2": 1}
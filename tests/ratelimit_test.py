@@ -0,0 +1,154 @@
+import time
+
+import requests
+
+from backup_github.ratelimit import (
+    GRAPHQL,
+    PRIMARY,
+    SECONDARY,
+    RateLimiter,
+    TokenPool,
+    token_label,
+)
+
+
+def response(status_code, headers=None, content=b""):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    resp._content = content
+    return resp
+
+
+class TestRateLimiter:
+    def test_classify(self):
+        limiter = RateLimiter()
+        assert limiter.classify(response(200)) is None
+        assert (
+            limiter.classify(response(403, {"X-RateLimit-Remaining": "0"})) == PRIMARY
+        )
+        assert limiter.classify(response(403, {"Retry-After": "30"})) == SECONDARY
+        assert limiter.classify(response(429)) == SECONDARY
+        assert (
+            limiter.classify(
+                response(
+                    403,
+                    content=b'{"message": "You have exceeded a secondary rate limit"}',
+                )
+            )
+            == SECONDARY
+        )
+        assert limiter.classify(response(403, {"X-RateLimit-Remaining": "10"})) is None
+
+    def test_no_delay_with_budget(self):
+        limiter = RateLimiter()
+        limiter.update(
+            {
+                "X-RateLimit-Limit": "5000",
+                "X-RateLimit-Remaining": "4000",
+                "X-RateLimit-Reset": str(int(time.time()) + 3600),
+            }
+        )
+        assert limiter.delay() == 0
+
+    def test_pacing_with_low_budget(self):
+        limiter = RateLimiter(reserve=0)
+        limiter.update(
+            {
+                "X-RateLimit-Limit": "5000",
+                "X-RateLimit-Remaining": "100",
+                "X-RateLimit-Reset": str(int(time.time()) + 100),
+            }
+        )
+        first = limiter.delay()
+        second = limiter.delay()
+        assert first < 0.1
+        assert 0.5 < second - first < 1.5
+
+    def test_exhausted_budget_waits_for_reset(self):
+        limiter = RateLimiter()
+        reset = int(time.time()) + 60
+        limiter.update(
+            {
+                "X-RateLimit-Limit": "5000",
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": str(reset),
+            }
+        )
+        limiter.exceeded(PRIMARY)
+        assert 59 < limiter.delay() <= 62
+
+    def test_stale_reset_waits_for_backoff(self):
+        limiter = RateLimiter()
+        limiter.update(budget(0, int(time.time()) - 60))
+        limiter.exceeded(PRIMARY, 0, 5)
+        assert 4 < limiter.delay() <= 5
+
+    def test_retry_after(self):
+        limiter = RateLimiter()
+        limiter.update({"Retry-After": "30"})
+        assert 29 < limiter.delay() <= 30
+
+    def test_secondary_without_retry_after(self):
+        limiter = RateLimiter(secondary_seconds=10)
+        limiter.exceeded(SECONDARY, 1)
+        assert 19 < limiter.delay() <= 20
+
+
+def budget(remaining, reset=None):
+    return {
+        "X-RateLimit-Limit": "5000",
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset or int(time.time()) + 3600),
+    }
+
+
+class TestTokenPool:
+    def test_most_headroom(self):
+        pool = TokenPool(["a", "b", "c"])
+        pool.limiters["a"].update(budget(100))
+        pool.limiters["b"].update(budget(4000))
+        pool.limiters["c"].update(budget(3000))
+        assert pool.pick() == "b"
+        assert pool.remaining() == 7100
+
+    def test_unused_token_first(self):
+        pool = TokenPool(["a", "b"])
+        pool.limiters["a"].update(budget(4999))
+        assert pool.pick() == "b"
+
+    def test_in_flight_requests_spread(self):
+        pool = TokenPool(["a", "b"])
+        with pool.use() as (first, _):
+            with pool.use() as (second, _):
+                assert {first, second} == {"a", "b"}
+
+    def test_exhausted_token_out_of_rotation(self):
+        pool = TokenPool(["a", "b"])
+        pool.limiters["a"].update(budget(4000))
+        pool.limiters["b"].update(budget(100))
+        pool.limiters["a"].exceeded(SECONDARY)
+        assert pool.pick() == "b"
+        pool.limiters["b"].update(budget(0, int(time.time()) + 10))
+        pool.limiters["b"].exceeded(PRIMARY)
+        # Both are exhausted, the one that is available first is used
+        assert pool.pick() == "b"
+
+    def test_budget_per_resource(self):
+        pool = TokenPool(["a", "b"])
+        pool.limiters["a"].update(budget(4000))
+        pool.limiters["b"].update(budget(100))
+        pool.limiters["a"].update({**budget(10), "X-RateLimit-Resource": GRAPHQL})
+        pool.limiters["b"].update({**budget(3000), "X-RateLimit-Resource": GRAPHQL})
+        assert pool.remaining() == 4100
+        assert pool.remaining(GRAPHQL) == 3010
+        assert pool.pick() == "a"
+        assert pool.pick(GRAPHQL) == "b"
+        with pool.use(GRAPHQL) as (token, limiter):
+            assert limiter is pool.limiter(token, GRAPHQL)
+            assert limiter.remaining == 3000
+
+    def test_token_label(self):
+        assert token_label("secret") == token_label("secret")
+        assert token_label("secret") != token_label("other")
+        assert "secret" not in token_label("secret")
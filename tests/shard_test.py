@@ -0,0 +1,234 @@
+import json
+import os
+import tempfile
+from collections import Counter
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from backup_github import main
+from backup_github.merge import merge, merge_metrics, merge_state
+from backup_github.parse_args import parse_args
+from backup_github.shard import Shard, assign
+from benchmarks.fake_github import FakeGithub, Organization
+from benchmarks.remote import create_remotes
+
+SHARD_1 = """# HELP github_backup_success 1 if backup is okay
+# TYPE github_backup_success gauge
+github_backup_success{organization="org"} 1.0
+# HELP github_backup_duration_seconds duration of last backup in seconds
+# TYPE github_backup_duration_seconds gauge
+github_backup_duration_seconds{organization="org"} 10.0
+# HELP github_backup_git_size_bytes Total size of git data
+# TYPE github_backup_git_size_bytes gauge
+github_backup_git_size_bytes{organization="org"} 100.0
+# HELP github_backup_items_written_total count of backed up items by resource type
+# TYPE github_backup_items_written_total counter
+github_backup_items_written_total{organization="org",resource="issues"} 3.0
+github_backup_items_written_created{organization="org",resource="issues"} 20.0
+# HELP github_backup_shard number of shards
+# TYPE github_backup_shard gauge
+github_backup_shard{organization="org",shard="1/2"} 2.0
+"""
+SHARD_2 = """# HELP github_backup_success 1 if backup is okay
+# TYPE github_backup_success gauge
+github_backup_success{organization="org"} 1.0
+# HELP github_backup_duration_seconds duration of last backup in seconds
+# TYPE github_backup_duration_seconds gauge
+github_backup_duration_seconds{organization="org"} 30.0
+# HELP github_backup_git_size_bytes Total size of git data
+# TYPE github_backup_git_size_bytes gauge
+github_backup_git_size_bytes{organization="org"} 50.0
+# HELP github_backup_items_written_total count of backed up items by resource type
+# TYPE github_backup_items_written_total counter
+github_backup_items_written_total{organization="org",resource="issues"} 4.0
+github_backup_items_written_created{organization="org",resource="issues"} 10.0
+# HELP github_backup_shard number of shards
+# TYPE github_backup_shard gauge
+github_backup_shard{organization="org",shard="2/2"} 2.0
+"""
+
+
+def samples(path):
+    with open(path) as file:
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(file.read())
+            for sample in family.samples
+        }
+
+
+def write_ledger(path, sizes, complete=True):
+    with open(path, "w") as file:
+        json.dump({"complete": complete, "sizes": sizes}, file)
+
+
+class TestShard:
+    def test_parse(self):
+        shard = parse_args(["org", "--shard", "2/4"]).shard
+        assert (shard.index, shard.count) == (2, 4)
+        assert str(shard) == "2/4"
+        assert not shard.primary
+        for value in ["0/4", "5/4", "1", "a/b"]:
+            with pytest.raises(Exception):
+                parse_args(["org", "--shard", value])
+
+    def test_path(self):
+        shard = Shard(1, 3)
+        assert shard.path("/b/org/journal.json") == "/b/org/journal.shard-1-of-3.json"
+        assert shard.path("/b/org/.cache/http") == "/b/org/.cache/http.shard-1-of-3"
+
+    def test_select_is_disjoint_and_complete(self):
+        names = [f"repo{index}" for index in range(50)]
+        selected = [Shard(index, 3).select(names) for index in range(1, 4)]
+        assert sorted(sum(selected, [])) == sorted(names)
+        assert Shard(2, 3).select(list(reversed(names))) == list(reversed(selected[1]))
+
+    def test_assign_is_stable(self):
+        names = [f"repo{index}" for index in range(1000)]
+        before = {name: assign(name, 4) for name in names}
+        # Other repositories never decide where one goes
+        assert Shard(1, 4).select(names[:10]) == [
+            name for name in names[:10] if before[name] == 1
+        ]
+        # A fifth shard only takes repositories over from the others
+        moved = [name for name in names if assign(name, 5) != before[name]]
+        assert all(assign(name, 5) == 5 for name in moved)
+        assert 100 < len(moved) < 300
+
+    def test_assign_is_balanced(self):
+        counts = Counter(assign(f"repo{index}", 4) for index in range(4000))
+        assert all(800 < count < 1200 for count in counts.values())
+
+
+class TestMerge:
+    def test_merge_metrics(self):
+        families = merge_metrics([SHARD_1, SHARD_2])
+        values = {
+            sample.name: sample.value
+            for family in families.values()
+            for sample in family.samples
+            if "shard" not in sample.labels
+        }
+        assert values["github_backup_success"] == 1
+        assert values["github_backup_duration_seconds"] == 30
+        assert values["github_backup_git_size_bytes"] == 150
+        assert values["github_backup_items_written_total"] == 7
+        assert values["github_backup_items_written_created"] == 10
+
+    def test_merge_state(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write_ledger(f"{temp_dir}/sizes.shard-1-of-2.json", {"repos/a": {"git": 1}})
+            write_ledger(f"{temp_dir}/sizes.shard-2-of-2.json", {"repos/b": {"git": 2}})
+            with open(f"{temp_dir}/users.shard-2-of-2.json", "w") as file:
+                json.dump({"bob": {"id": 2, "login": "bob"}}, file)
+            with open(f"{temp_dir}/users.json", "w") as file:
+                json.dump({"amy": {"id": 1, "login": "amy"}}, file)
+            assert merge_state(temp_dir, 2) == []
+            with open(f"{temp_dir}/sizes.json") as file:
+                assert json.load(file) == {
+                    "complete": True,
+                    "sizes": {"repos/a": {"git": 1}, "repos/b": {"git": 2}},
+                }
+            with open(f"{temp_dir}/users.json") as file:
+                assert list(json.load(file)) == ["amy", "bob"]
+
+    def test_repository_of_no_shard(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for index, listed, taken in [(1, ["a", "b"], ["a"]), (2, ["a", "c"], [])]:
+                write_ledger(f"{temp_dir}/sizes.shard-{index}-of-2.json", {})
+                with open(
+                    f"{temp_dir}/repositories.shard-{index}-of-2.json", "w"
+                ) as file:
+                    json.dump({"listed": listed, "repositories": taken}, file)
+            assert merge_state(temp_dir, 2) == [
+                "repositories backed up by no shard: ['b', 'c']"
+            ]
+
+    def test_unfinished_shard(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            write_ledger(f"{temp_dir}/sizes.shard-1-of-2.json", {})
+            with open(f"{temp_dir}/journal.shard-1-of-2.json", "w") as file:
+                json.dump({}, file)
+            assert merge_state(temp_dir, 2) == [
+                "shard 1/2 did not finish",
+                "shard 2/2 did not run",
+            ]
+
+    def test_missing_metrics_fail_the_run(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(f"{temp_dir}/org")
+            for index in [1, 2]:
+                write_ledger(f"{temp_dir}/org/sizes.shard-{index}-of-2.json", {})
+            with open(f"{temp_dir}/1.prom", "w") as file:
+                file.write(SHARD_1)
+            failed = merge(
+                ["org"], temp_dir, 2, [f"{temp_dir}/1.prom"], f"{temp_dir}/all.prom"
+            )
+            assert failed == ["org"]
+            metrics = samples(f"{temp_dir}/all.prom")
+        assert metrics[("github_backup_success", (("organization", "org"),))] == 0
+
+
+class TestShardedBackup:
+    def test_shards_cover_the_organization(self, monkeypatch):
+        organization = Organization(name="org", repos=5, members=2, issues=2, commits=1)
+        with tempfile.TemporaryDirectory() as temp_dir, FakeGithub(
+            organization
+        ) as server:
+            git_url = create_remotes(f"{temp_dir}/remotes", organization)
+            for index in [1, 2]:
+                monkeypatch.setattr(
+                    "sys.argv",
+                    [
+                        "backup-github",
+                        "org",
+                        "--all",
+                        "--dedup-users",
+                        "--shard",
+                        f"{index}/2",
+                        "-o",
+                        f"{temp_dir}/backup",
+                        "--metrics_path",
+                        f"{temp_dir}/{index}.prom",
+                        "--api-url",
+                        server.url,
+                        "--git-url",
+                        git_url,
+                    ],
+                )
+                main.main()
+            org_dir = f"{temp_dir}/backup/org"
+            shards = [
+                json.load(open(f"{org_dir}/sizes.shard-{index}-of-2.json"))["sizes"]
+                for index in [1, 2]
+            ]
+            monkeypatch.setattr(
+                "sys.argv",
+                [
+                    "backup-github-merge",
+                    "org",
+                    "--shards",
+                    "2",
+                    "-o",
+                    f"{temp_dir}/backup",
+                    "--metrics",
+                    f"{temp_dir}/1.prom",
+                    f"{temp_dir}/2.prom",
+                    "--metrics_path",
+                    f"{temp_dir}/all.prom",
+                ],
+            )
+            main.merge_shards()
+            assert sorted(os.listdir(f"{org_dir}/repos")) == [
+                f"repo{index}" for index in range(5)
+            ]
+            assert sorted(os.listdir(f"{org_dir}/members")) == ["user0", "user1"]
+            with open(f"{org_dir}/sizes.json") as file:
+                sizes = json.load(file)
+            metrics = samples(f"{temp_dir}/all.prom")
+        assert "members" in shards[0] and "members" not in shards[1]
+        assert not set(shards[0]) & set(shards[1])
+        assert sizes["complete"]
+        assert len([key for key in sizes["sizes"] if key.startswith("repos/")]) == 5
+        assert metrics[("github_backup_success", (("organization", "org"),))] == 1
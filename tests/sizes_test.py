@@ -0,0 +1,61 @@
+import os
+import tempfile
+from pathlib import Path
+
+from backup_github.sizes import SizeLedger
+
+
+def count_sizes(org_dir):
+    git = sum(
+        p.stat().st_size
+        for content in Path(f"{org_dir}/repos").glob("*/content")
+        for p in content.rglob("*")
+    )
+    meta = sum(
+        p.stat().st_size for p in Path(org_dir).rglob("*") if p.name != "sizes.json"
+    )
+    meta -= git
+    return {"git": git, "meta": meta}
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write("x" * size)
+
+
+class TestSizeLedger:
+    def prepare(self, org_dir):
+        write(f"{org_dir}/repos/test/content/test.git/HEAD", 100)
+        write(f"{org_dir}/repos/test/issues/1/issue.json", 10)
+        write(f"{org_dir}/repos/other/repo.json", 20)
+        write(f"{org_dir}/members/user1/member.json", 30)
+
+    def test_totals_match_full_scan(self):
+        with tempfile.TemporaryDirectory() as org_dir:
+            self.prepare(org_dir)
+            ledger = SizeLedger(org_dir)
+            totals = ledger.totals()
+            assert totals == count_sizes(org_dir)
+
+    def test_only_touched_entries_are_measured(self):
+        with tempfile.TemporaryDirectory() as org_dir:
+            self.prepare(org_dir)
+            first = SizeLedger(org_dir).totals()
+            ledger = SizeLedger(org_dir)
+            write(f"{org_dir}/repos/test/content/test.git/HEAD", 1000)
+            write(f"{org_dir}/repos/other/repo.json", 200)
+            ledger.touch(f"{org_dir}/repos/other/repo.json")
+            totals = ledger.totals()
+            assert totals["git"] == first["git"]
+            assert totals["meta"] == first["meta"] + 180
+            ledger.touch(f"{org_dir}/repos/test/content/test.git", "git")
+            assert ledger.totals() == count_sizes(org_dir)
+
+    def test_unfinished_run_is_measured_again(self):
+        with tempfile.TemporaryDirectory() as org_dir:
+            self.prepare(org_dir)
+            SizeLedger(org_dir).totals()
+            SizeLedger(org_dir)
+            write(f"{org_dir}/repos/test/content/test.git/HEAD", 1000)
+            assert SizeLedger(org_dir).totals() == count_sizes(org_dir)
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+
+from backup_github.state import Journal
+
+
+class TestJournal:
+    def test_fresh_run_ignores_previous_progress(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = f"{temp_dir}/journal.json"
+            Journal(path).complete("issues", "test")
+            assert Journal(path, resume=True).done("issues", "test")
+            assert not Journal(path).done("issues", "test")
+
+    def test_finish_removes_journal(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = f"{temp_dir}/journal.json"
+            journal = Journal(path)
+            journal.complete("members")
+            assert os.path.exists(path)
+            journal.finish()
+            assert not os.path.exists(path)
+
+
+class TestCursor:
+    def cursors(self, path):
+        with open(path) as file:
+            return json.load(file).get("cursors", {})
+
+    def test_cursor_waits_for_unsaved_items(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = f"{temp_dir}/journal.json"
+            cursor = Journal(path).cursor("issues", "test")
+
+            def pages():
+                for position, page in [(None, [1, 2]), ("page2", [3]), ("page3", [4])]:
+                    cursor.page(position)
+                    yield from [{"number": number} for number in page]
+
+            items = list(cursor.track(pages()))
+            cursor.done(items[1])
+            cursor.done(items[2])
+            assert not os.path.exists(path)
+            cursor.done(items[0])
+            assert self.cursors(path) == {"issues/test": "page3"}
+            assert Journal(path, resume=True).cursor("issues", "test").start == "page3"
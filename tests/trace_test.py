@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+import requests_mock
+
+from backup_github import trace
+from backup_github.backup import Backup
+from tests import backup_test
+
+
+class TestTrace:
+    def test_disabled_by_default(self):
+        assert isinstance(trace.tracer, trace.NullTracer)
+        with trace.span("name", "category") as span:
+            span.set(key="value")
+
+    def test_backup_spans(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace.start(f"{temp_dir}/trace.json")
+            try:
+                backup = Backup("token", "org", temp_dir, ["test"])
+                os.makedirs(f"{backup.output_dir}/repos/test")
+                with requests_mock.Mocker() as m:
+                    backup_test.TestBackup.mock_github(backup_test.TestBackup(), m)
+                    backup.backup_issues()
+                backup.writer.close()
+            finally:
+                trace.stop()
+            events = trace.load(f"{temp_dir}/trace.json")
+        spans = {(event["cat"], event["name"]) for event in events}
+        assert ("phase", "issues") in spans
+        assert ("repository", "test") in spans
+        assert ("page", "/repos/{owner}/{repo}/issues") in spans
+        http = [
+            event
+            for event in events
+            if event["name"] == "/repos/{owner}/{repo}/issues/{id}/comments"
+        ]
+        assert http and http[0]["args"]["status"] == 200
+        assert "bytes" in http[0]["args"]
+        summary = trace.summarize(events)
+        assert "/repos/{owner}/{repo}/issues" in summary
+
+    def test_load_unterminated_trace(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tracer = trace.Tracer(f"{temp_dir}/trace.json", flush_size=1)
+            tracer.complete("name", "category", tracer.origin, 1)
+            tracer.complete("name", "category", tracer.origin, 2)
+            assert len(trace.load(f"{temp_dir}/trace.json")) == 2
+            tracer.close()
+            assert len(trace.load(f"{temp_dir}/trace.json")) == 2
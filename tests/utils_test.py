@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from backup_github.utils import run_parallel
+
+
+class TestRunParallel:
+    def test_all_items_processed(self):
+        seen = []
+        lock = threading.Lock()
+
+        def func(item):
+            with lock:
+                seen.append(item)
+
+        run_parallel(func, iter(range(100)), 4)
+        assert sorted(seen) == list(range(100))
+
+    def test_error_is_raised(self):
+        def func(item):
+            if item == 3:
+                raise ValueError(item)
+
+        with pytest.raises(ValueError):
+            run_parallel(func, range(10), 2)
+
+    def test_items_are_consumed_lazily(self):
+        consumed = []
+        release = threading.Event()
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        def func(item):
+            release.wait(1)
+
+        thread = threading.Thread(target=run_parallel, args=(func, items(), 2))
+        thread.start()
+        thread.join(0.2)
+        assert len(consumed) <= 5
+        release.set()
+        thread.join()
+        assert len(consumed) == 100
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from backup_github.writer import QueuedWriter, TreeWriter, UserStore
+
+
+class TestQueuedWriter:
+    issue = {
+        "title": "title",
+        "body": "body",
+        "created_at": "2023-01-01T00:00:00Z",
+        "state": "open",
+        "assignee": None,
+        "user": {"login": "user1"},
+    }
+
+    def test_same_files_as_tree_writer(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            TreeWriter().save_issue(self.issue, f"{temp_dir}/sync/1")
+            writer = QueuedWriter()
+            writer.save_issue(self.issue, f"{temp_dir}/queued/1")
+            writer.close()
+            for name in ["issue.json", "assignee.json", "user.json"]:
+                with open(f"{temp_dir}/sync/1/{name}") as expected:
+                    with open(f"{temp_dir}/queued/1/{name}") as actual:
+                        assert json.load(expected) == json.load(actual)
+            assert os.path.isdir(f"{temp_dir}/queued/1/comments")
+
+    def test_layout_does_not_depend_on_orjson(self):
+        issue = {**self.issue, "title": "Grüße"}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            TreeWriter().save_issue(issue, f"{temp_dir}/1")
+            with open(f"{temp_dir}/1/issue.json", "rb") as file:
+                assert (
+                    file.read()
+                    == json.dumps(
+                        {
+                            key: issue[key]
+                            for key in ["title", "body", "created_at", "state"]
+                        },
+                        indent=4,
+                    ).encode()
+                )
+
+    def test_records_are_written_in_order(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            writer = QueuedWriter(queue_size=1, batch_size=2)
+            for value in range(100):
+                writer.write([(f"{temp_dir}/state.json", value)], atomic=True)
+            writer.flush()
+            with open(f"{temp_dir}/state.json") as file:
+                assert json.load(file) == 99
+            writer.close()
+
+    def test_error_is_raised_on_flush(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(f"{temp_dir}/file", "w"):
+                pass
+            writer = QueuedWriter()
+            writer.write([(f"{temp_dir}/file/issue.json", {})])
+            with pytest.raises(OSError):
+                writer.flush()
+            with pytest.raises(OSError):
+                writer.close()
+
+
+class TestUserStore:
+    def test_records_reference_users(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            users = UserStore(f"{temp_dir}/users.json")
+            users.seed([{"id": 1, "login": "user1"}])
+            writer = TreeWriter(users)
+            writer.save_issue(TestQueuedWriter.issue, f"{temp_dir}/1")
+            writer.save_comments(
+                [{"id": 2, "body": "", "user": {"login": "user2"}}], f"{temp_dir}/1"
+            )
+            writer.flush()
+            assert sorted(os.listdir(f"{temp_dir}/1")) == ["comments", "issue.json"]
+            with open(f"{temp_dir}/1/issue.json") as file:
+                issue = json.load(file)
+            assert (issue["user"], issue["assignee"]) == ("user1", None)
+            with open(f"{temp_dir}/1/comments/2/comment.json") as file:
+                assert json.load(file)["user"] == "user2"
+            with open(f"{temp_dir}/users.json") as file:
+                assert json.load(file) == {
+                    "user1": {"id": 1, "login": "user1"},
+                    "user2": {"id": None, "login": "user2"},
+                }
+
+    def test_known_user_keeps_id(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            users = UserStore(f"{temp_dir}/users.json")
+            users.ref({"id": 1, "login": "user1"})
+            users.save(TreeWriter())
+            users = UserStore(f"{temp_dir}/users.json")
+            assert users.ref({"login": "user1"}) == "user1"
+            assert not users.dirty
+            assert users.users["user1"]["id"] == 1